@@ -1,8 +1,88 @@
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
 
-from core.routers import core_router
+from fastapi import FastAPI, Request
+
+from core.routers import core_router, metrics_router
 from core.config import settings
+from core.service import executor, metrics
+from core.service.connections import connection_monitor
+from core.service.executor import run_slow
+from core.service.instances import instance_manager
+from core.service.jobs import job_manager
+from core.service.keypool import key_pool
+from core.service.management import management_client
+from core.service.metrics import REQUEST_DURATION, REQUEST_ERRORS
+from core.service.quota import quota_engine
+from core.service.registry import registry
+from core.service.reload import reload_scheduler
+from core.service.sysmetrics import system_sampler
+from core.service.traffic import traffic
+from core.service.user_managment import shutdown_keygen_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry.rebuild()
+    metrics.start_http_server(settings.metrics_host, settings.metrics_port)
+    key_pool.start()
+    system_sampler.start()
+    await run_slow(instance_manager.provision)
+    await management_client.start()
+    await job_manager.start()
+    await connection_monitor.start()
+    await traffic.start()
+    await quota_engine.start()
+    yield
+    await quota_engine.stop()
+    await traffic.stop()
+    await connection_monitor.stop()
+    await job_manager.stop()
+    await management_client.stop()
+    key_pool.stop()
+    system_sampler.stop()
+    reload_scheduler.flush()
+    executor.shutdown()
+    shutdown_keygen_pool()
+    metrics.stop_http_server()
 
-api = FastAPI(title="OV Node", docs_url="/doc" if settings.doc else None)
+
+api = FastAPI(
+    title="OV Node", docs_url="/doc" if settings.doc else None, lifespan=lifespan
+)
 
 api.include_router(core_router)
+api.include_router(metrics_router)
+
+
+@api.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        REQUEST_ERRORS.labels(_route_of(request)).inc()
+        raise
+    route = _route_of(request)
+    REQUEST_DURATION.labels(_method_of(request), route, response.status_code).observe(
+        time.perf_counter() - start
+    )
+    if response.status_code >= 500:
+        REQUEST_ERRORS.labels(route).inc()
+    return response
+
+
+# Label values come from the client before authentication, so every label
+# is mapped onto a fixed set: a scanner must not be able to create series.
+_METHODS = {"GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"}
+
+
+def _method_of(request: Request) -> str:
+    return request.method if request.method in _METHODS else "other"
+
+
+def _route_of(request: Request) -> str:
+    """The route template, so /download/ovpn/{client_name} is one series"""
+    route = request.scope.get("route")
+    path = getattr(route, "path", None)
+    return path if isinstance(path, str) else "unmatched"
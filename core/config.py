@@ -6,7 +6,48 @@ class Settings(BaseSettings):
     service_port: int = 9090
     api_key: str
     debug: str = "WARNING"
+    log_json: bool = False
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_rotate_when: str = ""
+    log_backups: int = 5
+    log_queue_size: int = 10000
+    log_rate_window: float = 60.0
+    log_rate_burst: int = 10
     doc: bool = False
+    native_pki: bool = True
+    keypool_low: int = 20
+    keypool_high: int = 100
+    keypool_idle_load: float = 0.75
+    keypool_check_interval: float = 30.0
+    management_address: str = "/etc/openvpn/server/management.sock"
+    # 0 runs one OpenVPN instance per CPU core
+    openvpn_instances: int = 1
+    reload_window: float = 2.0
+    slow_workers: int = 4
+    fast_workers: int = 16
+    job_workers: int = 4
+    job_history: int = 1000
+    job_ttl: float = 3600.0
+    idempotency_window: float = 600.0
+    idempotency_max: int = 10000
+    profile_cache_bytes: int = 64 * 1024 * 1024
+    connections_interval: float = 5.0
+    status_file: str = "/etc/openvpn/server/openvpn-status.log"
+    traffic_interval: float = 60.0
+    traffic_save_interval: float = 300.0
+    traffic_minutes: int = 60
+    traffic_hours: int = 48
+    traffic_days: int = 90
+    quota_interval: float = 5.0
+    quota_events_max: int = 10000
+    change_journal_max: int = 100000
+    sampler_interval: float = 5.0
+    tun_interface: str = "tun0"
+    metrics_port: int = 0
+    metrics_host: str = "127.0.0.1"
+    trace_log: bool = False
+    trace_history: int = 2000
+    profile_interval: float = 0.01
 
     class Config:
         env_file = os.path.join(os.path.dirname(__file__), "../.env")
@@ -1,21 +1,170 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
 
 from core.config import settings
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_FILE = os.path.join(os.path.dirname(BASE_DIR), "data", "app.log")
+DATE_FORMAT = "%Y-%m-%d %H:%M"
 
 os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
 
-logging.basicConfig(
-    filename=LOG_FILE,
-    encoding="utf-8",
-    filemode="a",
-    format="{asctime} - {levelname} - {message}",
-    style="{",
-    datefmt="%Y-%m-%d %H:%M",
-    level=settings.debug,
-)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most burst records per message template and window.
+
+    Only WARNING and above are limited. The key is the unformatted message,
+    so "Invalid API key: [%.64s]" is one key whatever the key was. Suppressed
+    records are counted and reported by flush() in a single summary line.
+    """
+
+    def __init__(self, window: float, burst: int):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = threading.Lock()
+        # key -> [window start, records seen, level, logger name]
+        self._seen: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or record.name == "AppLogger.summary":
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if entry is not None and entry[1] > self.burst:
+                    self._report(key, entry)
+                self._seen[key] = [now, 1, record.levelno, record.name]
+                return True
+            entry[1] += 1
+            return entry[1] <= self.burst
+
+    def flush(self, everything: bool = False) -> None:
+        """Summarize the windows that have closed, or all of them at shutdown"""
+        now = time.monotonic()
+        with self._lock:
+            for key, entry in list(self._seen.items()):
+                if everything or now - entry[0] >= self.window:
+                    if entry[1] > self.burst:
+                        self._report(key, entry)
+                    del self._seen[key]
+
+    def _report(self, key: tuple, entry: list) -> None:
+        summary.log(
+            entry[2],
+            "Suppressed %d repeats of '%s' from %s in %.0fs",
+            entry[1] - self.burst,
+            key[2],
+            entry[3],
+            self.window,
+        )
+
+
+def _file_handler() -> logging.Handler:
+    if settings.log_rotate_when:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE,
+            when=settings.log_rotate_when,
+            backupCount=settings.log_backups,
+            encoding="utf-8",
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE,
+            maxBytes=settings.log_max_bytes,
+            backupCount=settings.log_backups,
+            encoding="utf-8",
+        )
+    if settings.log_json:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter(
+                "{asctime} - {levelname} - {message}", DATE_FORMAT, style="{"
+            )
+        )
+    return handler
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in this process, so the record is handed over as
+        # is: the wrapped handler's formatter gets msg, args and exc_info
+        # (JsonFormatter puts the traceback in its own field).
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Dropping is better than stalling the caller on a stuck disk
+            pass
+
+
+_listeners: list[logging.handlers.QueueListener] = []
+
+
+def queued(handler: logging.Handler) -> logging.Handler:
+    """Wrap handler so callers only enqueue records.
+
+    A listener thread formats and writes them, so a burst of log lines never
+    blocks the event loop on disk I/O.
+    """
+    records: queue.Queue = queue.Queue(maxsize=settings.log_queue_size)
+    listener = logging.handlers.QueueListener(
+        records, handler, respect_handler_level=True
+    )
+    listener.start()
+    _listeners.append(listener)
+    return _QueueHandler(records)
+
+
+_rate_limit = RateLimitFilter(settings.log_rate_window, settings.log_rate_burst)
+_queue_handler = queued(_file_handler())
+_queue_handler.addFilter(_rate_limit)
+
+logging.basicConfig(handlers=[_queue_handler], level=settings.debug)
 
 logger = logging.getLogger("AppLogger")
+summary = logging.getLogger("AppLogger.summary")
+
+_stopped = threading.Event()
+
+
+def _flush_summaries() -> None:
+    while not _stopped.wait(settings.log_rate_window):
+        _rate_limit.flush()
+
+
+def _stop() -> None:
+    _stopped.set()
+    _rate_limit.flush(everything=True)
+    for listener in _listeners:
+        listener.stop()
+
+
+threading.Thread(target=_flush_summaries, name="log-summaries", daemon=True).start()
+atexit.register(_stop)
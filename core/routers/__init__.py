@@ -1,2 +1,2 @@
 from .router import router as core_router
-
+from .metrics import router as metrics_router
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import Response
+
+from core.auth.auth import check_api_key
+from core.service import metrics
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def prometheus_metrics(api_key: str = Depends(check_api_key)):
+    """Prometheus metrics; METRICS_PORT serves the same without an API key"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
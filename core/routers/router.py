@@ -1,86 +1,553 @@
-from fastapi import APIRouter, Depends
-from fastapi.responses import FileResponse
-import psutil
-from core.schema.all_schemas import User, ResponseModel, SetSettingsModel
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from core.schema.all_schemas import (
+    User,
+    UsersBatch,
+    ProfileBundle,
+    ReconcileRequest,
+    LimitsUpdate,
+    ResponseModel,
+    SetSettingsModel,
+)
 from core.auth.auth import check_api_key
 from core.service.user_managment import (
     create_user_on_server,
+    create_users_on_server,
     change_user_status as change_user_status_on_server,
     delete_user_on_server,
+    delete_users_on_server,
     download_ovpn_file,
+    list_users_on_server,
+    reconcile_users,
 )
+from core.service.connections import connection_monitor
+from core.service.executor import run_fast, run_slow
+from core.service.instances import instance_manager
+from core.service.jobs import PRIORITY_BATCH, PRIORITY_USER, Job, job_manager
+from core.service.pki import sanitize_name
+from core.service.profile import ENCODINGS, Profile, iter_bundle
+from core.service.registry import registry
+from core.service.quota import quota_engine
+from core.service.reload import reload_scheduler
+from core.service.singleflight import single_flight
+from core.service.sysmetrics import system_sampler
+from core.service.tracing import recent_spans, stack_sampler
+from core.service.traffic import traffic
 from core.setting.core import change_config
 
-
 router = APIRouter(prefix="/sync", tags=["node_sync"])
 
+# Lock key for settings changes; never a valid (sanitized) client name
+SETTINGS_KEY = ":settings"
+
 
 @router.post("/get-status", response_model=ResponseModel)
 async def get_status(request: SetSettingsModel, api_key: str = Depends(check_api_key)):
     """Get the current status of the node and set ovpn settings"""
     if request.set_new_setting:
-        change_settings = change_config(request)
+        change_settings = await run_slow(change_config, request, keys=[SETTINGS_KEY])
         if not change_settings:
             return ResponseModel(success=False, msg="Failed to change settings")
 
-    status = {"status": "running"}
-    cpu_usage = psutil.cpu_percent()
-    memory_info = psutil.virtual_memory()
-    status.update(
-        {
-            "cpu_usage": cpu_usage,
-            "memory_usage": memory_info.percent,
-        }
-    )
+    status = _collect_status()
     return ResponseModel(
         success=True, msg="Node status retrieved successfully", data=status
     )
 
 
-@router.post("/create-user", response_model=ResponseModel)
-async def create_user(user: User, api_key: str = Depends(check_api_key)):
-    success = create_user_on_server(user.name)
+def _collect_status() -> dict:
+    """Assemble the status from cached samples; nothing is measured here"""
+    system = system_sampler.snapshot()
+    return {
+        "status": "running",
+        "cpu_usage": system.get("cpu_percent"),
+        "memory_usage": system.get("memory_percent"),
+        "system": system,
+        "openvpn_reloads": reload_scheduler.summary(),
+        "instances": instance_manager.summary(),
+    }
+
+
+def _accept(
+    kind: str,
+    operation,
+    priority: int,
+    total: int = 0,
+    idempotency_key: str | None = None,
+) -> JSONResponse:
+    """Queue operation(job) as a background job and answer 202 with its id.
+
+    A retry carrying the same idempotency key gets the original job back
+    while it is queued, running or succeeded; a failed job is submitted anew.
+    """
+
+    async def run(job: Job) -> dict:
+        return (await operation(job)).model_dump()
+
+    job = None
+    key = (kind, "job", idempotency_key)
+    if idempotency_key:
+        job = job_manager.get(single_flight.recall(key))
+        if job is not None and _job_failed(job):
+            single_flight.forget(key)
+            job = None
+    if job is None:
+        job = job_manager.submit(kind, run, priority=priority, total=total)
+        if idempotency_key:
+            single_flight.remember(key, job.id)
+    return JSONResponse(
+        status_code=202,
+        content=ResponseModel(
+            success=True, msg="Job accepted", data={"job_id": job.id}
+        ).model_dump(),
+    )
+
+
+def _job_failed(job: Job) -> bool:
+    if job.status == "failed":
+        return True
+    return job.status == "done" and not (job.result or {}).get("success", True)
+
+
+def _client_names(names: list[str]) -> list[str]:
+    """Sanitize request names once, so locks match what the PKI and ccd use"""
+    return list(dict.fromkeys(sanitize_name(name) for name in names))
+
+
+async def _create_user(name: str, job: Job | None = None) -> ResponseModel:
+    success = await single_flight.do(
+        ("create-user", name),
+        lambda: run_slow(create_user_on_server, name, keys=[name]),
+    )
     if success:
         return ResponseModel(
             success=True,
             msg="User created successfully",
-            data={"client_name": user.name},
+            data={"client_name": name},
         )
     return ResponseModel(success=False, msg="Failed to create user")
 
 
-@router.post("/delete-user", response_model=ResponseModel)
-async def delete_user(user: User, api_key: str = Depends(check_api_key)):
-    result = delete_user_on_server(user.name)
+async def _create_users(names: list[str], job: Job | None = None) -> ResponseModel:
+    progress = job.set_progress if job else None
+    results = await single_flight.do(
+        ("create-users", frozenset(names)),
+        lambda: run_slow(create_users_on_server, names, progress, keys=names),
+    )
+    created = sum(1 for result in results.values() if result == "created")
+    return ResponseModel(
+        success=created == len(results),
+        msg=f"{created} of {len(results)} users created",
+        data={"results": results},
+    )
+
+
+async def _delete_user(name: str, job: Job | None = None) -> ResponseModel:
+    result = await single_flight.do(
+        ("delete-user", name),
+        lambda: run_slow(delete_user_on_server, name, keys=[name]),
+    )
     if result:
         return ResponseModel(
             success=True,
             msg="User deleted successfully",
-            data={"client_name": user.name},
+            data={"client_name": name},
         )
     return ResponseModel(success=False, msg="Failed to delete user")
 
 
+async def _delete_users(names: list[str], job: Job | None = None) -> ResponseModel:
+    progress = job.set_progress if job else None
+    results = await single_flight.do(
+        ("delete-users", frozenset(names)),
+        lambda: run_slow(delete_users_on_server, names, progress, keys=names),
+    )
+    deleted = sum(1 for result in results.values() if result == "deleted")
+    return ResponseModel(
+        success=deleted == len(results),
+        msg=f"{deleted} of {len(results)} users deleted",
+        data={"results": results},
+    )
+
+
+async def _reconcile(
+    request: ReconcileRequest, job: Job | None = None
+) -> ResponseModel:
+    desired = {sanitize_name(user.name): user.status for user in request.users}
+    if request.prune and not desired:
+        # An empty list from a panel bug would revoke every client on the node
+        return ResponseModel(success=False, msg="Refusing to prune to an empty set")
+    progress = job.set_progress if job else None
+    # Every name the diff may touch: the listed ones and every current client
+    keys = list(desired) + await run_fast(registry.names, "valid")
+    result = await run_slow(
+        reconcile_users,
+        desired,
+        request.prune,
+        request.dry_run,
+        progress,
+        keys=keys,
+    )
+    if request.dry_run:
+        return ResponseModel(success=True, msg="Reconcile plan", data=result)
+    changed = sum(len(names) for names in result["changes"].values())
+    return ResponseModel(
+        success=not result["failed"],
+        msg=f"{changed} changes applied, {len(result['failed'])} failed",
+        data=result,
+    )
+
+
+@router.post("/create-user", response_model=ResponseModel)
+async def create_user(
+    user: User,
+    run_async: bool = Query(False, alias="async"),
+    idempotency_key: str | None = Header(None),
+    api_key: str = Depends(check_api_key),
+):
+    name = sanitize_name(user.name)
+    if run_async:
+        return _accept(
+            "create-user",
+            lambda job: _create_user(name, job),
+            PRIORITY_USER,
+            idempotency_key=idempotency_key,
+        )
+    return await single_flight.idempotent(
+        "create-user", idempotency_key, lambda: _create_user(name)
+    )
+
+
+@router.post("/create-users", response_model=ResponseModel)
+async def create_users(
+    batch: UsersBatch,
+    run_async: bool = Query(False, alias="async"),
+    idempotency_key: str | None = Header(None),
+    api_key: str = Depends(check_api_key),
+):
+    names = _client_names(batch.names)
+    if run_async:
+        return _accept(
+            "create-users",
+            lambda job: _create_users(names, job),
+            PRIORITY_BATCH,
+            total=len(names),
+            idempotency_key=idempotency_key,
+        )
+    return await single_flight.idempotent(
+        "create-users", idempotency_key, lambda: _create_users(names)
+    )
+
+
+@router.post("/delete-user", response_model=ResponseModel)
+async def delete_user(
+    user: User,
+    run_async: bool = Query(False, alias="async"),
+    idempotency_key: str | None = Header(None),
+    api_key: str = Depends(check_api_key),
+):
+    name = sanitize_name(user.name)
+    if run_async:
+        return _accept(
+            "delete-user",
+            lambda job: _delete_user(name, job),
+            PRIORITY_USER,
+            idempotency_key=idempotency_key,
+        )
+    return await single_flight.idempotent(
+        "delete-user", idempotency_key, lambda: _delete_user(name)
+    )
+
+
+@router.post("/delete-users", response_model=ResponseModel)
+async def delete_users(
+    batch: UsersBatch,
+    run_async: bool = Query(False, alias="async"),
+    idempotency_key: str | None = Header(None),
+    api_key: str = Depends(check_api_key),
+):
+    names = _client_names(batch.names)
+    if run_async:
+        return _accept(
+            "delete-users",
+            lambda job: _delete_users(names, job),
+            PRIORITY_BATCH,
+            total=len(names),
+            idempotency_key=idempotency_key,
+        )
+    return await single_flight.idempotent(
+        "delete-users", idempotency_key, lambda: _delete_users(names)
+    )
+
+
+@router.post("/reconcile", response_model=ResponseModel)
+async def reconcile(
+    request: ReconcileRequest,
+    run_async: bool = Query(False, alias="async"),
+    idempotency_key: str | None = Header(None),
+    api_key: str = Depends(check_api_key),
+):
+    """Converge the node on the full desired user set in batched changes"""
+    if run_async and not request.dry_run:
+        return _accept(
+            "reconcile",
+            lambda job: _reconcile(request, job),
+            PRIORITY_BATCH,
+            idempotency_key=idempotency_key,
+        )
+    if request.dry_run:
+        return await _reconcile(request)
+    return await single_flight.idempotent(
+        "reconcile", idempotency_key, lambda: _reconcile(request)
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=ResponseModel)
+async def get_job(job_id: str, api_key: str = Depends(check_api_key)):
+    job = job_manager.get(job_id)
+    if job is None:
+        return ResponseModel(success=False, msg="Job not found")
+    return ResponseModel(success=True, msg="Job retrieved", data=job.to_dict())
+
+
 @router.post("/change-user-status", response_model=ResponseModel)
 async def change_user_status(user: User, api_key: str = Depends(check_api_key)):
-    result = change_user_status_on_server(user.name, user.status)
+    name = sanitize_name(user.name)
+    # A deactivation waits on the management interface, so it is slow work
+    result = await single_flight.do(
+        ("change-user-status", name, user.status),
+        lambda: run_slow(change_user_status_on_server, name, user.status, keys=[name]),
+    )
     if result:
         return ResponseModel(
             success=True,
             msg="User status changed successfully",
-            data={"client_name": user.name},
+            data={"client_name": name},
         )
     return ResponseModel(success=False, msg="Failed to change user status")
 
 
+@router.get("/list-users", response_model=ResponseModel)
+async def list_users(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    status: str | None = Query(None, pattern="^(valid|revoked)$"),
+    api_key: str = Depends(check_api_key),
+):
+    return ResponseModel(
+        success=True,
+        msg="Users retrieved successfully",
+        data=await run_fast(list_users_on_server, offset, limit, status),
+    )
+
+
+@router.get("/connections", response_model=ResponseModel)
+async def connections(api_key: str = Depends(check_api_key)):
+    """Currently connected sessions, from the last background refresh"""
+    return ResponseModel(
+        success=True,
+        msg="Connections retrieved successfully",
+        data=connection_monitor.snapshot(),
+    )
+
+
+@router.get("/traffic", response_model=ResponseModel)
+async def traffic_usage(
+    name: str | None = Query(None),
+    start: float | None = Query(None),
+    end: float | None = Query(None),
+    resolution: str | None = Query(None, pattern="^(1m|1h|1d)$"),
+    api_key: str = Depends(check_api_key),
+):
+    """Traffic of one user as a time series, or per-user totals for all users"""
+    return ResponseModel(
+        success=True,
+        msg="Traffic retrieved successfully",
+        data=await run_fast(
+            traffic.usage,
+            sanitize_name(name) if name else None,
+            start,
+            end,
+            resolution,
+        ),
+    )
+
+
+@router.post("/limits", response_model=ResponseModel)
+async def set_limits(request: LimitsUpdate, api_key: str = Depends(check_api_key)):
+    """Push per-user data quotas and expiry dates for the node to enforce"""
+    result = await run_fast(
+        quota_engine.set_limits,
+        [
+            {**limit.model_dump(), "name": sanitize_name(limit.name)}
+            for limit in request.limits
+        ],
+        request.replace,
+    )
+    quota_engine.wake()
+    return ResponseModel(success=True, msg="Limits updated successfully", data=result)
+
+
+@router.get("/limits", response_model=ResponseModel)
+async def get_limits(
+    name: str | None = Query(None), api_key: str = Depends(check_api_key)
+):
+    return ResponseModel(
+        success=True,
+        msg="Limits retrieved successfully",
+        data=await run_fast(
+            quota_engine.get_limits, sanitize_name(name) if name else None
+        ),
+    )
+
+
+@router.get("/limits/events", response_model=ResponseModel)
+async def limit_events(
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    api_key: str = Depends(check_api_key),
+):
+    """Enforcement events after the given id, oldest first"""
+    return ResponseModel(
+        success=True,
+        msg="Limit events retrieved successfully",
+        data=quota_engine.events(since, limit),
+    )
+
+
+@router.get("/changes", response_model=ResponseModel)
+async def changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    api_key: str = Depends(check_api_key),
+):
+    """Changes after revision since, or a full snapshot when they are gone"""
+    return ResponseModel(
+        success=True,
+        msg="Changes retrieved successfully",
+        data=await run_fast(registry.changes, since, limit),
+    )
+
+
+@router.get("/debug/traces", response_model=ResponseModel)
+async def debug_traces(
+    trace_id: str | None = Query(None),
+    limit: int = Query(200, ge=1, le=5000),
+    api_key: str = Depends(check_api_key),
+):
+    """Recently finished tracing spans, newest first"""
+    return ResponseModel(
+        success=True,
+        msg="Spans retrieved successfully",
+        data=recent_spans(trace_id, limit),
+    )
+
+
+@router.post("/debug/profile", response_model=ResponseModel)
+async def debug_profile(
+    seconds: float = Query(10, gt=0, le=60),
+    top: int = Query(30, ge=1, le=500),
+    api_key: str = Depends(check_api_key),
+):
+    """Sample every thread's stack for the given seconds and return the profile"""
+    profile = await stack_sampler.run(seconds, top)
+    if profile is None:
+        return ResponseModel(success=False, msg="A profile is already running")
+    return ResponseModel(success=True, msg="Profile collected", data=profile)
+
+
 @router.get("/download/ovpn/{client_name}")
-async def download_ovpn(client_name: str, api_key: str = Depends(check_api_key)):
-    response = await download_ovpn_file(client_name)
+async def download_ovpn(
+    client_name: str, request: Request, api_key: str = Depends(check_api_key)
+):
+    name = sanitize_name(client_name)
+    response = await single_flight.do(
+        ("download", name), lambda: download_ovpn_file(name)
+    )
     if response:
-        return FileResponse(
-            path=response,
-            filename=f"{client_name}.ovpn",
-            media_type="application/x-openvpn-profile",
-        )
+        return _profile_response(request, response, name)
     else:
         return ResponseModel(success=False, msg="OVPN file not found", data=None)
+
+
+def _profile_response(request: Request, profile: Profile, name: str) -> Response:
+    """Serve a profile with ETag/Last-Modified validators and gzip/br encoding"""
+    encoding = _pick_encoding(request.headers.get("accept-encoding", ""))
+    # Strong validators must differ between representations, and a 304 must
+    # carry the validator of the representation it stands for.
+    etag = f"{profile.etag}-{encoding}" if encoding else profile.etag
+    headers = {
+        "ETag": f'"{etag}"',
+        "Last-Modified": formatdate(profile.last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if _not_modified(request, profile, etag):
+        return Response(status_code=304, headers=headers)
+
+    content = profile.data
+    if encoding:
+        content = profile.encoded(encoding)
+        headers["Content-Encoding"] = encoding
+    headers["Content-Disposition"] = f'attachment; filename="{name}.ovpn"'
+    return Response(
+        content=content, media_type="application/x-openvpn-profile", headers=headers
+    )
+
+
+def _not_modified(request: Request, profile: Profile, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        for tag in if_none_match.split(","):
+            tag = tag.strip().removeprefix("W/").strip('"')
+            if tag in ("*", etag):
+                return True
+        return False
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(profile.last_modified) <= since
+    return False
+
+
+def _pick_encoding(accept_encoding: str) -> str | None:
+    """Choose br or gzip from Accept-Encoding, honouring q=0"""
+    offered = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        offered[coding.strip().lower()] = quality
+    for coding in ENCODINGS:
+        if offered.get(coding, offered.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+@router.post("/download/ovpn-bundle")
+async def download_ovpn_bundle(
+    request: ProfileBundle, api_key: str = Depends(check_api_key)
+):
+    """Stream the profiles of the given users, or of all valid users, as one archive"""
+    if request.names == "all":
+        names = await run_fast(registry.names)
+    else:
+        names = _client_names(request.names)
+    return StreamingResponse(
+        iter_bundle(names, request.format),
+        media_type="application/zip" if request.format == "zip" else "application/gzip",
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="ovpn-profiles.{request.format}"'
+            )
+        },
+    )
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 
 
 class User(BaseModel):
@@ -7,6 +7,38 @@ class User(BaseModel):
     status: str = "activate"
 
 
+class UsersBatch(BaseModel):
+    names: list[str]
+
+
+class DesiredUser(BaseModel):
+    name: str
+    status: Literal["activate", "deactivate"] = "activate"
+
+
+class ReconcileRequest(BaseModel):
+    users: list[DesiredUser]
+    prune: bool = False
+    dry_run: bool = False
+
+
+class ProfileBundle(BaseModel):
+    names: list[str] | Literal["all"] = "all"
+    format: Literal["zip", "tar.gz"] = "zip"
+
+
+class UserLimit(BaseModel):
+    name: str
+    data_limit: Optional[int] = None
+    expires_at: Optional[float] = None
+    used: Optional[int] = None
+
+
+class LimitsUpdate(BaseModel):
+    limits: list[UserLimit]
+    replace: bool = False
+
+
 class ResponseModel(BaseModel):
     success: bool
     msg: str
@@ -0,0 +1,267 @@
+import asyncio
+import os
+import time
+from dataclasses import asdict, dataclass
+
+from core.config import settings
+from core.logger import logger
+from core.service.executor import run_fast
+from core.service.management import management_client
+from core.service.metrics import CONNECTED_CLIENTS
+
+# Minimum spacing between refreshes triggered by connect/disconnect events.
+EVENT_DEBOUNCE = 1.0
+# Refresh intervals a snapshot outlives its last source, flagged stale,
+# before its sessions are dropped.
+STALE_INTERVALS = 3
+
+
+@dataclass
+class Session:
+    common_name: str
+    real_address: str
+    virtual_address: str
+    virtual_ipv6_address: str
+    bytes_received: int
+    bytes_sent: int
+    connected_since: int
+    client_id: int | None = None
+    peer_id: int | None = None
+    cipher: str | None = None
+    instance: int = 0
+
+
+def parse_status(lines: list[str]) -> list[Session]:
+    """Parse OpenVPN status output in any status-version (1, 2 or 3).
+
+    Versions 2 and 3 describe their rows with HEADER lines (comma and tab
+    separated respectively), so columns are looked up by name. Version 1
+    has fixed sections and no virtual address in the client list; that is
+    joined in from the routing table.
+    """
+    if not lines:
+        return []
+    if lines[0].startswith("OpenVPN CLIENT LIST"):
+        return _parse_v1(lines)
+
+    sep = "\t" if "\t" in lines[0] else ","
+    columns: dict[str, dict[str, int]] = {}
+    sessions = []
+    for line in lines:
+        row = line.split(sep)
+        if row[0] == "HEADER" and len(row) > 2:
+            columns[row[1]] = {name: i + 1 for i, name in enumerate(row[2:])}
+        elif row[0] == "CLIENT_LIST" and "CLIENT_LIST" in columns:
+            col = columns["CLIENT_LIST"]
+
+            def get(name: str, default: str = "") -> str:
+                i = col.get(name)
+                return row[i] if i is not None and i < len(row) else default
+
+            sessions.append(
+                Session(
+                    common_name=get("Common Name"),
+                    real_address=get("Real Address"),
+                    virtual_address=get("Virtual Address"),
+                    virtual_ipv6_address=get("Virtual IPv6 Address"),
+                    bytes_received=_int(get("Bytes Received")),
+                    bytes_sent=_int(get("Bytes Sent")),
+                    connected_since=_int(get("Connected Since (time_t)")),
+                    client_id=_int(get("Client ID"), None),
+                    peer_id=_int(get("Peer ID"), None),
+                    cipher=get("Data Channel Cipher") or None,
+                )
+            )
+    return sessions
+
+
+def _parse_v1(lines: list[str]) -> list[Session]:
+    section = None
+    clients, routes = [], {}
+    for line in lines:
+        if line in ("OpenVPN CLIENT LIST", "ROUTING TABLE", "GLOBAL STATS", "END"):
+            section = line
+            continue
+        row = line.split(",")
+        if row[0] in ("Updated", "Common Name", "Virtual Address"):
+            continue
+        if section == "OpenVPN CLIENT LIST" and len(row) >= 5:
+            clients.append(row)
+        elif section == "ROUTING TABLE" and len(row) >= 3:
+            routes.setdefault(row[2], row[0])
+    return [
+        Session(
+            common_name=name,
+            real_address=real,
+            virtual_address=routes.get(real, ""),
+            virtual_ipv6_address="",
+            bytes_received=_int(received),
+            bytes_sent=_int(sent),
+            connected_since=_parse_time(since),
+        )
+        for name, real, received, sent, since, *_ in clients
+    ]
+
+
+def _int(value: str, default: int | None = 0) -> int | None:
+    return int(value) if value.isdigit() else default
+
+
+def _parse_time(value: str) -> int:
+    try:
+        return int(time.mktime(time.strptime(value, "%Y-%m-%d %H:%M:%S")))
+    except ValueError:
+        try:
+            return int(time.mktime(time.strptime(value, "%a %b %d %H:%M:%S %Y")))
+        except ValueError:
+            return 0
+
+
+class ConnectionMonitor:
+    """Keep a snapshot of connected sessions, refreshed in the background.
+
+    Sessions of every OpenVPN server instance are merged into one snapshot.
+    For each instance the management interface (status 3) is preferred;
+    when it is not reachable that instance's status file is read instead,
+    and only re-parsed when it changed. Connect/disconnect notifications
+    trigger an early refresh. Readers get the last snapshot as is, whatever
+    the number of sessions. When no source answers, the snapshot is flagged
+    stale with its age and emptied after STALE_INTERVALS intervals.
+    """
+
+    def __init__(self, interval: float, status_file: str):
+        self.interval = interval
+        self.status_files = [status_file]
+        self._snapshot = {
+            "updated_at": None,
+            "source": None,
+            "stale": True,
+            "age": None,
+            "count": 0,
+            "sessions": [],
+        }
+        self._by_name: dict[str, list[Session]] = {}
+        self._files: dict[str, tuple[tuple, list[Session]]] = {}
+        self._wakeup = asyncio.Event()
+        self._unsubscribe = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._unsubscribe = management_client.subscribe(
+                "CLIENT", lambda event: self._wakeup.set()
+            )
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict:
+        return self._snapshot
+
+    def sessions_of(self, name: str) -> list[Session]:
+        return self._by_name.get(name, [])
+
+    def configure(self, status_files: list[str]) -> None:
+        """Set the status file of each instance, in instance order.
+
+        Safe while running: a refresh in progress finishes with the old list
+        and the next one reads the new files.
+        """
+        self.status_files = status_files
+        self._files = {}
+
+    async def refresh(self) -> None:
+        statuses = {}
+        if management_client.connected:
+            statuses = await management_client.statuses()
+        await run_fast(self._collect, statuses)
+
+    def _collect(self, statuses: dict[int, list[str]]) -> None:
+        sessions, sources = [], set()
+        for instance, status_file in enumerate(self.status_files):
+            if instance in statuses:
+                found = parse_status(statuses[instance])
+                sources.add("management")
+                self._files.pop(status_file, None)
+            else:
+                found = self._read_status_file(status_file)
+                if found is None:
+                    continue
+                sources.add("status-file")
+            for session in found:
+                session.instance = instance
+            sessions.extend(found)
+        if sources:
+            self._publish("+".join(sorted(sources)), sessions)
+        else:
+            self._expire()
+
+    def _read_status_file(self, path: str) -> list[Session] | None:
+        """Sessions in a status file, re-parsed only when the file changed"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with open(path, "r", errors="replace") as f:
+            sessions = parse_status(f.read().splitlines())
+        self._files[path] = (stamp, sessions)
+        return sessions
+
+    def _publish(self, source: str, sessions: list[Session]) -> None:
+        """Swap in a new snapshot; runs on a worker thread, readers never lock"""
+        by_name: dict[str, list[Session]] = {}
+        for session in sessions:
+            by_name.setdefault(session.common_name, []).append(session)
+        self._by_name = by_name
+        self._snapshot = {
+            "updated_at": time.time(),
+            "source": source,
+            "stale": False,
+            "age": 0.0,
+            "count": len(sessions),
+            "sessions": [asdict(session) for session in sessions],
+        }
+
+    def _expire(self) -> None:
+        """Flag the last snapshot stale, and drop its sessions once too old"""
+        snapshot = self._snapshot
+        if snapshot["updated_at"] is None:
+            return
+        age = time.time() - snapshot["updated_at"]
+        if age > self.interval * STALE_INTERVALS and snapshot["sessions"]:
+            self._by_name = {}
+            snapshot = dict(snapshot, count=0, sessions=[])
+        self._snapshot = dict(snapshot, stale=True, age=round(age, 1))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Failed to refresh connected clients: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                await asyncio.sleep(EVENT_DEBOUNCE)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+connection_monitor = ConnectionMonitor(
+    settings.connections_interval, settings.status_file
+)
+CONNECTED_CLIENTS.set_function(lambda: connection_monitor.snapshot()["count"])
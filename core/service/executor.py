@@ -0,0 +1,74 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Iterable
+
+from core.config import settings
+
+# Slow pool: PKI signing, script sessions, systemctl. Fast pool: small file
+# and /proc reads. Keeping them apart means a burst of user creations can
+# never starve health checks.
+slow_pool = ThreadPoolExecutor(
+    max_workers=settings.slow_workers, thread_name_prefix="ovnode-slow"
+)
+fast_pool = ThreadPoolExecutor(
+    max_workers=settings.fast_workers, thread_name_prefix="ovnode-fast"
+)
+
+_key_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+
+@asynccontextmanager
+async def client_locks(keys: Iterable[str]):
+    """Hold one lock per client name so operations on the same name run in
+    order while unrelated names proceed concurrently.
+
+    Locks are taken in sorted order so overlapping batches cannot deadlock,
+    and are dropped once nobody is waiting on them.
+    """
+    keys = sorted(set(keys))
+    registered, acquired = [], []
+    try:
+        for key in keys:
+            lock, users = _key_locks.get(key, (asyncio.Lock(), 0))
+            _key_locks[key] = (lock, users + 1)
+            registered.append(key)
+            await lock.acquire()
+            acquired.append(key)
+        yield
+    finally:
+        for key in reversed(acquired):
+            _key_locks[key][0].release()
+        for key in registered:
+            lock, users = _key_locks[key]
+            if users <= 1:
+                del _key_locks[key]
+            else:
+                _key_locks[key] = (lock, users - 1)
+
+
+async def run_slow(func: Callable, *args, keys: Iterable[str] = (), **kwargs) -> Any:
+    """Run blocking PKI/script/systemctl work off the event loop"""
+    async with client_locks(keys):
+        return await _run_in(slow_pool, func, *args, **kwargs)
+
+
+async def run_fast(func: Callable, *args, keys: Iterable[str] = (), **kwargs) -> Any:
+    """Run short blocking file or /proc work off the event loop"""
+    async with client_locks(keys):
+        return await _run_in(fast_pool, func, *args, **kwargs)
+
+
+async def _run_in(pool: ThreadPoolExecutor, func: Callable, *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context so tracing spans nest across the thread hop
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(pool, call)
+
+
+def shutdown() -> None:
+    slow_pool.shutdown(wait=False, cancel_futures=True)
+    fast_pool.shutdown(wait=False, cancel_futures=True)
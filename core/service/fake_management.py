@@ -0,0 +1,216 @@
+"""Local stand-in for the OpenVPN management interface.
+
+It speaks enough of the protocol (status 3, kill, client-kill, load-stats,
+bytecount and the >CLIENT / >BYTECOUNT_CLI notifications) to exercise
+ManagementClient and the services built on it without a running OpenVPN:
+
+    python -m core.service.fake_management /tmp/ovpn-mgmt.sock
+"""
+
+import asyncio
+import sys
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class FakeClient:
+    cid: int
+    name: str
+    real_address: str
+    virtual_address: str
+    bytes_received: int = 0
+    bytes_sent: int = 0
+    connected_since: int = field(default_factory=lambda: int(time.time()))
+
+
+class FakeManagementServer:
+    def __init__(self, address: str):
+        self.address = address
+        self.clients: dict[int, FakeClient] = {}
+        self._next_cid = 0
+        self._server: asyncio.AbstractServer | None = None
+        self._writers: set[asyncio.StreamWriter] = set()
+        self._bytecount_tasks: dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    async def start(self) -> None:
+        if self.address.startswith("/"):
+            self._server = await asyncio.start_unix_server(self._handle, self.address)
+        else:
+            host, _, port = self.address.rpartition(":")
+            self._server = await asyncio.start_server(self._handle, host, int(port))
+
+    async def stop(self) -> None:
+        for task in self._bytecount_tasks.values():
+            task.cancel()
+        for writer in list(self._writers):
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def connect_client(
+        self, name: str, real_address: str = "203.0.113.10:50000"
+    ) -> FakeClient:
+        """Add a session and announce it with >CLIENT:ESTABLISHED"""
+        client = FakeClient(
+            cid=self._next_cid,
+            name=name,
+            real_address=real_address,
+            virtual_address=f"10.8.0.{self._next_cid + 2}",
+        )
+        self._next_cid += 1
+        self.clients[client.cid] = client
+        self._broadcast_client_event("ESTABLISHED", client)
+        return client
+
+    def disconnect_client(self, cid: int) -> bool:
+        client = self.clients.pop(cid, None)
+        if client is None:
+            return False
+        self._broadcast_client_event("DISCONNECT", client)
+        return True
+
+    def add_traffic(self, cid: int, received: int, sent: int) -> None:
+        client = self.clients[cid]
+        client.bytes_received += received
+        client.bytes_sent += sent
+
+    def status_lines(self) -> list[str]:
+        now = int(time.time())
+        lines = [
+            "TITLE\tOpenVPN 2.6.0 fake",
+            f"TIME\t{time.strftime('%Y-%m-%d %H:%M:%S')}\t{now}",
+            "HEADER\tCLIENT_LIST\tCommon Name\tReal Address\tVirtual Address\t"
+            "Virtual IPv6 Address\tBytes Received\tBytes Sent\tConnected Since\t"
+            "Connected Since (time_t)\tUsername\tClient ID\tPeer ID\t"
+            "Data Channel Cipher",
+        ]
+        for c in self.clients.values():
+            since = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(c.connected_since)
+            )
+            lines.append(
+                f"CLIENT_LIST\t{c.name}\t{c.real_address}\t{c.virtual_address}\t\t"
+                f"{c.bytes_received}\t{c.bytes_sent}\t{since}\t{c.connected_since}\t"
+                f"UNDEF\t{c.cid}\t{c.cid}\tAES-256-GCM"
+            )
+        lines.append(
+            "HEADER\tROUTING_TABLE\tVirtual Address\tCommon Name\tReal Address\t"
+            "Last Ref\tLast Ref (time_t)"
+        )
+        for c in self.clients.values():
+            lines.append(
+                f"ROUTING_TABLE\t{c.virtual_address}\t{c.name}\t{c.real_address}\t"
+                f"{time.strftime('%Y-%m-%d %H:%M:%S')}\t{now}"
+            )
+        lines.append("GLOBAL_STATS\tMax bcast/mcast queue length\t0")
+        lines.append("END")
+        return lines
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        self._send(writer, ">INFO:OpenVPN Management Interface Version 5 -- fake")
+        try:
+            while raw := await reader.readline():
+                command = raw.decode().strip()
+                if command == "quit":
+                    break
+                self._send(writer, "\r\n".join(self._execute(writer, command)))
+                await writer.drain()
+        finally:
+            task = self._bytecount_tasks.pop(writer, None)
+            if task is not None:
+                task.cancel()
+            self._writers.discard(writer)
+            writer.close()
+
+    def _execute(self, writer: asyncio.StreamWriter, command: str) -> list[str]:
+        word, _, arg = command.partition(" ")
+        if word == "status":
+            return self.status_lines()
+        if word == "kill":
+            killed = [c.cid for c in self.clients.values() if c.name == arg]
+            if not killed:
+                return [f"ERROR: common name '{arg}' not found"]
+            for cid in killed:
+                self.disconnect_client(cid)
+            return [
+                f"SUCCESS: common name '{arg}' found, {len(killed)} client(s) killed"
+            ]
+        if word == "client-kill":
+            if arg.isdigit() and self.disconnect_client(int(arg)):
+                return ["SUCCESS: client-kill command succeeded"]
+            return ["ERROR: client-kill command failed"]
+        if word == "load-stats":
+            received = sum(c.bytes_received for c in self.clients.values())
+            sent = sum(c.bytes_sent for c in self.clients.values())
+            return [
+                f"SUCCESS: nclients={len(self.clients)},"
+                f"bytesin={received},bytesout={sent}"
+            ]
+        if word == "bytecount" and arg.isdigit():
+            task = self._bytecount_tasks.pop(writer, None)
+            if task is not None:
+                task.cancel()
+            if int(arg) > 0:
+                self._bytecount_tasks[writer] = asyncio.create_task(
+                    self._bytecount_loop(writer, int(arg))
+                )
+            return ["SUCCESS: bytecount interval changed"]
+        return [f"ERROR: unknown command [{command}], enter 'help' for more options"]
+
+    async def _bytecount_loop(self, writer: asyncio.StreamWriter, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            for c in list(self.clients.values()):
+                self._send(
+                    writer,
+                    f">BYTECOUNT_CLI:{c.cid},{c.bytes_received},{c.bytes_sent}",
+                )
+
+    def _broadcast_client_event(self, event: str, client: FakeClient) -> None:
+        lines = [
+            f">CLIENT:{event},{client.cid}",
+            f">CLIENT:ENV,common_name={client.name}",
+            f">CLIENT:ENV,trusted_ip={client.real_address.rpartition(':')[0]}",
+            f">CLIENT:ENV,ifconfig_pool_remote_ip={client.virtual_address}",
+            f">CLIENT:ENV,time_unix={client.connected_since}",
+        ]
+        if event == "DISCONNECT":
+            # Like OpenVPN, report what the session moved over its lifetime
+            lines += [
+                f">CLIENT:ENV,bytes_received={client.bytes_received}",
+                f">CLIENT:ENV,bytes_sent={client.bytes_sent}",
+                f">CLIENT:ENV,time_duration="
+                f"{int(time.time()) - client.connected_since}",
+            ]
+        lines.append(">CLIENT:ENV,END")
+        for writer in list(self._writers):
+            for line in lines:
+                self._send(writer, line)
+
+    @staticmethod
+    def _send(writer: asyncio.StreamWriter, line: str) -> None:
+        if not writer.is_closing():
+            writer.write(f"{line}\r\n".encode())
+
+
+async def _serve(address: str) -> None:
+    server = FakeManagementServer(address)
+    await server.start()
+    server.connect_client("first_client")
+    print(f"Fake OpenVPN management interface listening on {address}")
+    try:
+        while True:
+            await asyncio.sleep(5)
+            for client in server.clients.values():
+                server.add_traffic(client.cid, 4096, 16384)
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(_serve(sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1:7505"))
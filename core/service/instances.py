@@ -0,0 +1,300 @@
+import ipaddress
+import os
+import subprocess
+from dataclasses import dataclass
+
+from core.config import settings
+from core.logger import logger
+from core.service.connections import connection_monitor
+from core.service.management import management_client
+from core.service.reload import OPENVPN_UNIT, reload_scheduler
+from core.service.sysmetrics import system_sampler
+from core.setting import ovpn_config
+
+SERVER_DIR = os.path.dirname(ovpn_config.SERVER_CONF)
+FIREWALL_UNIT = "/etc/systemd/system/openvpn-iptables.service"
+INSTANCES_FIREWALL_UNIT = "/etc/systemd/system/ovnode-instances-iptables.service"
+
+# Files each OpenVPN process needs for itself; instance i gets "name-i.ext".
+# The status file is always set, to the one the connection monitor reads.
+PER_INSTANCE_FILES = {
+    "ifconfig-pool-persist",
+    "log",
+    "log-append",
+    "replay-persist",
+    "writepid",
+}
+
+
+@dataclass
+class Instance:
+    """One OpenVPN server process: its own port, subnet and management socket"""
+
+    index: int
+    port: int
+    proto: str
+    network: str | None
+    management_address: str
+    status_file: str
+    device: str
+
+    @property
+    def name(self) -> str:
+        return "server" if self.index == 0 else f"server-{self.index}"
+
+    @property
+    def unit(self) -> str:
+        return OPENVPN_UNIT if self.index == 0 else f"openvpn-server@{self.name}"
+
+    @property
+    def config_path(self) -> str:
+        return os.path.join(SERVER_DIR, f"{self.name}.conf")
+
+
+def _suffixed(path: str, index: int) -> str:
+    if index == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{index}{ext}"
+
+
+def _management_address(index: int) -> str:
+    address = settings.management_address
+    if index == 0 or address.startswith("/"):
+        return _suffixed(address, index)
+    host, _, port = address.rpartition(":")
+    return f"{host}:{int(port) + index}"
+
+
+def _shift(network, index: int):
+    """The index-th network of the same size after network"""
+    start = int(network.network_address) + index * network.num_addresses
+    return type(network)((start, network.prefixlen))
+
+
+class InstanceManager:
+    """Run the OpenVPN data plane as several processes to use every core.
+
+    OpenVPN handles all of its tunnels on one thread, so one process caps
+    the node at a single core. server.conf stays instance 0; instance i is
+    server-i.conf, a copy listening on port + i with the i-th next subnet
+    and its own tun device, management socket and status file. OpenVPN
+    cannot share a port between processes, so profiles list every port as a
+    remote and clients pick one at random.
+    """
+
+    def __init__(self, count: int):
+        self.count = count or os.cpu_count() or 1
+        self.instances: list[Instance] = []
+
+    def provision(self, restart_changed: bool = True) -> list[Instance]:
+        """Write and start the extra instances to match server.conf.
+
+        Configs are only rewritten when their content changes. Changed
+        instances are restarted unless restart_changed is False, for callers
+        that schedule a restart of every unit themselves.
+        """
+        if not os.path.exists(ovpn_config.SERVER_CONF):
+            return self.instances
+        try:
+            base = ovpn_config.OpenVPNConfig.load(ovpn_config.SERVER_CONF)
+            configs = [self._render(base, index) for index in range(self.count)]
+            self.instances = [instance for instance, _ in configs]
+            changed = []
+            for instance, config in configs[1:]:
+                text = config.render()
+                if _read(instance.config_path) != text:
+                    ovpn_config.write_atomic(instance.config_path, text)
+                    changed.append(instance)
+            self._remove_surplus()
+            self._write_remotes()
+            self._write_firewall()
+            for instance in self.instances[1:]:
+                _systemctl("enable", "--now", instance.unit)
+            if restart_changed and changed:
+                _systemctl("restart", *(instance.unit for instance in changed))
+        except Exception as e:
+            logger.error("Failed to provision OpenVPN instances: %s", e)
+            return self.instances
+
+        reload_scheduler.units = [instance.unit for instance in self.instances]
+        system_sampler.tun_interfaces = [instance.device for instance in self.instances]
+        addresses = [instance.management_address for instance in self.instances]
+        if addresses != [client.address for client in management_client.clients]:
+            management_client.configure(addresses)
+        status_files = [instance.status_file for instance in self.instances]
+        if status_files != connection_monitor.status_files:
+            connection_monitor.configure(status_files)
+        if len(self.instances) > 1:
+            logger.info("Running %d OpenVPN instances", len(self.instances))
+        return self.instances
+
+    def summary(self) -> list[dict]:
+        """Per instance: where it listens and how many sessions it carries"""
+        sessions = connection_monitor.snapshot()["sessions"]
+        connected = {
+            client.instance: client.connected for client in management_client.clients
+        }
+        return [
+            {
+                "name": instance.name,
+                "port": instance.port,
+                "proto": instance.proto,
+                "network": instance.network,
+                "device": instance.device,
+                "management": connected.get(instance.index, False),
+                "sessions": sum(1 for s in sessions if s["instance"] == instance.index),
+            }
+            for instance in self.instances
+        ]
+
+    def _render(self, base: ovpn_config.OpenVPNConfig, index: int):
+        config = ovpn_config.OpenVPNConfig(base.render())
+        port = int((base.get("port") or ["1194"])[0]) + index
+        proto = (base.get("proto") or ["udp"])[0]
+        network = None
+        server = base.get("server")
+        if server and len(server) >= 2:
+            net = _shift(ipaddress.IPv4Network(f"{server[0]}/{server[1]}"), index)
+            network = str(net)
+            config.set(
+                "server", str(net.network_address), str(net.netmask), *server[2:]
+            )
+        server_ipv6 = base.get("server-ipv6")
+        if server_ipv6:
+            net = _shift(ipaddress.IPv6Network(server_ipv6[0]), index)
+            config.set("server-ipv6", str(net), *server_ipv6[1:])
+
+        address = _management_address(index)
+        status_file = _suffixed(settings.status_file, index)
+        device = settings.tun_interface
+        if index:
+            # A numbered device, so the sampler knows which one is whose;
+            # server.conf's "dev tun" takes the lowest free one, tun0.
+            dev = (base.get("dev") or ["tun"])[0]
+            device = f"{dev.rstrip('0123456789')}{index}"
+            config.set("dev", device)
+            config.set("port", str(port))
+            for keyword in PER_INSTANCE_FILES:
+                args = config.get(keyword)
+                if args:
+                    config.set(keyword, _suffixed(args[0], index), *args[1:])
+            if address.startswith("/"):
+                config.set("management", address, "unix")
+            else:
+                config.set("management", *address.rsplit(":", 1))
+            interval = (config.get("status") or [])[1:] or [ovpn_config.STATUS_INTERVAL]
+            config.set("status", status_file, *interval)
+            config.set("status-version", "3")
+        instance = Instance(index, port, proto, network, address, status_file, device)
+        return instance, config
+
+    def _remove_surplus(self) -> None:
+        wanted = {instance.config_path for instance in self.instances}
+        for filename in os.listdir(SERVER_DIR):
+            path = os.path.join(SERVER_DIR, filename)
+            suffix = filename.removeprefix("server-").removesuffix(".conf")
+            if not (filename.endswith(".conf") and suffix.isdigit()) or path in wanted:
+                continue
+            _systemctl("disable", "--now", f"openvpn-server@server-{suffix}")
+            os.remove(path)
+            logger.info("Removed OpenVPN instance server-%s", suffix)
+
+    def _write_remotes(self) -> None:
+        """List one remote per instance in client-common.txt"""
+        path = ovpn_config.CLIENT_TEMPLATE
+        if not os.path.exists(path):
+            return
+        client = ovpn_config.OpenVPNConfig.load(path)
+        remotes = client.get_all("remote")
+        if not remotes:
+            return
+        first = remotes[0]
+        client.set_all(
+            "remote",
+            [[first[0], str(instance.port)] + first[2:] for instance in self.instances],
+        )
+        client.set_all("remote-random", [[]] if len(self.instances) > 1 else [])
+        text = client.render()
+        if _read(path) != text:
+            ovpn_config.write_atomic(path, text)
+
+    def _write_firewall(self) -> None:
+        """Open the extra ports and NAT the extra subnets like the installer does.
+
+        The installer's firewall unit is copied with instance 0's port and
+        subnets replaced by each extra instance's; rules that mention
+        neither are already shared.
+        """
+        if len(self.instances) == 1:
+            if os.path.exists(INSTANCES_FIREWALL_UNIT):
+                _systemctl(
+                    "disable", "--now", os.path.basename(INSTANCES_FIREWALL_UNIT)
+                )
+                os.remove(INSTANCES_FIREWALL_UNIT)
+                _systemctl("daemon-reload")
+            return
+        template = _read(FIREWALL_UNIT)
+        if template is None:
+            logger.warning(
+                "No %s; open ports %s in the firewall yourself",
+                FIREWALL_UNIT,
+                ", ".join(str(instance.port) for instance in self.instances[1:]),
+            )
+            return
+
+        first = self.instances[0]
+        base = ovpn_config.OpenVPNConfig.load(ovpn_config.SERVER_CONF)
+        server_ipv6 = base.get("server-ipv6")
+        dport = _firewall_port(template) or str(first.port)
+        lines = []
+        for line in template.splitlines():
+            if not line.startswith(("ExecStart=", "ExecStop=")):
+                lines.append(line)
+                continue
+            for instance in self.instances[1:]:
+                rule = line.replace(f"--dport {dport} ", f"--dport {instance.port} ")
+                if first.network:
+                    rule = rule.replace(first.network, instance.network)
+                if server_ipv6:
+                    net = ipaddress.IPv6Network(server_ipv6[0])
+                    rule = rule.replace(str(net), str(_shift(net, instance.index)))
+                if rule != line:
+                    lines.append(rule)
+        text = "\n".join(lines) + "\n"
+        if _read(INSTANCES_FIREWALL_UNIT) == text:
+            return
+        with open(INSTANCES_FIREWALL_UNIT, "w") as f:
+            f.write(text)
+        unit = os.path.basename(INSTANCES_FIREWALL_UNIT)
+        _systemctl("daemon-reload")
+        _systemctl("enable", unit)
+        _systemctl("restart", unit)
+
+
+def _firewall_port(template: str) -> str | None:
+    words = template.split()
+    for i, word in enumerate(words[:-1]):
+        if word == "--dport":
+            return words[i + 1]
+    return None
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _systemctl(*args: str) -> bool:
+    try:
+        subprocess.run(["/usr/bin/systemctl", *args], check=True, timeout=60)
+        return True
+    except Exception as e:
+        logger.error("systemctl %s failed: %s", " ".join(args), e)
+        return False
+
+
+instance_manager = InstanceManager(settings.openvpn_instances)
@@ -0,0 +1,114 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable
+
+from core.config import settings
+from core.logger import logger
+
+# Lower runs first: single-user operations overtake queued bulk work.
+PRIORITY_USER = 0
+PRIORITY_BATCH = 10
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    priority: int
+    status: str = "queued"
+    progress: int = 0
+    total: int = 0
+    result: Any = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    def set_progress(self, done: int) -> None:
+        self.progress = done
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class JobManager:
+    """Run long node operations in the background and keep their results.
+
+    Jobs wait on a priority queue served by a fixed number of worker tasks.
+    Finished jobs stay queryable until they are older than the TTL or pushed
+    out of the bounded history.
+    """
+
+    def __init__(self, workers: int, history: int, ttl: float):
+        self.workers = workers
+        self.history = history
+        self.ttl = ttl
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._queue: asyncio.PriorityQueue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._seq = itertools.count()
+
+    async def start(self) -> None:
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(
+        self,
+        kind: str,
+        func: Callable[[Job], Awaitable[Any]],
+        priority: int = PRIORITY_USER,
+        total: int = 0,
+    ) -> Job:
+        """Queue func(job) and return the job immediately"""
+        self._evict()
+        job = Job(id=uuid.uuid4().hex, kind=kind, priority=priority, total=total)
+        self._jobs[job.id] = job
+        self._queue.put_nowait((priority, next(self._seq), job, func))
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        self._evict()
+        return self._jobs.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job, func = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await func(job)
+                job.status = "done"
+                if job.total:
+                    job.progress = job.total
+            except Exception as e:
+                logger.exception("Job %s (%s) failed: %s", job.id, job.kind, e)
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
+
+    def _evict(self) -> None:
+        """Drop finished jobs past the TTL, then the oldest beyond the bound"""
+        cutoff = time.time() - self.ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) <= self.history:
+                break
+            if job.finished_at is not None:
+                del self._jobs[job_id]
+
+
+job_manager = JobManager(settings.job_workers, settings.job_history, settings.job_ttl)
@@ -0,0 +1,124 @@
+import os
+import threading
+import uuid
+from collections import deque
+
+from core.config import settings
+from core.logger import logger
+from core.service import pki
+from core.service.metrics import KEY_POOL_KEYS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+POOL_DIR = os.path.join(os.path.dirname(os.path.dirname(BASE_DIR)), "data", "keypool")
+
+
+class KeyPool:
+    """Bounded on-disk pool of pre-generated client private keys.
+
+    Keys live in a root-only directory (0700, files 0600) named after the key
+    spec they were generated with, so a CA algorithm change never hands out a
+    mismatched key. A background thread refills the pool from the low to the
+    high watermark while the node is idle.
+    """
+
+    def __init__(self, path: str, low: int, high: int):
+        self.path = path
+        self.low = low
+        self.high = high
+        self._keys: deque[str] = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.high <= 0 or self._thread is not None:
+            return
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        os.chmod(self.path, 0o700)
+        with self._lock:
+            self._keys = deque(
+                sorted(f for f in os.listdir(self.path) if f.endswith(".pem"))
+            )
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="keypool-refill", daemon=True
+        )
+        self._thread.start()
+        logger.info("Key pool started with %d keys", len(self._keys))
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def take(self, spec: tuple[str, int | str]) -> bytes | None:
+        """Pop a key generated for spec, or None when the pool has none"""
+        prefix = _spec_prefix(spec)
+        key_pem = None
+        with self._lock:
+            while self._keys:
+                filename = self._keys.popleft()
+                path = os.path.join(self.path, filename)
+                try:
+                    if filename.startswith(prefix):
+                        with open(path, "rb") as f:
+                            key_pem = f.read()
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning("Dropping unreadable pooled key %s: %s", path, e)
+                    key_pem = None
+                if key_pem:
+                    break
+            remaining = len(self._keys)
+        if remaining < self.low:
+            self._wakeup.set()
+        return key_pem
+
+    def _put(self, spec: tuple[str, int | str], key_pem: bytes) -> None:
+        filename = f"{_spec_prefix(spec)}{uuid.uuid4().hex}.pem"
+        path = os.path.join(self.path, filename)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key_pem)
+        with self._lock:
+            self._keys.append(filename)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if len(self._keys) < self.low:
+                try:
+                    self._refill()
+                except Exception as e:
+                    logger.error("Key pool refill failed: %s", e)
+            self._wakeup.wait(timeout=settings.keypool_check_interval)
+            self._wakeup.clear()
+
+    def _refill(self) -> None:
+        if not pki.native_pki_available():
+            return
+        spec = pki.client_key_spec()
+        while len(self._keys) < self.high and not self._stop.is_set():
+            if not _node_is_idle():
+                self._stop.wait(timeout=1)
+                continue
+            self._put(spec, pki.generate_client_key(*spec))
+        logger.info("Key pool refilled to %d keys", len(self._keys))
+
+
+def _spec_prefix(spec: tuple[str, int | str]) -> str:
+    return f"{spec[0]}-{spec[1]}-"
+
+
+def _node_is_idle() -> bool:
+    """Treat the node as idle while the 1-minute load is below the threshold"""
+    return os.getloadavg()[0] < (os.cpu_count() or 1) * settings.keypool_idle_load
+
+
+key_pool = KeyPool(POOL_DIR, settings.keypool_low, settings.keypool_high)
+KEY_POOL_KEYS.set_function(lambda: len(key_pool))
@@ -0,0 +1,391 @@
+import asyncio
+import socket
+from collections import deque
+from typing import Callable
+
+from core.config import settings
+from core.logger import logger
+
+
+def _connect(address: str, timeout: float) -> socket.socket:
+    """Open a connection to the management interface (unix socket or host:port)"""
+    if address.startswith("/"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        return sock
+    host, _, port = address.rpartition(":")
+    return socket.create_connection((host, int(port)), timeout=timeout)
+
+
+def send_command(
+    command: str, timeout: float = 3.0, address: str | None = None
+) -> str | None:
+    """Send a single-line command and return its SUCCESS/ERROR reply.
+
+    Returns None if the management interface is not reachable.
+    """
+    try:
+        with _connect(address or settings.management_address, timeout) as sock:
+            stream = sock.makefile("rw", encoding="utf-8", newline="\n")
+            stream.write(f"{command}\n")
+            stream.flush()
+            for line in stream:
+                line = line.rstrip("\r\n")
+                if line.startswith(("SUCCESS:", "ERROR:")):
+                    stream.write("quit\n")
+                    stream.flush()
+                    return line
+    except OSError as e:
+        logger.warning("OpenVPN management interface unavailable: %s", e)
+    return None
+
+
+def kill_client(name: str) -> bool:
+    """Disconnect every session of a common name, leaving other clients alone.
+
+    A client is connected to one instance only, so a SUCCESS from any of
+    them is enough. Returns False if none succeeded and some instance could
+    not be reached, as the sessions may be on that one.
+    """
+    try:
+        replies = management_client.run_threadsafe(management_client.kill(name))
+    except Exception:
+        replies = [
+            send_command(f"kill {name}", address=client.address)
+            for client in management_client.clients
+        ]
+    killed = any(reply and reply.startswith("SUCCESS:") for reply in replies)
+    if not killed and None in replies:
+        return False
+    logger.info("Management kill '%s': %s", name, "; ".join(map(str, replies)))
+    return True
+
+
+def _run_threadsafe(loop: asyncio.AbstractEventLoop | None, coro, timeout: float):
+    """Run coro on loop from a worker thread and wait for its result"""
+    if loop is None:
+        coro.close()
+        raise ConnectionError("management interface not started")
+    try:
+        on_loop = asyncio.get_running_loop() is loop
+    except RuntimeError:
+        on_loop = False
+    if on_loop:
+        coro.close()
+        raise RuntimeError("run_threadsafe called from the event loop thread")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+# Commands whose reply is a block of lines terminated by END rather than a
+# single SUCCESS:/ERROR: line.
+_MULTILINE_COMMANDS = {"status", "help", "version"}
+_MULTILINE_WITH_ARG = {"state", "log", "echo"}
+
+
+class ManagementClient:
+    """Persistent asyncio client for the OpenVPN management interface.
+
+    Keeps one connection open and reconnects with backoff. Commands are
+    pipelined: they are written as soon as they are issued and replies are
+    matched to them in order. Real-time notifications (">CLIENT:",
+    ">BYTECOUNT_CLI:", ...) are fanned out to subscribers by their type.
+    """
+
+    def __init__(self, address: str, instance: int = 0):
+        self.address = address
+        self.instance = instance
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._pending: deque[tuple[asyncio.Future, bool, list[str]]] = deque()
+        self._subscribers: dict[str, set[Callable]] = {}
+        self._client_event: dict | None = None
+        self._bytecount_interval = 0
+        self._connected = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._close()
+
+    def subscribe(self, kind: str, callback: Callable) -> Callable[[], None]:
+        """Call callback for every notification of kind (e.g. "CLIENT").
+
+        Returns a function that removes the subscription.
+        """
+        self._subscribers.setdefault(kind, set()).add(callback)
+        return lambda: self.unsubscribe(kind, callback)
+
+    def unsubscribe(self, kind: str, callback: Callable) -> None:
+        self._subscribers.get(kind, set()).discard(callback)
+
+    async def command(self, command: str, timeout: float = 10.0) -> list[str]:
+        """Send a command and return its reply lines (without the END marker)"""
+        if not self.connected:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((future, _is_multiline(command), []))
+        self._writer.write(f"{command}\n".encode())
+        await self._writer.drain()
+        return await asyncio.wait_for(future, timeout)
+
+    async def status(self) -> list[str]:
+        return await self.command("status 3")
+
+    async def kill(self, name: str) -> str:
+        return (await self.command(f"kill {name}"))[0]
+
+    async def client_kill(self, cid: int | str) -> str:
+        return (await self.command(f"client-kill {cid}"))[0]
+
+    async def load_stats(self) -> dict[str, int]:
+        reply = (await self.command("load-stats"))[0]
+        stats = {}
+        for item in reply.removeprefix("SUCCESS:").strip().split(","):
+            key, _, value = item.partition("=")
+            if value.isdigit():
+                stats[key] = int(value)
+        return stats
+
+    async def bytecount(self, interval: int) -> str:
+        """Enable >BYTECOUNT_CLI notifications every interval seconds (0 = off)"""
+        self._bytecount_interval = interval
+        return (await self.command(f"bytecount {interval}"))[0]
+
+    def run_threadsafe(self, coro, timeout: float = 10.0):
+        """Run a client coroutine from a worker thread and wait for its result"""
+        if not self.connected:
+            coro.close()
+            raise ConnectionError("management interface not connected")
+        return _run_threadsafe(self._loop, coro, timeout)
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                await self._connect()
+                backoff = 1.0
+                logger.info("Connected to OpenVPN management at %s", self.address)
+                if self._bytecount_interval:
+                    self._writer.write(
+                        f"bytecount {self._bytecount_interval}\n".encode()
+                    )
+                    self._pending.append(
+                        (asyncio.get_running_loop().create_future(), False, [])
+                    )
+                await self._read_loop()
+            except asyncio.CancelledError:
+                raise
+            except OSError as e:
+                logger.debug("Management connection failed: %s", e)
+            self._close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    async def _connect(self) -> None:
+        if self.address.startswith("/"):
+            self._reader, self._writer = await asyncio.open_unix_connection(
+                self.address
+            )
+        else:
+            host, _, port = self.address.rpartition(":")
+            self._reader, self._writer = await asyncio.open_connection(host, int(port))
+        self._connected.set()
+
+    async def _read_loop(self) -> None:
+        while True:
+            raw = await self._reader.readline()
+            if not raw:
+                raise ConnectionResetError("management interface closed")
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            if line.startswith(">"):
+                self._notify(line[1:])
+            elif self._pending:
+                self._reply(line)
+
+    def _reply(self, line: str) -> None:
+        future, multiline, lines = self._pending[0]
+        if not multiline or (not lines and line.startswith("ERROR:")):
+            lines.append(line)
+        elif line != "END":
+            lines.append(line)
+            return
+        self._pending.popleft()
+        if not future.done():
+            future.set_result(lines)
+
+    def _notify(self, line: str) -> None:
+        kind, _, payload = line.partition(":")
+        if kind == "CLIENT":
+            # >CLIENT:<EVENT>,... is followed by >CLIENT:ENV,k=v lines and
+            # >CLIENT:ENV,END; deliver them as one event.
+            if payload.startswith("ENV,"):
+                if self._client_event is None:
+                    return
+                env = payload[4:]
+                if env == "END":
+                    event, self._client_event = self._client_event, None
+                    self._publish(kind, event)
+                else:
+                    key, _, value = env.partition("=")
+                    self._client_event["env"][key] = value
+                return
+            event, *args = payload.split(",")
+            self._client_event = {
+                "event": event,
+                "args": args,
+                "env": {},
+                "instance": self.instance,
+            }
+            return
+        self._publish(kind, payload)
+
+    def _publish(self, kind: str, payload) -> None:
+        for callback in list(self._subscribers.get(kind, ())):
+            try:
+                result = callback(payload)
+                if asyncio.iscoroutine(result):
+                    asyncio.create_task(result)
+            except Exception as e:
+                logger.error("Management subscriber for %s failed: %s", kind, e)
+
+    def _close(self) -> None:
+        self._connected.clear()
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        self._client_event = None
+        while self._pending:
+            future, _, _ = self._pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError("management connection lost"))
+
+
+def _is_multiline(command: str) -> bool:
+    word, _, arg = command.strip().partition(" ")
+    if word in _MULTILINE_COMMANDS:
+        return True
+    return word in _MULTILINE_WITH_ARG and arg.strip() not in ("on", "off", "")
+
+
+class ManagementPool:
+    """One ManagementClient per OpenVPN server instance, used as one.
+
+    Subscriptions apply to every instance (CLIENT events carry the index of
+    the instance they came from), status is collected per instance and a
+    kill is sent to all of them.
+    """
+
+    def __init__(self, addresses: list[str]):
+        self._subscriptions: list[tuple[str, Callable]] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.clients: list[ManagementClient] = []
+        self.configure(addresses)
+
+    def configure(self, addresses: list[str]) -> None:
+        """Set the instance addresses.
+
+        Once started, the old clients are stopped and the new ones started
+        on the event loop; call it from a worker thread then.
+        """
+        clients = [
+            ManagementClient(address, instance)
+            for instance, address in enumerate(addresses)
+        ]
+        for kind, callback in self._subscriptions:
+            for client in clients:
+                client.subscribe(kind, callback)
+        if self._loop is None:
+            self.clients = clients
+        else:
+            _run_threadsafe(self._loop, self._replace(clients), 30.0)
+
+    async def _replace(self, clients: list[ManagementClient]) -> None:
+        old, self.clients = self.clients, clients
+        for client in old:
+            await client.stop()
+        for client in clients:
+            await client.start()
+
+    @property
+    def connected(self) -> bool:
+        return any(client.connected for client in self.clients)
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        for client in self.clients:
+            await client.start()
+
+    async def stop(self) -> None:
+        for client in self.clients:
+            await client.stop()
+        self._loop = None
+
+    def subscribe(self, kind: str, callback: Callable) -> Callable[[], None]:
+        self._subscriptions.append((kind, callback))
+        for client in self.clients:
+            client.subscribe(kind, callback)
+
+        def unsubscribe() -> None:
+            if (kind, callback) in self._subscriptions:
+                self._subscriptions.remove((kind, callback))
+            # The clients may have been replaced since subscribing
+            for client in self.clients:
+                client.unsubscribe(kind, callback)
+
+        return unsubscribe
+
+    async def statuses(self) -> dict[int, list[str]]:
+        """status 3 of every reachable instance, by instance index"""
+        connected = [client for client in self.clients if client.connected]
+        replies = await asyncio.gather(
+            *(client.status() for client in connected), return_exceptions=True
+        )
+        statuses = {}
+        for client, reply in zip(connected, replies):
+            if isinstance(reply, (ConnectionError, asyncio.TimeoutError)):
+                logger.debug("status 3 on %s failed: %s", client.address, reply)
+            elif isinstance(reply, BaseException):
+                raise reply
+            else:
+                statuses[client.instance] = reply
+        return statuses
+
+    async def kill(self, name: str) -> list[str | None]:
+        """Kill name on every instance; None for an instance not reachable"""
+
+        async def kill_on(client: ManagementClient) -> str | None:
+            if not client.connected:
+                return None
+            try:
+                return await client.kill(name)
+            except (ConnectionError, asyncio.TimeoutError):
+                return None
+
+        return list(await asyncio.gather(*(kill_on(c) for c in self.clients)))
+
+    def run_threadsafe(self, coro, timeout: float = 10.0):
+        """Run a pool coroutine from a worker thread and wait for its result"""
+        if not self.connected:
+            coro.close()
+            raise ConnectionError("management interface not connected")
+        return _run_threadsafe(self._loop, coro, timeout)
+
+
+management_client = ManagementPool([settings.management_address])
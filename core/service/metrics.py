@@ -0,0 +1,264 @@
+"""Minimal Prometheus metrics: counters, gauges and histograms with labels.
+
+Recording only touches the labelled child it updates, under that child's
+own lock, so hot paths never contend on a registry-wide lock. The text
+exposition format is produced on scrape.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import ContextDecorator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from core.logger import logger
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)  # fmt: skip
+
+_registry: list["_Metric"] = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_str(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, values)] + (
+            [extra] if extra else []
+        )
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _render_child(self, values: tuple, child: _Value) -> list[str]:
+        return [f"{self.name}{self._label_str(values)} {_num(child.value)}"]
+
+
+class Gauge(Counter):
+    """A value that can go up and down, or be read from a callback on scrape"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def render(self) -> list[str]:
+        if self._function is not None:
+            try:
+                self.labels().set(self._function())
+            except Exception as e:
+                logger.debug("Gauge %s callback failed: %s", self.name, e)
+        return super().render()
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer(ContextDecorator):
+    """Observe the wall time of a with-block or a decorated call"""
+
+    def __init__(self, histogram: _Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.histogram.observe(time.perf_counter() - self._start)
+        return False
+
+    def _recreate_cm(self) -> "_Timer":
+        # A fresh timer per decorated call keeps concurrent calls apart
+        return _Timer(self.histogram)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _Histogram:
+        return _Histogram(self.buckets)
+
+    def time(self, *values) -> _Timer:
+        return self.labels(*values).time()
+
+    def _render_child(self, values: tuple, child: _Histogram) -> list[str]:
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _num(bound)
+            labels = self._label_str(values, f'le="{le}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_str(values)} {_num(total)}")
+        lines.append(f"{self.name}_count{self._label_str(values)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+_server: ThreadingHTTPServer | None = None
+
+
+def start_http_server(host: str, port: int) -> None:
+    """Serve /metrics without authentication on a separate port"""
+    global _server
+    if _server is not None or not port:
+        return
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(
+        target=_server.serve_forever, name="metrics-http", daemon=True
+    ).start()
+    logger.info("Serving metrics on %s:%d", host, port)
+
+
+def stop_http_server() -> None:
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+
+REQUEST_DURATION = Histogram(
+    "ovnode_http_request_duration_seconds",
+    "Latency of API requests by route",
+    ("method", "route", "status"),
+)
+REQUEST_ERRORS = Counter(
+    "ovnode_http_request_errors_total",
+    "API requests that failed with a 5xx or an exception",
+    ("route",),
+)
+PHASE_DURATION = Histogram(
+    "ovnode_phase_duration_seconds",
+    "Duration of internal operations (script spawn, CRL rebuild, restart, ...)",
+    ("phase",),
+)
+PROMPT_WAIT = Histogram(
+    "ovnode_script_prompt_wait_seconds",
+    "Time spent waiting for each openvpn-install.sh prompt",
+    ("script", "prompt"),
+)
+ERRORS = Counter("ovnode_errors_total", "Internal failures by kind", ("kind",))
+CONNECTED_CLIENTS = Gauge(
+    "ovnode_connected_clients", "Sessions connected to the OpenVPN server"
+)
+KEY_POOL_KEYS = Gauge(
+    "ovnode_key_pool_keys", "Pre-generated client keys waiting in the pool"
+)
@@ -0,0 +1,430 @@
+import datetime
+import grp
+import os
+import re
+import shutil
+import threading
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+from core.logger import logger
+from core.service.tracing import span
+
+SERVER_DIR = "/etc/openvpn/server"
+PKI_DIR = f"{SERVER_DIR}/easy-rsa/pki"
+CLIENT_COMMON = f"{SERVER_DIR}/client-common.txt"
+TLS_CRYPT_KEY = f"{SERVER_DIR}/tc.key"
+PROFILE_DIR = "/root"
+
+CERT_DAYS = 3650
+
+# Serializes every write to index.txt / serial so the engine never interleaves
+# with itself (or with the install script) on the CA database.
+pki_lock = threading.RLock()
+
+_ca_cache: dict = {}
+
+_CURVES = {
+    "secp256r1": ec.SECP256R1,
+    "secp384r1": ec.SECP384R1,
+    "secp521r1": ec.SECP521R1,
+}
+
+
+class PKIError(Exception):
+    """Raised when a certificate cannot be issued or revoked."""
+
+
+def sanitize_name(name: str) -> str:
+    """Apply the same client name sanitization as openvpn-install.sh"""
+    return re.sub(r"[^0-9a-zA-Z_-]", "_", name)
+
+
+def native_pki_available() -> bool:
+    """Check if the easy-rsa CA files exist so the engine can sign directly"""
+    return all(
+        os.path.exists(path)
+        for path in (
+            f"{PKI_DIR}/ca.crt",
+            f"{PKI_DIR}/private/ca.key",
+            f"{PKI_DIR}/index.txt",
+            CLIENT_COMMON,
+            TLS_CRYPT_KEY,
+        )
+    )
+
+
+def _load_ca() -> tuple:
+    """Load the CA certificate and key, cached until either file changes"""
+    cert_path = f"{PKI_DIR}/ca.crt"
+    key_path = f"{PKI_DIR}/private/ca.key"
+    stamp = (os.stat(cert_path).st_mtime_ns, os.stat(key_path).st_mtime_ns)
+    if _ca_cache.get("stamp") != stamp:
+        with open(cert_path, "rb") as f:
+            cert_pem = f.read()
+        with open(key_path, "rb") as f:
+            key = serialization.load_pem_private_key(f.read(), password=None)
+        _ca_cache.update(
+            stamp=stamp,
+            cert=x509.load_pem_x509_certificate(cert_pem),
+            cert_pem=cert_pem,
+            key=key,
+        )
+    return _ca_cache["cert"], _ca_cache["key"], _ca_cache["cert_pem"]
+
+
+def client_key_spec() -> tuple[str, int | str]:
+    """Return the (algorithm, size/curve) easy-rsa would use, based on the CA key"""
+    _, ca_key, _ = _load_ca()
+    if isinstance(ca_key, ec.EllipticCurvePrivateKey):
+        return "ec", ca_key.curve.name
+    if isinstance(ca_key, ed25519.Ed25519PrivateKey):
+        return "ed25519", 0
+    return "rsa", ca_key.key_size
+
+
+def generate_client_key(algo: str = "rsa", size: int | str = 2048) -> bytes:
+    """Generate a new unencrypted client private key as PKCS#8 PEM"""
+    if algo == "ec":
+        key = ec.generate_private_key(_CURVES[size]())
+    elif algo == "ed25519":
+        key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        key = rsa.generate_private_key(public_exponent=65537, key_size=int(size))
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+
+
+def _sign_client(name: str, key_pem: bytes) -> x509.Certificate:
+    """Sign a client certificate with the same extensions as easy-rsa's client type"""
+    ca_cert, ca_key, _ = _load_ca()
+    # Only the public half is needed and the key was generated by this node, so
+    # the (slow) RSA consistency check would dominate the whole signing step.
+    key = serialization.load_pem_private_key(
+        key_pem, password=None, unsafe_skip_rsa_key_validation=True
+    )
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    try:
+        ca_key_id = ca_cert.extensions.get_extension_for_class(
+            x509.SubjectKeyIdentifier
+        ).value.digest
+    except x509.ExtensionNotFound:
+        ca_key_id = x509.SubjectKeyIdentifier.from_public_key(
+            ca_cert.public_key()
+        ).digest
+
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)]))
+        .issuer_name(ca_cert.subject)
+        .public_key(key.public_key())
+        .serial_number(int.from_bytes(os.urandom(16), "big") >> 1)
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=CERT_DAYS))
+        .add_extension(
+            x509.BasicConstraints(ca=False, path_length=None), critical=False
+        )
+        .add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False
+        )
+        .add_extension(
+            x509.AuthorityKeyIdentifier(
+                key_identifier=ca_key_id,
+                authority_cert_issuer=[x509.DirectoryName(ca_cert.issuer)],
+                authority_cert_serial_number=ca_cert.serial_number,
+            ),
+            critical=False,
+        )
+        .add_extension(
+            x509.ExtendedKeyUsage([ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False
+        )
+        .add_extension(
+            x509.KeyUsage(
+                digital_signature=True,
+                content_commitment=False,
+                key_encipherment=False,
+                data_encipherment=False,
+                key_agreement=False,
+                key_cert_sign=False,
+                crl_sign=False,
+                encipher_only=False,
+                decipher_only=False,
+            ),
+            critical=False,
+        )
+    )
+    algorithm = (
+        None if isinstance(ca_key, ed25519.Ed25519PrivateKey) else hashes.SHA256()
+    )
+    return builder.sign(ca_key, algorithm)
+
+
+def _serial_hex(serial: int) -> str:
+    """Format a serial the way openssl writes it to index.txt"""
+    text = f"{serial:X}"
+    return text if len(text) % 2 == 0 else "0" + text
+
+
+def _index_line(cert: x509.Certificate, name: str) -> str:
+    expiry = cert.not_valid_after_utc.strftime("%y%m%d%H%M%SZ")
+    return f"V\t{expiry}\t\t{_serial_hex(cert.serial_number)}\tunknown\t/CN={name}\n"
+
+
+def _write_file(path: str, data: bytes, mode: int = 0o644) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+
+def _store_client(name: str, cert: x509.Certificate, key_pem: bytes) -> None:
+    """Write issued cert, key and by-serial copy into the easy-rsa layout"""
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+    os.makedirs(f"{PKI_DIR}/certs_by_serial", exist_ok=True)
+    _write_file(f"{PKI_DIR}/issued/{name}.crt", cert_pem)
+    _write_file(
+        f"{PKI_DIR}/certs_by_serial/{_serial_hex(cert.serial_number)}.pem", cert_pem
+    )
+    _write_file(f"{PKI_DIR}/private/{name}.key", key_pem, 0o600)
+
+
+def _append_index(lines: list[str], last_serial: int) -> None:
+    """Append entries to index.txt and advance the serial file, like openssl ca"""
+    with open(f"{PKI_DIR}/index.txt", "a") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(f"{PKI_DIR}/serial.old", "w") as f:
+        f.write(_serial_hex(last_serial) + "\n")
+    with open(f"{PKI_DIR}/serial", "w") as f:
+        f.write(_serial_hex(last_serial + 1) + "\n")
+
+
+def _read_tls_crypt() -> str:
+    with open(TLS_CRYPT_KEY, "r") as f:
+        return _tls_crypt_block(f.read())
+
+
+def _tls_crypt_block(content: str) -> str:
+    start = content.find("-----BEGIN OpenVPN Static key")
+    return content[start:] if start != -1 else content
+
+
+def build_profile(cert_pem: str, key_pem: str) -> str:
+    """Assemble a client .ovpn exactly like new_client() in openvpn-install.sh"""
+    with open(CLIENT_COMMON, "r") as f:
+        common = f.read()
+    _, _, ca_pem = _load_ca()
+    return assemble_profile(
+        common, ca_pem.decode(), cert_pem, key_pem, _read_tls_crypt()
+    )
+
+
+def assemble_profile(
+    common: str, ca_pem: str, cert_pem: str, key_pem: str, tls_crypt: str
+) -> str:
+    """Join client-common.txt and the inline blocks of a client profile"""
+    return (
+        f"{common}"
+        f"<ca>\n{ca_pem}</ca>\n"
+        f"<cert>\n{cert_pem[cert_pem.find('-----BEGIN CERTIFICATE'):]}</cert>\n"
+        f"<key>\n{key_pem}</key>\n"
+        f"<tls-crypt>\n{_tls_crypt_block(tls_crypt)}</tls-crypt>\n"
+    )
+
+
+@span("cert_issue")
+def issue_client(name: str, key_pem: bytes | None = None) -> str:
+    """Issue a client certificate against the easy-rsa CA and write its .ovpn.
+
+    Returns the serial number in index.txt format.
+    """
+    if os.path.exists(f"{PKI_DIR}/issued/{name}.crt"):
+        raise PKIError(f"client '{name}' already exists")
+
+    if key_pem is None:
+        key_pem = generate_client_key(*client_key_spec())
+
+    with pki_lock:
+        if os.path.exists(f"{PKI_DIR}/issued/{name}.crt"):
+            raise PKIError(f"client '{name}' already exists")
+        cert = _sign_client(name, key_pem)
+        _store_client(name, cert, key_pem)
+        _append_index([_index_line(cert, name)], cert.serial_number)
+
+    _write_profile(name, cert, key_pem)
+    logger.info("Issued certificate for '%s' natively", name)
+    return _serial_hex(cert.serial_number)
+
+
+@span("cert_issue")
+def issue_clients(clients: dict[str, bytes]) -> dict[str, str | PKIError]:
+    """Issue several client certificates in one serialized pass over index.txt.
+
+    Keys are passed in pre-generated and the index/serial files are written once
+    for the whole batch. Returns the serial per name, or the PKIError for it.
+    """
+    results: dict[str, str | PKIError] = {}
+    issued = []
+    with pki_lock:
+        for name, key_pem in clients.items():
+            if os.path.exists(f"{PKI_DIR}/issued/{name}.crt"):
+                results[name] = PKIError(f"client '{name}' already exists")
+                continue
+            try:
+                cert = _sign_client(name, key_pem)
+                _store_client(name, cert, key_pem)
+            except Exception as e:
+                results[name] = PKIError(str(e))
+                continue
+            issued.append((name, cert, key_pem))
+
+        if issued:
+            _append_index(
+                [_index_line(cert, name) for name, cert, _ in issued],
+                issued[-1][1].serial_number,
+            )
+
+    for name, cert, key_pem in issued:
+        try:
+            _write_profile(name, cert, key_pem)
+        except Exception as e:
+            logger.error("Error writing profile for '%s': %s", name, e)
+        results[name] = _serial_hex(cert.serial_number)
+    logger.info("Issued %d certificates natively", len(issued))
+    return results
+
+
+def _write_profile(name: str, cert: x509.Certificate, key_pem: bytes) -> None:
+    profile = build_profile(
+        cert.public_bytes(serialization.Encoding.PEM).decode(), key_pem.decode()
+    )
+    _write_file(f"{PROFILE_DIR}/{name}.ovpn", profile.encode())
+
+
+def revoke_clients(names: list[str]) -> dict[str, str | PKIError]:
+    """Revoke several clients in index.txt and regenerate crl.pem once.
+
+    Mirrors `easyrsa revoke` for each name plus a single `easyrsa gen-crl`,
+    and removes the key and request files like openvpn-install.sh does.
+    Returns the revoked serial per name, or the PKIError for it.
+    """
+    results: dict[str, str | PKIError] = {}
+    revoked_at = datetime.datetime.now(datetime.timezone.utc)
+    with pki_lock:
+        with open(f"{PKI_DIR}/index.txt", "r") as f:
+            lines = f.readlines()
+
+        # The first entry is the server certificate and is never offered
+        # for revocation, the same as the script's client list.
+        valid = {}
+        for number, line in enumerate(lines[1:], start=1):
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) == 6 and fields[0] == "V":
+                valid[fields[5].split("CN=", 1)[-1]] = number
+
+        revoked = []
+        for name in names:
+            number = valid.pop(name, None)
+            if number is None:
+                results[name] = PKIError(f"client '{name}' not found")
+                continue
+            fields = lines[number].rstrip("\n").split("\t")
+            fields[0] = "R"
+            fields[2] = revoked_at.strftime("%y%m%d%H%M%SZ")
+            lines[number] = "\t".join(fields) + "\n"
+            revoked.append((name, fields[3]))
+
+        if revoked:
+            _replace_file(
+                f"{PKI_DIR}/index.txt", "".join(lines).encode(), keep_old=True
+            )
+            for name, serial in revoked:
+                _archive_revoked(name, serial)
+            generate_crl()
+
+    for name, serial in revoked:
+        results[name] = serial
+    logger.info("Revoked %d certificates natively", len(revoked))
+    return results
+
+
+def _replace_file(path: str, data: bytes, keep_old: bool = False) -> None:
+    """Atomically replace path with data (temp file + rename)"""
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if keep_old and os.path.exists(path):
+        shutil.copy2(path, f"{path}.old")
+    os.replace(tmp_path, path)
+
+
+def _archive_revoked(name: str, serial: str) -> None:
+    """Move the issued cert under revoked/ and drop the key and request"""
+    os.makedirs(f"{PKI_DIR}/revoked/certs_by_serial", exist_ok=True)
+    issued = f"{PKI_DIR}/issued/{name}.crt"
+    if os.path.exists(issued):
+        os.replace(issued, f"{PKI_DIR}/revoked/certs_by_serial/{serial}.crt")
+    for path in (
+        f"{PKI_DIR}/certs_by_serial/{serial}.pem",
+        f"{PKI_DIR}/private/{name}.key",
+        f"{PKI_DIR}/reqs/{name}.req",
+    ):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@span("crl_rebuild")
+def generate_crl() -> None:
+    """Rebuild crl.pem from index.txt and install it for the OpenVPN server"""
+    ca_cert, ca_key, _ = _load_ca()
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    builder = (
+        x509.CertificateRevocationListBuilder()
+        .issuer_name(ca_cert.subject)
+        .last_update(now)
+        .next_update(now + datetime.timedelta(days=CERT_DAYS))
+    )
+    with open(f"{PKI_DIR}/index.txt", "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 6 or fields[0] != "R":
+                continue
+            revoked_at = datetime.datetime.strptime(
+                fields[2].split(",")[0], "%y%m%d%H%M%SZ"
+            ).replace(tzinfo=datetime.timezone.utc)
+            builder = builder.add_revoked_certificate(
+                x509.RevokedCertificateBuilder()
+                .serial_number(int(fields[3], 16))
+                .revocation_date(revoked_at)
+                .build()
+            )
+
+    algorithm = (
+        None if isinstance(ca_key, ed25519.Ed25519PrivateKey) else hashes.SHA256()
+    )
+    crl_pem = builder.sign(ca_key, algorithm).public_bytes(serialization.Encoding.PEM)
+    _replace_file(f"{PKI_DIR}/crl.pem", crl_pem)
+    _replace_file(f"{SERVER_DIR}/crl.pem", crl_pem)
+    try:
+        group = "nogroup" if _group_exists("nogroup") else "nobody"
+        shutil.chown(f"{SERVER_DIR}/crl.pem", "nobody", group)
+    except (LookupError, PermissionError) as e:
+        logger.warning("Could not chown crl.pem: %s", e)
+    logger.info("CRL regenerated")
+
+
+def _group_exists(name: str) -> bool:
+    try:
+        grp.getgrnam(name)
+        return True
+    except KeyError:
+        return False
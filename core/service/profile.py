@@ -0,0 +1,216 @@
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+try:
+    import brotli
+except ImportError:  # optional: br is only offered when installed
+    brotli = None
+
+from core.config import settings
+from core.service import pki
+
+# Archive bytes are handed to the response once this much has accumulated.
+BUNDLE_CHUNK = 256 * 1024
+
+# Content codings offered for downloads, in order of preference.
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+@dataclass
+class Profile:
+    data: bytes
+    etag: str
+    last_modified: float
+    _encoded: dict[str, bytes] = field(default_factory=dict, repr=False)
+
+    def encoded(self, encoding: str) -> bytes:
+        """The profile compressed with gzip or br, computed once per profile"""
+        if encoding not in self._encoded:
+            if encoding == "br":
+                self._encoded[encoding] = brotli.compress(self.data)
+            else:
+                self._encoded[encoding] = gzip.compress(self.data, mtime=0)
+        return self._encoded[encoding]
+
+
+class ProfileRenderer:
+    """Build client .ovpn profiles from the PKI at request time.
+
+    Rendered bytes are cached per client and keyed on the (mtime, size) of
+    every input file: client-common.txt, the CA, the client cert and key and
+    the tls-crypt key. A settings change rewrites client-common.txt, so every
+    cached profile goes stale at once without touching any .ovpn on disk.
+    The cache is an LRU bounded by the total size of the stored profiles.
+    Each profile carries a content hash for ETags and the newest input mtime
+    for Last-Modified, so conditional requests are answered from memory.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[str, tuple[tuple, Profile]] = OrderedDict()
+        self._size = 0
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _inputs(name: str) -> tuple[str, ...]:
+        return (
+            pki.CLIENT_COMMON,
+            f"{pki.PKI_DIR}/ca.crt",
+            f"{pki.PKI_DIR}/issued/{name}.crt",
+            f"{pki.PKI_DIR}/private/{name}.key",
+            pki.TLS_CRYPT_KEY,
+        )
+
+    @staticmethod
+    def _stamp(paths: tuple[str, ...]) -> tuple | None:
+        try:
+            return tuple(
+                (st.st_mtime_ns, st.st_size) for st in (os.stat(p) for p in paths)
+            )
+        except FileNotFoundError:
+            return None
+
+    def render(self, name: str, store: bool = True) -> Profile | None:
+        """Return the profile for name, or None if the client has no valid cert.
+
+        With store=False a cached profile is still used but a freshly rendered
+        one is not kept, so bulk exports do not flush the cache.
+        """
+        name = pki.sanitize_name(name)
+        paths = self._inputs(name)
+        stamp = self._stamp(paths)
+        if stamp is None:
+            return None
+        with self._lock:
+            entry = self._cache.get(name)
+            if entry is not None and entry[0] == stamp:
+                self._cache.move_to_end(name)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+
+        try:
+            contents = []
+            for path in paths:
+                with open(path, "r") as f:
+                    contents.append(f.read())
+        except FileNotFoundError:
+            return None
+        common, ca_pem, cert_pem, key_pem, tls_crypt = contents
+        data = pki.assemble_profile(
+            common, ca_pem, cert_pem, key_pem, tls_crypt
+        ).encode()
+        profile = Profile(
+            data=data,
+            etag=hashlib.sha256(data).hexdigest()[:32],
+            last_modified=max(mtime for mtime, _ in stamp) / 1e9,
+        )
+
+        # Re-stat so a file replaced while reading is never cached under the
+        # new stamp with the old content.
+        if store and self._stamp(paths) == stamp:
+            self._store(name, stamp, profile)
+        return profile
+
+    def invalidate(self, name: str | None = None) -> None:
+        """Drop one client's profile, or all of them"""
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+                self._size = 0
+            else:
+                entry = self._cache.pop(pki.sanitize_name(name), None)
+                if entry is not None:
+                    self._size -= len(entry[1].data)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self.stats, entries=len(self._cache), bytes=self._size)
+
+    def _store(self, name: str, stamp: tuple, profile: Profile) -> None:
+        if len(profile.data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._cache.pop(name, None)
+            if old is not None:
+                self._size -= len(old[1].data)
+            self._cache[name] = (stamp, profile)
+            self._size += len(profile.data)
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._size -= len(evicted.data)
+
+
+class _ChunkWriter:
+    """Write-only file object whose contents are drained by the caller"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks, self.size = [], 0
+        return data
+
+
+def iter_bundle(names: Iterable[str], fmt: str = "zip") -> Iterator[bytes]:
+    """Stream a zip or tar.gz archive holding the profiles of the given clients.
+
+    Profiles are rendered one at a time and the archive is handed out as it
+    grows, so memory stays flat however many clients are exported. Names
+    without a valid certificate are listed in missing.txt at the end.
+    """
+    out = _ChunkWriter()
+    if fmt == "zip":
+        archive = zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED)
+    else:
+        archive = tarfile.open(fileobj=out, mode="w|gz")
+    missing = []
+    try:
+        for name in names:
+            profile = profile_renderer.render(name, store=False)
+            if profile is None:
+                missing.append(name)
+                continue
+            _add_member(archive, f"{name}.ovpn", profile.data)
+            if out.size >= BUNDLE_CHUNK:
+                yield out.take()
+        if missing:
+            _add_member(archive, "missing.txt", ("\n".join(missing) + "\n").encode())
+    finally:
+        archive.close()
+    yield out.take()
+
+
+def _add_member(archive, filename: str, data: bytes) -> None:
+    if isinstance(archive, zipfile.ZipFile):
+        info = zipfile.ZipInfo(filename, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o600 << 16
+        archive.writestr(info, data)
+    else:
+        info = tarfile.TarInfo(filename)
+        info.size, info.mtime, info.mode = len(data), int(time.time()), 0o600
+        archive.addfile(info, io.BytesIO(data))
+
+
+profile_renderer = ProfileRenderer(settings.profile_cache_bytes)
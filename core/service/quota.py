@@ -0,0 +1,223 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+
+from core.config import settings
+from core.logger import logger
+from core.service.connections import connection_monitor
+from core.service.executor import run_fast, run_slow
+from core.service.registry import CCD_DIR, registry
+from core.service.traffic import traffic
+from core.service.user_managment import change_user_status
+
+
+@dataclass
+class Limit:
+    name: str
+    data_limit: int | None = None
+    expires_at: float | None = None
+    used: int = 0
+    enforced: str | None = None
+
+    def violation(self, used: int, now: float) -> str | None:
+        if self.expires_at is not None and now >= self.expires_at:
+            return "expired"
+        if self.data_limit is not None and used >= self.data_limit:
+            return "quota"
+        return None
+
+
+class QuotaEngine:
+    """Enforce per-user data quotas and expiry dates on the node itself.
+
+    Limits are pushed by the panel and kept in the registry database. Usage
+    is counted from the traffic accounting deltas plus whatever the live
+    sessions moved since the last traffic sample, and checked every
+    QUOTA_INTERVAL seconds. A user over their limit is deactivated through
+    the ccd file and their sessions are killed; raising the limit of a user
+    the node cut off re-activates them. Every action is recorded as an event
+    the panel collects in batches.
+    """
+
+    def __init__(self, interval: float, max_events: int):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._limits: dict[str, Limit] = {}
+        self._dirty: set[str] = set()
+        self._review: set[str] = set()
+        self._events: deque[dict] = deque(maxlen=max_events)
+        # Event ids keep increasing across restarts without being persisted
+        self._event_ids = itertools.count(int(time.time() * 1000))
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            limits = await run_fast(registry.load_limits)
+            with self._lock:
+                self._limits = {row["name"]: Limit(**row) for row in limits}
+            traffic.add_listener(self._on_traffic)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await run_fast(self._flush)
+
+    def set_limits(self, limits: list[dict], replace: bool = False) -> dict:
+        """Create or update limits; with replace, users not listed lose theirs.
+
+        A limit with neither data_limit nor expires_at removes the user's
+        limit. "used" resets the counted usage to the panel's figure.
+        """
+        updated, removed = [], []
+        with self._lock:
+            listed = {item["name"] for item in limits}
+            if replace:
+                removed = [name for name in self._limits if name not in listed]
+            for item in limits:
+                name = item["name"]
+                if item.get("data_limit") is None and item.get("expires_at") is None:
+                    removed.append(name)
+                    continue
+                limit = self._limits.get(name) or Limit(name=name)
+                limit.data_limit = item.get("data_limit")
+                limit.expires_at = item.get("expires_at")
+                if item.get("used") is not None:
+                    limit.used = item["used"]
+                self._limits[name] = limit
+                self._dirty.add(name)
+                self._review.add(name)
+                updated.append(name)
+            for name in removed:
+                self._limits.pop(name, None)
+                self._dirty.discard(name)
+        if removed:
+            registry.delete_limits(removed)
+        self._flush()
+        return {"updated": len(updated), "removed": len(removed)}
+
+    def wake(self) -> None:
+        """Run a check now instead of at the next interval (event loop only)"""
+        self._wakeup.set()
+
+    def get_limits(self, name: str | None = None) -> list[dict]:
+        with self._lock:
+            if name is None:
+                return [asdict(limit) for limit in self._limits.values()]
+            limit = self._limits.get(name)
+            return [asdict(limit)] if limit is not None else []
+
+    def events(self, since: int = 0, limit: int = 1000) -> dict:
+        """Events newer than since, oldest first, and the id to ask from next"""
+        with self._lock:
+            events = [event for event in self._events if event["id"] > since]
+        events = events[:limit]
+        return {
+            "events": events,
+            "last_id": events[-1]["id"] if events else since,
+        }
+
+    def check(self) -> list[tuple[Limit, str | None, int]]:
+        """Return (limit, violation, used) for every user whose state must change"""
+        now = time.time()
+        with self._lock:
+            limits = list(self._limits.values())
+            review, self._review = self._review, set()
+        # Until traffic has sampled the live sessions once, their usage is
+        # not known yet; data limits wait for it, expiry dates do not.
+        ready = traffic.ready
+        actions = []
+        for limit in limits:
+            if limit.data_limit is not None and not ready:
+                continue
+            used = limit.used
+            if limit.data_limit is not None:
+                used += traffic.unsampled(connection_monitor.sessions_of(limit.name))
+            violation = limit.violation(used, now)
+            if violation == limit.enforced:
+                # Something else may have re-activated a user the node cut off
+                # (a status change from the panel, an operator); while the
+                # violation lasts the user is cut off again.
+                if violation is None or not os.path.exists(f"{CCD_DIR}/{limit.name}"):
+                    continue
+            # A cut-off user only comes back when the panel changes the limit;
+            # usage of killed sessions may not be accounted yet.
+            if violation is None and limit.name not in review:
+                continue
+            actions.append((limit, violation, used))
+        return actions
+
+    def apply(self, limit: Limit, violation: str | None, used: int) -> None:
+        """Cut a user off, or restore one the node cut off earlier"""
+        status = "deactivate" if violation else "activate"
+        client = registry.get(limit.name)
+        if client is not None and client["status"] == "valid":
+            if not change_user_status(limit.name, status):
+                logger.error("Could not %s '%s' for its limits", status, limit.name)
+                return
+        with self._lock:
+            reason = violation or limit.enforced
+            limit.enforced = violation
+            self._dirty.add(limit.name)
+            event = {
+                "id": next(self._event_ids),
+                "name": limit.name,
+                "action": "disabled" if violation else "restored",
+                "reason": reason,
+                "used": used,
+                "data_limit": limit.data_limit,
+                "expires_at": limit.expires_at,
+                "at": time.time(),
+            }
+            self._events.append(event)
+        registry.record_change(f"limit_{event['action']}", limit.name, event)
+        logger.info("User '%s' %sd by the node (%s)", limit.name, status, reason)
+
+    def _on_traffic(self, deltas: dict[str, list[int]]) -> None:
+        with self._lock:
+            for name, (received, sent) in deltas.items():
+                limit = self._limits.get(name)
+                if limit is not None:
+                    limit.used += received + sent
+                    self._dirty.add(name)
+
+    def _flush(self) -> None:
+        """Persist the limits that changed since the last flush"""
+        with self._lock:
+            dirty = [
+                asdict(self._limits[name])
+                for name in self._dirty
+                if name in self._limits
+            ]
+            self._dirty.clear()
+        if dirty:
+            registry.save_limits(dirty)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                for limit, violation, used in await run_fast(self.check):
+                    await run_slow(
+                        self.apply, limit, violation, used, keys=[limit.name]
+                    )
+                await run_fast(self._flush)
+            except Exception as e:
+                logger.error("Limit enforcement failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+quota_engine = QuotaEngine(settings.quota_interval, settings.quota_events_max)
@@ -0,0 +1,374 @@
+import calendar
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from core.config import settings
+from core.logger import logger
+from core.service import pki
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(os.path.dirname(os.path.dirname(BASE_DIR)), "data", "clients.db")
+CCD_DIR = "/etc/openvpn/ccd"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    name TEXT PRIMARY KEY,
+    serial TEXT NOT NULL,
+    status TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    cert_path TEXT,
+    key_path TEXT,
+    ccd INTEGER NOT NULL DEFAULT 0,
+    profile_path TEXT,
+    created_at REAL,
+    revoked_at REAL
+);
+CREATE INDEX IF NOT EXISTS clients_status_seq ON clients (status, seq);
+CREATE TABLE IF NOT EXISTS limits (
+    name TEXT PRIMARY KEY,
+    data_limit INTEGER,
+    expires_at REAL,
+    used INTEGER NOT NULL DEFAULT 0,
+    enforced TEXT
+);
+CREATE TABLE IF NOT EXISTS changes (
+    rev INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    name TEXT,
+    data TEXT,
+    at REAL NOT NULL
+);
+"""
+
+
+class ClientRegistry:
+    """Persistent name -> client record index backed by SQLite.
+
+    It is rebuilt from pki/index.txt on startup and whenever index.txt is
+    changed behind our back (e.g. by the install script), so lookups never
+    have to scan the PKI or scrape the script's menu.
+
+    Every change to a client, the settings or an enforcement is also
+    appended to a journal under an increasing revision, so the panel can
+    sync incrementally with changes(since). Only the newest journal_max
+    entries are kept.
+    """
+
+    def __init__(self, path: str, journal_max: int):
+        self.path = path
+        self.journal_max = journal_max
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._index_stamp: tuple | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def rebuild(self) -> int:
+        """Re-read index.txt, the issued certs and the ccd dir into the table"""
+        index_file = f"{pki.PKI_DIR}/index.txt"
+        if not os.path.exists(index_file):
+            return 0
+        with self._lock:
+            stamp = _stat_stamp(index_file)
+            with open(index_file, "r") as f:
+                lines = f.readlines()
+
+            previous = {
+                row["name"]: (row["status"], row["created_at"])
+                for row in self.conn.execute(
+                    "SELECT name, status, created_at FROM clients"
+                )
+            }
+            created = {name: row[1] for name, row in previous.items()}
+            records = {}
+            # The first entry is the server certificate
+            for seq, line in enumerate(lines[1:], start=1):
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 6 or fields[0] not in ("V", "R"):
+                    continue
+                name = fields[5].split("CN=", 1)[-1]
+                cert_path = f"{pki.PKI_DIR}/issued/{name}.crt"
+                if fields[0] == "V":
+                    created_at = created.get(name) or _mtime(cert_path)
+                    records[name] = _record(name, fields[3], "valid", seq, created_at)
+                elif records.get(name, {}).get("status") != "valid":
+                    record = _record(name, fields[3], "revoked", seq, created.get(name))
+                    record["revoked_at"] = _parse_index_time(fields[2])
+                    records[name] = record
+
+            # Changes made behind our back (e.g. by the install script). The
+            # first build of a new database has nothing to compare with; a
+            # snapshot covers it.
+            changes = []
+            if previous or self._index_stamp is not None:
+                for name, record in records.items():
+                    if previous.get(name, (None,))[0] != record["status"]:
+                        kind = "created" if record["status"] == "valid" else "revoked"
+                        changes.append((f"user_{kind}", name, None))
+                for name in previous.keys() - records.keys():
+                    changes.append(("user_revoked", name, None))
+
+            with self._transaction():
+                self.conn.execute("DELETE FROM clients")
+                self.conn.executemany(_INSERT, list(records.values()))
+                self._journal(changes)
+            self._index_stamp = stamp
+        logger.info("Client registry rebuilt with %d entries", len(records))
+        return len(records)
+
+    def refresh(self) -> None:
+        """Rebuild only if index.txt changed since we last saw it"""
+        index_file = f"{pki.PKI_DIR}/index.txt"
+        if os.path.exists(index_file) and _stat_stamp(index_file) != self._index_stamp:
+            self.rebuild()
+
+    def get(self, name: str) -> dict | None:
+        self.refresh()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM clients WHERE name = ?", (name,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def menu_number(self, name: str) -> int | None:
+        """Position of name in the install script's numbered revoke menu"""
+        client = self.get(name)
+        if client is None or client["status"] != "valid":
+            return None
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*) FROM clients WHERE status = 'valid' AND seq <= ?",
+                (client["seq"],),
+            ).fetchone()
+        return row[0]
+
+    def page(
+        self, offset: int = 0, limit: int = 100, status: str | None = None
+    ) -> tuple[int, list[dict]]:
+        self.refresh()
+        where, params = ("WHERE status = ?", [status]) if status else ("", [])
+        with self._lock:
+            total = self.conn.execute(
+                f"SELECT COUNT(*) FROM clients {where}", params
+            ).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT * FROM clients {where} ORDER BY seq LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def names(self, status: str = "valid") -> list[str]:
+        """All client names with the given status, in creation order"""
+        self.refresh()
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT name FROM clients WHERE status = ? ORDER BY seq", (status,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def record_issued(self, serials: dict[str, str]) -> None:
+        """Register clients just issued by the native engine"""
+        with self._lock:
+            seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM clients")
+            next_seq = seq.fetchone()[0] + 1
+            now = time.time()
+            records = []
+            for offset, (name, serial) in enumerate(serials.items()):
+                records.append(_record(name, serial, "valid", next_seq + offset, now))
+            with self._transaction():
+                self.conn.executemany(_REPLACE, records)
+                self._journal([("user_created", name, None) for name in serials])
+            self._mark_seen()
+
+    def record_revoked(self, names: list[str]) -> None:
+        with self._lock:
+            now = time.time()
+            with self._transaction():
+                self.conn.executemany(
+                    "UPDATE clients SET status = 'revoked', revoked_at = ?, ccd = 0 "
+                    "WHERE name = ?",
+                    [(now, name) for name in names],
+                )
+                self._journal([("user_revoked", name, None) for name in names])
+            self._mark_seen()
+
+    def set_ccd(self, name: str, active: bool) -> None:
+        with self._lock:
+            with self._transaction():
+                updated = self.conn.execute(
+                    "UPDATE clients SET ccd = ? WHERE name = ? AND ccd != ?",
+                    (int(active), name, int(active)),
+                ).rowcount
+                if updated:
+                    kind = "user_activated" if active else "user_deactivated"
+                    self._journal([(kind, name, None)])
+
+    def record_change(
+        self, kind: str, name: str | None = None, data: dict | None = None
+    ) -> None:
+        """Journal a change the client table does not hold (settings, limits)"""
+        with self._lock:
+            self._journal([(kind, name, data)])
+
+    def changes(self, since: int = 0, limit: int = 1000) -> dict:
+        """Journal entries after revision since, or a snapshot if they are gone.
+
+        A snapshot is returned for since=0, when entries after since were
+        already dropped from the journal, or when since is ahead of this node
+        (its database was reset). Either way the panel continues from the returned revision.
+        """
+        self.refresh()
+        with self._lock:
+            revision = self._revision()
+            oldest = self.conn.execute("SELECT MIN(rev) FROM changes").fetchone()[0]
+            truncated = oldest is None or oldest > since + 1
+            if since == 0 or since > revision or (since < revision and truncated):
+                clients = self.conn.execute(
+                    "SELECT name, status, ccd FROM clients ORDER BY seq"
+                ).fetchall()
+                limits = self.conn.execute("SELECT * FROM limits").fetchall()
+                return {
+                    "revision": revision,
+                    "snapshot": True,
+                    "users": [dict(row) for row in clients],
+                    "limits": [dict(row) for row in limits],
+                }
+            rows = self.conn.execute(
+                "SELECT * FROM changes WHERE rev > ? ORDER BY rev LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        changes = [
+            dict(row, data=json.loads(row["data"]) if row["data"] else None)
+            for row in rows
+        ]
+        last = changes[-1]["rev"] if changes else since
+        return {
+            "revision": last,
+            "snapshot": False,
+            "changes": changes,
+            "more": last < revision,
+        }
+
+    def load_limits(self) -> list[dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM limits").fetchall()
+        return [dict(row) for row in rows]
+
+    def save_limits(self, limits: list[dict]) -> None:
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO limits "
+                "(name, data_limit, expires_at, used, enforced) "
+                "VALUES (:name, :data_limit, :expires_at, :used, :enforced)",
+                limits,
+            )
+
+    def delete_limits(self, names: list[str]) -> None:
+        with self._lock:
+            self.conn.executemany(
+                "DELETE FROM limits WHERE name = ?", [(name,) for name in names]
+            )
+
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute("BEGIN")
+        try:
+            yield
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _journal(self, changes: list[tuple[str, str | None, dict | None]]) -> None:
+        """Append changes and drop the entries beyond journal_max (lock held)"""
+        if not changes:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO changes (kind, name, data, at) VALUES (?, ?, ?, ?)",
+            [
+                (kind, name, json.dumps(data) if data is not None else None, now)
+                for kind, name, data in changes
+            ],
+        )
+        self.conn.execute(
+            "DELETE FROM changes WHERE rev <= ?",
+            (self._revision() - self.journal_max,),
+        )
+
+    def _revision(self) -> int:
+        row = self.conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'changes'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _mark_seen(self) -> None:
+        index_file = f"{pki.PKI_DIR}/index.txt"
+        if os.path.exists(index_file):
+            self._index_stamp = _stat_stamp(index_file)
+
+
+_COLUMNS = (
+    "name, serial, status, seq, cert_path, key_path, ccd, profile_path, "
+    "created_at, revoked_at"
+)
+_VALUES = (
+    ":name, :serial, :status, :seq, :cert_path, :key_path, :ccd, :profile_path, "
+    ":created_at, :revoked_at"
+)
+_INSERT = f"INSERT INTO clients ({_COLUMNS}) VALUES ({_VALUES})"
+_REPLACE = f"INSERT OR REPLACE INTO clients ({_COLUMNS}) VALUES ({_VALUES})"
+
+
+def _record(
+    name: str, serial: str, status: str, seq: int, created_at: float | None
+) -> dict:
+    return {
+        "name": name,
+        "serial": serial,
+        "status": status,
+        "seq": seq,
+        "cert_path": f"{pki.PKI_DIR}/issued/{name}.crt",
+        "key_path": f"{pki.PKI_DIR}/private/{name}.key",
+        "ccd": int(status == "valid" and os.path.exists(f"{CCD_DIR}/{name}")),
+        "profile_path": f"{pki.PROFILE_DIR}/{name}.ovpn",
+        "created_at": created_at,
+        "revoked_at": None,
+    }
+
+
+def _stat_stamp(path: str) -> tuple:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _mtime(path: str) -> float | None:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _parse_index_time(value: str) -> float | None:
+    try:
+        return calendar.timegm(time.strptime(value.split(",")[0], "%y%m%d%H%M%SZ"))
+    except ValueError:
+        return None
+
+
+registry = ClientRegistry(DB_FILE, settings.change_journal_max)
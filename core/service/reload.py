@@ -0,0 +1,114 @@
+import subprocess
+import threading
+
+from core.config import settings
+from core.logger import logger
+from core.service.metrics import ERRORS
+from core.service.tracing import span
+
+OPENVPN_UNIT = "openvpn-server@server"
+
+
+class ReloadScheduler:
+    """Coalesce OpenVPN restart/reconnect requests into one action per window.
+
+    The first request opens a window; everything requested until it closes is
+    served by a single action. A reconnect (SIGUSR1) drops every session but
+    keeps the tun device and keys thanks to persist-tun/persist-key, so it
+    works after OpenVPN has dropped root. It is used unless any request in
+    the window needed a full restart, i.e. a server.conf change. SIGHUP is
+    never sent: it re-opens tun and re-reads the keys, which fails as
+    nobody/nogroup and stops the server. The action is applied to every
+    OpenVPN server unit in units.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self.units = [OPENVPN_UNIT]
+        self._lock = threading.Lock()
+        self._pending: str | None = None
+        self._timer: threading.Timer | None = None
+        # Restarts attempted, failed ones included
+        self._restarts_run = 0
+        self.stats = {
+            "requested": 0,
+            "restart_requests": 0,
+            "restarts": 0,
+            "reconnects": 0,
+            "coalesced": 0,
+            "failed": 0,
+        }
+
+    def request(self, restart: bool = False) -> None:
+        """Schedule a reconnect of all sessions, or a full restart if restart"""
+        with self._lock:
+            self.stats["requested"] += 1
+            if restart:
+                self.stats["restart_requests"] += 1
+            if self._pending is not None:
+                self.stats["coalesced"] += 1
+            if restart or self._pending == "restart":
+                self._pending = "restart"
+            else:
+                self._pending = "reconnect"
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self._fire)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """Run any pending action now instead of waiting for the window"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        self._fire()
+
+    def summary(self) -> dict:
+        """Counters plus how many restarts were avoided versus one per request.
+
+        Only restart requests count: a reconnect request never costs a
+        restart, whether or not its window ends in one.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["restarts_saved"] = stats["restart_requests"] - self._restarts_run
+        return stats
+
+    def _fire(self) -> None:
+        with self._lock:
+            action, self._pending, self._timer = self._pending, None, None
+        if action is None:
+            return
+        if action == "restart":
+            with self._lock:
+                self._restarts_run += 1
+            command = ["/usr/bin/systemctl", "restart", *self.units]
+        else:
+            command = [
+                "/usr/bin/systemctl",
+                "kill",
+                "--kill-who=main",
+                "-s",
+                "SIGUSR1",
+                *self.units,
+            ]
+        try:
+            logger.info("Running OpenVPN %s...", action)
+            with span(f"openvpn_{action}"):
+                subprocess.run(command, check=True, timeout=30)
+            with self._lock:
+                self.stats[f"{action}s"] += 1
+            logger.info("OpenVPN %s completed successfully.", action)
+        except subprocess.TimeoutExpired:
+            ERRORS.labels(f"openvpn_{action}").inc()
+            with self._lock:
+                self.stats["failed"] += 1
+            logger.error("Timeout during OpenVPN %s", action)
+        except Exception as e:
+            ERRORS.labels(f"openvpn_{action}").inc()
+            with self._lock:
+                self.stats["failed"] += 1
+            logger.error("Error during OpenVPN %s: %s", action, e)
+
+
+reload_scheduler = ReloadScheduler(settings.reload_window)
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from core.config import settings
+
+
+class SingleFlight:
+    """Collapse duplicate in-flight operations into one execution.
+
+    Callers asking for a key that is already running attach to that run and
+    get its result. The run is a task of its own, so a caller disconnecting
+    does not cancel the work the others are waiting on. Successful results
+    can also be remembered per idempotency key for a limited window; a
+    failure is not, so a retry after a transient error runs again.
+    """
+
+    def __init__(self, window: float, max_entries: int):
+        self.window = window
+        self.max_entries = max_entries
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self._results: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def idempotent(
+        self,
+        operation: str,
+        idempotency_key: str | None,
+        func: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Run func until it succeeds once per (operation, idempotency key).
+
+        A result with success=False, or an exception, is not remembered.
+        """
+        if not idempotency_key:
+            return await func()
+        key = (operation, idempotency_key)
+        cached = self.recall(key)
+        if cached is not None:
+            return cached
+        result = await self.do(("idempotency",) + key, func)
+        if getattr(result, "success", True):
+            self.remember(key, result)
+        return result
+
+    def recall(self, key: Hashable) -> Any:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._results[key]
+            return None
+        return entry[1]
+
+    def forget(self, key: Hashable) -> None:
+        self._results.pop(key, None)
+
+    def remember(self, key: Hashable, value: Any) -> None:
+        self._results[key] = (time.monotonic() + self.window, value)
+        self._results.move_to_end(key)
+        now = time.monotonic()
+        while self._results:
+            oldest_key, (expires, _) = next(iter(self._results.items()))
+            if expires >= now and len(self._results) <= self.max_entries:
+                break
+            del self._results[oldest_key]
+
+
+single_flight = SingleFlight(settings.idempotency_window, settings.idempotency_max)
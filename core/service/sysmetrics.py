@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+from core.config import settings
+from core.logger import logger
+
+# Fields averaged over the 1/5/15 minute windows.
+AVERAGED = (
+    "cpu_percent",
+    "memory_percent",
+    "rx_bytes_per_sec",
+    "tx_bytes_per_sec",
+    "tun_rx_packets_per_sec",
+    "tun_tx_packets_per_sec",
+    "openvpn_cpu_percent",
+)
+
+
+class SystemSampler:
+    """Sample host and OpenVPN metrics on a background thread.
+
+    Every interval it records per-core CPU, memory, per-interface byte rates,
+    packet rates summed over the tunnel interfaces of the OpenVPN instances
+    and the openvpn processes' CPU and RSS, keeps fifteen minutes of samples
+    and recomputes the 1/5/15 minute averages. Readers only get the prepared snapshot; nothing is measured on
+    their behalf.
+    """
+
+    def __init__(self, interval: float, tun_interface: str):
+        self.interval = interval
+        # One per OpenVPN instance; set by the instance manager
+        self.tun_interfaces = [tun_interface]
+        self._window: deque[dict] = deque(maxlen=max(int(900 / interval), 1))
+        self._snapshot: dict = {}
+        self._last_net: tuple[float, dict] | None = None
+        self._processes: dict[int, psutil.Process] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        # Prime the CPU counters so the first sample covers a real interval
+        psutil.cpu_percent(percpu=True)
+        self.sample()
+        self._thread = threading.Thread(
+            target=self._run, name="system-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def snapshot(self) -> dict:
+        return self._snapshot
+
+    def sample(self) -> None:
+        now = time.time()
+        per_core = psutil.cpu_percent(percpu=True)
+        memory = psutil.virtual_memory()
+        interfaces, tun = self._net_rates(now)
+        openvpn = self._openvpn_usage()
+        current = {
+            "time": now,
+            "cpu_percent": round(sum(per_core) / len(per_core), 1),
+            "cpu_per_core": per_core,
+            "memory_percent": memory.percent,
+            "memory_used": memory.used,
+            "memory_total": memory.total,
+            "load_average": os.getloadavg(),
+            "rx_bytes_per_sec": sum(i["rx_bytes_per_sec"] for i in interfaces.values()),
+            "tx_bytes_per_sec": sum(i["tx_bytes_per_sec"] for i in interfaces.values()),
+            "tun_rx_packets_per_sec": tun["rx_packets_per_sec"],
+            "tun_tx_packets_per_sec": tun["tx_packets_per_sec"],
+            "openvpn_cpu_percent": openvpn["cpu_percent"],
+            "openvpn_rss": openvpn["rss"],
+            "openvpn_processes": openvpn["processes"],
+            "interfaces": interfaces,
+        }
+        self._window.append({key: current[key] for key in ("time",) + AVERAGED})
+        self._snapshot = dict(current, averages=self._averages(now))
+
+    def _net_rates(self, now: float) -> tuple[dict, dict]:
+        counters = psutil.net_io_counters(pernic=True)
+        previous = self._last_net
+        self._last_net = (now, counters)
+        interfaces = {}
+        tun = {"rx_packets_per_sec": 0.0, "tx_packets_per_sec": 0.0}
+        if previous is None:
+            return interfaces, tun
+        elapsed = max(now - previous[0], 1e-6)
+        for nic, c in counters.items():
+            p = previous[1].get(nic)
+            if nic == "lo" or p is None:
+                continue
+            interfaces[nic] = {
+                "rx_bytes_per_sec": _rate(c.bytes_recv, p.bytes_recv, elapsed),
+                "tx_bytes_per_sec": _rate(c.bytes_sent, p.bytes_sent, elapsed),
+            }
+            if nic in self.tun_interfaces:
+                tun["rx_packets_per_sec"] += _rate(
+                    c.packets_recv, p.packets_recv, elapsed
+                )
+                tun["tx_packets_per_sec"] += _rate(
+                    c.packets_sent, p.packets_sent, elapsed
+                )
+        return interfaces, tun
+
+    def _openvpn_usage(self) -> dict:
+        """CPU and RSS summed over openvpn processes, tracked across samples"""
+        pids = set()
+        for proc in psutil.process_iter(["name"]):
+            if proc.info["name"] == "openvpn":
+                pids.add(proc.pid)
+                # Keep the first Process object so cpu_percent() has a baseline
+                self._processes.setdefault(proc.pid, proc)
+        cpu, rss = 0.0, 0
+        for pid in list(self._processes):
+            if pid not in pids:
+                del self._processes[pid]
+                continue
+            try:
+                cpu += self._processes[pid].cpu_percent()
+                rss += self._processes[pid].memory_info().rss
+            except psutil.Error:
+                del self._processes[pid]
+        return {"cpu_percent": round(cpu, 1), "rss": rss, "processes": len(pids)}
+
+    def _averages(self, now: float) -> dict:
+        averages = {}
+        for minutes in (1, 5, 15):
+            samples = [s for s in self._window if s["time"] >= now - minutes * 60]
+            averages[f"{minutes}m"] = {
+                key: round(sum(s[key] for s in samples) / len(samples), 2)
+                for key in AVERAGED
+            }
+        return averages
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error("System metrics sampling failed: %s", e)
+
+
+def _rate(current: int, previous: int, elapsed: float) -> float:
+    return round(max(current - previous, 0) / elapsed, 1)
+
+
+system_sampler = SystemSampler(settings.sampler_interval, settings.tun_interface)
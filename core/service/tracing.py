@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from core.config import settings
+from core.logger import queued
+from core.service.metrics import PHASE_DURATION
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACE_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(BASE_DIR)), "data", "traces.jsonl"
+)
+
+_current: ContextVar[dict | None] = ContextVar("current_span", default=None)
+_recent: deque[dict] = deque(maxlen=settings.trace_history)
+
+trace_logger = logging.getLogger("AppLogger.trace")
+trace_logger.propagate = False
+if settings.trace_log:
+    _handler = logging.handlers.RotatingFileHandler(
+        TRACE_FILE,
+        maxBytes=settings.log_max_bytes,
+        backupCount=settings.log_backups,
+        encoding="utf-8",
+    )
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(queued(_handler))
+    trace_logger.setLevel(logging.INFO)
+
+
+class span(ContextDecorator):
+    """Time a step of a node operation as part of the current trace.
+
+    Spans nest through a context variable, which the executor carries into
+    worker threads, so the steps of one request share a trace id. A finished
+    span feeds ovnode_phase_duration_seconds, is kept in a bounded buffer for
+    /sync/debug/traces and, with TRACE_LOG, is written as a JSON line.
+    """
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> dict:
+        parent = _current.get()
+        self.record = {
+            "name": self.name,
+            "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_id": parent["span_id"] if parent else None,
+            "start": time.time(),
+            "attrs": dict(self.attrs),
+        }
+        self._token = _current.set(self.record)
+        self._started = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        duration = time.perf_counter() - self._started
+        _current.reset(self._token)
+        record = self.record
+        record["duration"] = round(duration, 6)
+        record["status"] = "error" if exc_type else "ok"
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        PHASE_DURATION.labels(record["name"]).observe(duration)
+        _recent.append(record)
+        if trace_logger.handlers:
+            trace_logger.info(json.dumps(record, default=str))
+        return False
+
+    def _recreate_cm(self) -> "span":
+        return span(self.name, **self.attrs)
+
+
+def annotate(**attrs) -> None:
+    """Attach attributes to the innermost open span, if any"""
+    record = _current.get()
+    if record is not None:
+        record["attrs"].update(attrs)
+
+
+def recent_spans(trace_id: str | None = None, limit: int = 200) -> list[dict]:
+    """The most recently finished spans, newest first"""
+    spans = [s for s in reversed(_recent) if trace_id in (None, s["trace_id"])]
+    return spans[:limit]
+
+
+class StackSampler:
+    """Sample the stacks of every thread for a while and aggregate them.
+
+    Stacks are folded ("outer;inner;leaf count"), the input format of
+    flame graph tools. Only one profile runs at a time.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    async def run(self, seconds: float, top: int = 30) -> dict | None:
+        """profile() on a thread of its own, so it never holds a pool worker"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def settle(method, value) -> None:
+            if not future.done():
+                method(value)
+
+        def target() -> None:
+            try:
+                result = self.profile(seconds, top)
+            except Exception as e:
+                loop.call_soon_threadsafe(settle, future.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(settle, future.set_result, result)
+
+        threading.Thread(target=target, name="stack-profiler", daemon=True).start()
+        return await future
+
+    def profile(self, seconds: float, top: int = 30) -> dict | None:
+        """Sample for seconds and return the profile, or None if one is running"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            stacks: Counter[str] = Counter()
+            leaves: Counter[str] = Counter()
+            me = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    folded = _fold(frame)
+                    stacks[f"{names.get(ident, ident)};{folded}"] += 1
+                    leaves[folded.rsplit(";", 1)[-1]] += 1
+                samples += 1
+                time.sleep(self.interval)
+            return {
+                "seconds": seconds,
+                "samples": samples,
+                "interval": self.interval,
+                "top": [
+                    {"frame": frame, "samples": count}
+                    for frame, count in leaves.most_common(top)
+                ],
+                "folded": [f"{stack} {count}" for stack, count in stacks.items()],
+            }
+        finally:
+            self._lock.release()
+
+
+def _fold(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+stack_sampler = StackSampler(settings.profile_interval)
@@ -0,0 +1,469 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from array import array
+from dataclasses import asdict
+from typing import Callable
+
+from core.config import settings
+from core.logger import logger
+from core.service.connections import connection_monitor
+from core.service.executor import run_fast
+from core.service.management import management_client
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRAFFIC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(BASE_DIR)), "data", "traffic"
+)
+
+
+class Tier:
+    """One resolution of the time series: a ring of slots per user.
+
+    Counters live in two flat array('Q') columns (received/sent) of
+    rows * slots entries, so a user costs 16 bytes per slot and nothing
+    else. All users share the ring position: buckets[slot] is the bucket
+    number (time // seconds) that slot currently holds.
+    """
+
+    def __init__(self, name: str, seconds: int, slots: int):
+        self.name = name
+        self.seconds = seconds
+        self.slots = slots
+        self.buckets = array("q", [-1] * slots)
+        self.received = array("Q")
+        self.sent = array("Q")
+
+    def add_row(self) -> None:
+        self.received.frombytes(bytes(8 * self.slots))
+        self.sent.frombytes(bytes(8 * self.slots))
+
+    def keep_rows(self, rows: list[int]) -> None:
+        """Drop every row not in rows, keeping the order of the others"""
+        received, sent = array("Q"), array("Q")
+        for row in rows:
+            base = row * self.slots
+            received.extend(self.received[base : base + self.slots])
+            sent.extend(self.sent[base : base + self.slots])
+        self.received, self.sent = received, sent
+
+    def idle_rows(self) -> set[int]:
+        """Rows with no traffic in any slot"""
+        rows = len(self.received) // self.slots
+        return {
+            row
+            for row in range(rows)
+            if not any(self.received[row * self.slots : (row + 1) * self.slots])
+            and not any(self.sent[row * self.slots : (row + 1) * self.slots])
+        }
+
+    def reset(self, rows: int) -> None:
+        self.buckets = array("q", [-1] * self.slots)
+        self.received = array("Q", bytes(8 * rows * self.slots))
+        self.sent = array("Q", bytes(8 * rows * self.slots))
+
+    def slot_for(self, bucket: int) -> int:
+        """Return the slot for bucket, clearing it if it held an older one"""
+        slot = bucket % self.slots
+        if self.buckets[slot] != bucket:
+            rows = len(self.received) // self.slots
+            for i in range(slot, rows * self.slots, self.slots):
+                self.received[i] = 0
+                self.sent[i] = 0
+            self.buckets[slot] = bucket
+        return slot
+
+    def add(self, row: int, slot: int, received: int, sent: int) -> None:
+        i = row * self.slots + slot
+        self.received[i] += received
+        self.sent[i] += sent
+
+    def held(self, start: float, end: float) -> list[tuple[int, int]]:
+        """(bucket, slot) for every bucket in range the ring still holds"""
+        first, last = int(start // self.seconds), int(end // self.seconds)
+        return [
+            (bucket, bucket % self.slots)
+            for bucket in range(max(first, last - self.slots + 1), last + 1)
+            if self.buckets[bucket % self.slots] == bucket
+        ]
+
+    def series(self, row: int, start: float, end: float) -> list[list[int]]:
+        """[bucket start, received, sent] for every non-empty bucket in range"""
+        base = row * self.slots
+        points = []
+        for bucket, slot in self.held(start, end):
+            received, sent = self.received[base + slot], self.sent[base + slot]
+            if received or sent:
+                points.append([bucket * self.seconds, received, sent])
+        return points
+
+    def totals(self, rows: dict[str, int], start: float, end: float) -> dict:
+        """Per-user byte totals over range, skipping users with no traffic"""
+        slots = [slot for _, slot in self.held(start, end)]
+        if not slots:
+            return {}
+        whole_ring = len(slots) == self.slots
+        totals = {}
+        for name, row in rows.items():
+            base = row * self.slots
+            if whole_ring:
+                received = sum(self.received[base : base + self.slots])
+                sent = sum(self.sent[base : base + self.slots])
+            else:
+                received = sum([self.received[base + slot] for slot in slots])
+                sent = sum([self.sent[base + slot] for slot in slots])
+            if received or sent:
+                totals[name] = {"bytes_received": received, "bytes_sent": sent}
+        return totals
+
+    def covers(self, start: float, now: float) -> bool:
+        return start >= now - self.seconds * self.slots
+
+
+class TrafficAccounting:
+    """Per-user byte counters sampled from the live sessions into ring tiers.
+
+    Every interval the cumulative counters of the connected sessions are
+    diffed against the previous sample and the deltas are added to the
+    current minute, hour and day bucket of each user. Bytes a session moved
+    after the last sample are recovered from the management DISCONNECT
+    event. Memory is fixed per user by the number of slots in each tier,
+    and rows that no longer hold any traffic are reclaimed. The tiers and
+    the per-session baselines are written to TRAFFIC_DIR, so history
+    survives restarts and sessions that outlive one are not counted twice.
+    """
+
+    def __init__(self, path: str, interval: float, tiers: list[Tier]):
+        self.path = path
+        self.interval = interval
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self._rows: dict[str, int] = {}
+        self._last: dict[tuple, tuple[int, int]] = {}
+        self._cids: dict[tuple[int, int], tuple] = {}
+        self._ended: set = set()
+        # Set when history was loaded without session baselines: the next
+        # sample only records where each session stands.
+        self._baseline = False
+        self._sampled = False
+        # Each save writes a new generation of tier files; index.json names
+        # the one that is complete.
+        self._generation = 0
+        self._listeners: list[Callable[[dict[str, list[int]]], None]] = []
+        self._task: asyncio.Task | None = None
+        self._unsubscribe = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            await run_fast(self.load)
+            self._unsubscribe = management_client.subscribe(
+                "CLIENT", self._on_client_event
+            )
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await run_fast(self.save)
+
+    def sample(self, sessions: list[dict], now: float | None = None) -> None:
+        """Account the byte deltas of sessions since the previous sample"""
+        now = time.time() if now is None else now
+        deltas: dict[str, list[int]] = {}
+        seen, ended, cids = {}, set(), {}
+        with self._lock:
+            for session in sessions:
+                key = _session_key(session)
+                if session.get("client_id") is not None:
+                    cids[(session.get("instance", 0), session["client_id"])] = key
+                if key in self._ended:
+                    # Already settled by its DISCONNECT event; the snapshot
+                    # just has not caught up yet.
+                    ended.add(key)
+                    continue
+                current = (session["bytes_received"], session["bytes_sent"])
+                seen[key] = current
+                if self._baseline:
+                    continue
+                last = self._last.get(key, (0, 0))
+                received = current[0] - last[0] if current[0] >= last[0] else current[0]
+                sent = current[1] - last[1] if current[1] >= last[1] else current[1]
+                if received or sent:
+                    total = deltas.setdefault(session["common_name"], [0, 0])
+                    total[0] += received
+                    total[1] += sent
+            self._last, self._ended, self._cids = seen, ended, cids
+            self._baseline = False
+            self._sampled = True
+            self._record(deltas, now)
+
+    @property
+    def ready(self) -> bool:
+        """Whether the live sessions have been sampled since start"""
+        return self._sampled
+
+    def add_listener(self, callback: Callable[[dict[str, list[int]]], None]) -> None:
+        """Call callback with every batch of accounted {name: [received, sent]}.
+
+        It runs on a worker thread while the accounting lock is held, so it
+        must be quick and must not call back into this object.
+        """
+        self._listeners.append(callback)
+
+    def unsampled(self, sessions: list) -> int:
+        """Bytes the given live sessions moved since they were last accounted"""
+        total = 0
+        with self._lock:
+            if self._baseline:
+                return 0
+            for session in sessions:
+                key = _session_key(asdict(session))
+                if key in self._ended:
+                    continue
+                last = self._last.get(key, (0, 0))
+                total += max(session.bytes_received - last[0], 0)
+                total += max(session.bytes_sent - last[1], 0)
+        return total
+
+    def _record(self, deltas: dict[str, list[int]], now: float) -> None:
+        if not deltas:
+            return
+        for callback in self._listeners:
+            try:
+                callback(deltas)
+            except Exception as e:
+                logger.error("Traffic listener failed: %s", e)
+        slots = [(tier, tier.slot_for(int(now // tier.seconds))) for tier in self.tiers]
+        for name, (received, sent) in deltas.items():
+            row = self._rows.get(name)
+            if row is None:
+                row = self._rows[name] = len(self._rows)
+                for tier in self.tiers:
+                    tier.add_row()
+            for tier, slot in slots:
+                tier.add(row, slot, received, sent)
+
+    def usage(
+        self,
+        name: str | None = None,
+        start: float | None = None,
+        end: float | None = None,
+        resolution: str | None = None,
+    ) -> dict:
+        """Traffic for one user (with points) or totals for all users.
+
+        Without a resolution the finest tier still holding start is used.
+        """
+        now = time.time()
+        end = now if end is None else end
+        start = end - 86400 if start is None else start
+        tier = self._pick_tier(start, now, resolution)
+        with self._lock:
+            if name is not None:
+                row = self._rows.get(name)
+                points = tier.series(row, start, end) if row is not None else []
+                return {
+                    "name": name,
+                    "resolution": tier.name,
+                    "start": start,
+                    "end": end,
+                    "bytes_received": sum(p[1] for p in points),
+                    "bytes_sent": sum(p[2] for p in points),
+                    "points": points,
+                }
+            users = tier.totals(self._rows, start, end)
+        return {"resolution": tier.name, "start": start, "end": end, "users": users}
+
+    def _pick_tier(self, start: float, now: float, resolution: str | None) -> Tier:
+        for tier in self.tiers:
+            if resolution is not None:
+                if tier.name == resolution:
+                    return tier
+            elif tier.covers(start, now):
+                return tier
+        if resolution is not None:
+            raise ValueError(f"unknown resolution '{resolution}'")
+        return self.tiers[-1]
+
+    def compact(self) -> int:
+        """Free the rows of users with no traffic left in any tier.
+
+        Revoked users stop moving bytes, so their rows empty out once the
+        longest tier has rolled past them and are reclaimed here; memory
+        follows the users with recent traffic, not every name ever seen.
+        """
+        with self._lock:
+            idle = set.intersection(*(tier.idle_rows() for tier in self.tiers))
+            if not idle:
+                return 0
+            names = sorted(self._rows, key=self._rows.get)
+            kept = [row for row in range(len(names)) if row not in idle]
+            for tier in self.tiers:
+                tier.keep_rows(kept)
+            self._rows = {names[row]: i for i, row in enumerate(kept)}
+        logger.info("Reclaimed traffic rows of %d idle users", len(idle))
+        return len(idle)
+
+    def save(self) -> None:
+        """Write every tier to disk as one atomic update.
+
+        The tier files of a save are written under a new generation number
+        and only become current when index.json, which names the generation
+        and the row of every user, is replaced. A crash at any point leaves
+        the previous save whole.
+        """
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        with self._lock:
+            names = sorted(self._rows, key=self._rows.get)
+            columns = {
+                tier.name: (tier.buckets[:], tier.received[:], tier.sent[:])
+                for tier in self.tiers
+            }
+            meta = {
+                "generation": self._generation + 1,
+                "names": names,
+                "tiers": {t.name: [t.seconds, t.slots] for t in self.tiers},
+                "sessions": [
+                    list(key) + list(last) for key, last in self._last.items()
+                ],
+            }
+        current = set()
+        for tier in self.tiers:
+            for suffix, column in zip(_COLUMNS, columns[tier.name]):
+                filename = _tier_file(tier.name, meta["generation"], suffix)
+                with open(os.path.join(self.path, filename), "wb") as f:
+                    column.tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                current.add(filename)
+        with open(os.path.join(self.path, "index.json.tmp"), "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(
+            os.path.join(self.path, "index.json.tmp"),
+            os.path.join(self.path, "index.json"),
+        )
+        self._generation = meta["generation"]
+        # Earlier generations, and the unversioned files of older releases
+        for filename in os.listdir(self.path):
+            if filename.endswith(_COLUMNS) and filename not in current:
+                os.remove(os.path.join(self.path, filename))
+
+    def load(self) -> None:
+        """Restore saved tiers; a tier whose size changed starts empty"""
+        try:
+            with open(os.path.join(self.path, "index.json")) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        rows = len(meta["names"])
+        # Saves of older releases have no generation and unversioned files
+        generation = meta.get("generation")
+        with self._lock:
+            self._generation = generation or 0
+            self._rows = {name: row for row, name in enumerate(meta["names"])}
+            if "sessions" in meta:
+                self._last = {
+                    tuple(entry[:3]): tuple(entry[3:]) for entry in meta["sessions"]
+                }
+            else:
+                self._baseline = True
+            for tier in self.tiers:
+                try:
+                    if meta["tiers"].get(tier.name) != [tier.seconds, tier.slots]:
+                        raise ValueError("tier layout changed")
+                    columns = {"buckets": array("q")}
+                    columns["received"], columns["sent"] = array("Q"), array("Q")
+                    for suffix, column in columns.items():
+                        filename = _tier_file(tier.name, generation, suffix)
+                        with open(os.path.join(self.path, filename), "rb") as f:
+                            column.fromfile(
+                                f, tier.slots * (1 if suffix == "buckets" else rows)
+                            )
+                    tier.buckets = columns["buckets"]
+                    tier.received, tier.sent = columns["received"], columns["sent"]
+                except (OSError, EOFError, ValueError) as e:
+                    logger.warning("Discarding saved %s traffic: %s", tier.name, e)
+                    tier.reset(rows)
+
+    def _on_client_event(self, event: dict):
+        if event["event"] == "DISCONNECT" and event["args"]:
+            env = event["env"]
+            if "bytes_received" in env and "common_name" in env:
+                return run_fast(self._settle, event)
+
+    def _settle(self, event: dict) -> None:
+        """Account the bytes a session moved between the last sample and its end"""
+        env = event["env"]
+        instance = event.get("instance", 0)
+        cid = int(event["args"][0]) if event["args"][0].isdigit() else None
+        with self._lock:
+            key = self._cids.pop((instance, cid), None)
+            if key is None:
+                since = env.get("time_unix", "")
+                key = (instance, env["common_name"], int(since or 0))
+            last = self._last.pop(key, (0, 0))
+            self._ended.add(key)
+            if self._baseline:
+                return
+            received = max(int(env["bytes_received"]) - last[0], 0)
+            sent = max(int(env["bytes_sent"]) - last[1], 0)
+            self._record({env["common_name"]: [received, sent]}, time.time())
+
+    async def _run(self) -> None:
+        saved_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                snapshot = connection_monitor.snapshot()
+                # Without a live source the sessions are unknown, not gone;
+                # their bytes are counted once a source answers again.
+                if not snapshot["stale"]:
+                    await run_fast(self.sample, snapshot["sessions"])
+                if time.monotonic() - saved_at >= settings.traffic_save_interval:
+                    await run_fast(self.compact)
+                    await run_fast(self.save)
+                    saved_at = time.monotonic()
+            except Exception as e:
+                logger.error("Traffic sampling failed: %s", e)
+
+
+_COLUMNS = ("buckets", "received", "sent")
+
+
+def _tier_file(tier: str, generation: int | None, suffix: str) -> str:
+    if generation is None:
+        return f"{tier}.{suffix}"
+    return f"{tier}.{generation}.{suffix}"
+
+
+def _session_key(session: dict) -> tuple:
+    # Every status source reports these, unlike client ids, and they survive
+    # a node restart, so a saved baseline still matches its session.
+    return (
+        session.get("instance", 0),
+        session["common_name"],
+        session["connected_since"],
+    )
+
+
+traffic = TrafficAccounting(
+    TRAFFIC_DIR,
+    settings.traffic_interval,
+    [
+        Tier("1m", 60, settings.traffic_minutes),
+        Tier("1h", 3600, settings.traffic_hours),
+        Tier("1d", 86400, settings.traffic_days),
+    ],
+)
@@ -1,34 +1,220 @@
+import functools
+import multiprocessing
 import pexpect
-import re
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
 
+from core.config import settings
 from core.logger import logger
-
+from core.service import pki
+from core.service.executor import run_fast, run_slow
+from core.service.keypool import key_pool
+from core.service.management import kill_client
+from core.service.metrics import ERRORS, PROMPT_WAIT
+from core.service.profile import Profile, profile_renderer
+from core.service.registry import registry
+from core.service.reload import reload_scheduler
+from core.service.singleflight import single_flight
+from core.service.tracing import annotate, span
 
 script_path = "/root/openvpn-install.sh"
 
+_keygen_pool: ProcessPoolExecutor | None = None
+
 
 def create_user_on_server(name) -> bool:
+    with span("user_create", name=name):
+        if settings.native_pki and pki.native_pki_available():
+            return _create_user_native(name)
+        return _create_user_with_script(name)
+
+
+def _create_user_native(name: str) -> bool:
+    """Issue the client certificate in-process against the easy-rsa CA"""
+    name = pki.sanitize_name(name)
+    try:
+        with span("key_take"):
+            key_pem = key_pool.take(pki.client_key_spec())
+            annotate(pooled=key_pem is not None)
+        serial = pki.issue_client(name, key_pem)
+        with span("ccd_write"):
+            os.makedirs("/etc/openvpn/ccd", exist_ok=True)
+            with open(f"/etc/openvpn/ccd/{name}", "w") as f:
+                f.write("")
+        with span("registry_record"):
+            registry.record_issued({name: serial})
+        return True
+    except pki.PKIError as e:
+        logger.error("Failed to create user '%s': %s", name, e)
+        return False
+    except Exception as e:
+        logger.exception("Error in native create for '%s': %s", name, e)
+        return False
+
+
+@span("user_create_batch")
+def create_users_on_server(
+    names: list[str], progress: Callable[[int], None] | None = None
+) -> dict[str, str]:
+    """Create many users at once and return a per-name result.
+
+    Keypairs are generated in a process pool sized to the cores, then all
+    certificates are signed and appended to the PKI index in one pass.
+    progress, if given, is called with the number of names handled so far.
+    """
+    names = list(dict.fromkeys(names))
+    progress = progress or (lambda done: None)
+    annotate(count=len(names))
+    if not (settings.native_pki and pki.native_pki_available()):
+        results = {}
+        for name in names:
+            results[name] = "created" if _create_user_with_script(name) else "failed"
+            progress(len(results))
+        return results
+
+    results: dict[str, str] = {}
+    clean_names = []
+    for name in names:
+        clean = pki.sanitize_name(name)
+        client = registry.get(clean)
+        if clean in clean_names or (client and client["status"] == "valid"):
+            results[name] = "exists"
+        else:
+            clean_names.append(clean)
+    progress(len(results))
+
+    def keys_done(done: int) -> None:
+        progress(len(results) + done)
+
+    try:
+        keys = _generate_keys(clean_names, keys_done)
+        issued = pki.issue_clients(dict(zip(clean_names, keys)))
+    except Exception as e:
+        logger.exception("Error in batch create: %s", e)
+        issued = {}
+
+    with span("ccd_write"):
+        os.makedirs("/etc/openvpn/ccd", exist_ok=True)
+        for name in names:
+            if name in results:
+                continue
+            clean = pki.sanitize_name(name)
+            outcome = issued.get(clean)
+            if isinstance(outcome, str):
+                with open(f"/etc/openvpn/ccd/{clean}", "w") as f:
+                    f.write("")
+                results[name] = "created"
+            else:
+                if outcome is not None:
+                    logger.error("Failed to create user '%s': %s", clean, outcome)
+                results[name] = "failed"
+    with span("registry_record"):
+        registry.record_issued(
+            {
+                clean: serial
+                for clean, serial in issued.items()
+                if isinstance(serial, str)
+            }
+        )
+    return results
+
+
+@span("keygen")
+def _generate_keys(names: list[str], progress: Callable[[int], None]) -> list[bytes]:
+    """Generate one client key per name, taking pooled keys before using the cores"""
+    spec = pki.client_key_spec()
+    keys = []
+    while len(keys) < len(names):
+        key_pem = key_pool.take(spec)
+        if key_pem is None:
+            break
+        keys.append(key_pem)
+    progress(len(keys))
+    annotate(pooled=len(keys), generated=len(names) - len(keys))
+
+    missing = len(names) - len(keys)
+    if missing == 0:
+        return keys
+    pooled = len(keys)
+    try:
+        for key_pem in _get_keygen_pool().map(
+            pki.generate_client_key, [spec[0]] * missing, [spec[1]] * missing
+        ):
+            keys.append(key_pem)
+            progress(len(keys))
+        return keys
+    except Exception as e:
+        logger.warning("Key generation pool failed, generating in-process: %s", e)
+        shutdown_keygen_pool()
+        del keys[pooled:]
+        for _ in range(missing):
+            keys.append(pki.generate_client_key(*spec))
+            progress(len(keys))
+        return keys
+
+
+def _get_keygen_pool() -> ProcessPoolExecutor:
+    """Lazily start the key generation pool, one worker per core"""
+    global _keygen_pool
+    if _keygen_pool is None:
+        _keygen_pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count() or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _keygen_pool
+
+
+def shutdown_keygen_pool() -> None:
+    """Stop the key generation workers; the next batch starts new ones"""
+    global _keygen_pool
+    if _keygen_pool is not None:
+        _keygen_pool.shutdown(wait=False, cancel_futures=True)
+        _keygen_pool = None
+
+
+def _spawn_script() -> pexpect.spawn:
+    env = {"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"}
+    with span("pexpect_spawn"):
+        return pexpect.spawn(
+            "/usr/bin/bash", [script_path], env=env, encoding="utf-8", timeout=120
+        )
+
+
+def _expect(bash: pexpect.spawn, script: str, prompt: str, pattern, timeout: int):
+    """bash.expect(), recording how long the script took to show the prompt"""
+    with PROMPT_WAIT.time(script, prompt):
+        return bash.expect(pattern, timeout=timeout)
+
+
+def _holding_pki_lock(func):
+    """Script sessions run easy-rsa on the same index.txt as the native engine,
+    so they never overlap with each other or with native issuance."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with pki.pki_lock:
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@span("script_create")
+@_holding_pki_lock
+def _create_user_with_script(name: str) -> bool:
     try:
         if not os.path.exists(script_path):
             logger.error("script not found on ")
             return False
 
-        env = {"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"}
-        bash = pexpect.spawn(
-            "/usr/bin/bash",
-            [script_path],
-            env=env,
-            encoding="utf-8",
-            timeout=120,
-        )
+        bash = _spawn_script()
 
-        bash.expect(r"Option:", timeout=90)
+        _expect(bash, "create", "menu", r"Option:", 90)
         bash.sendline("1")
 
-        bash.expect(r"Name:", timeout=90)
+        _expect(bash, "create", "name", r"Name:", 90)
         bash.sendline(name)
-        bash.expect(pexpect.EOF, timeout=180)
+        _expect(bash, "create", "finish", pexpect.EOF, 180)
 
         bash.close()
         ccd_file = f"/etc/openvpn/ccd/{name}"
@@ -38,71 +224,144 @@ def create_user_on_server(name) -> bool:
         return True
 
     except pexpect.TIMEOUT:
+        ERRORS.labels("script_timeout").inc()
         logger.error("Timeout occurred while executing script!")
         return False
     except pexpect.EOF:
+        ERRORS.labels("script_eof").inc()
         logger.error("Script closed earlier than expected!")
         return False
     except Exception as e:
+        ERRORS.labels("script_error").inc()
         logger.error(f"Error occurred: {e}")
         return False
 
 
 def delete_user_on_server(name) -> bool | str:
+    with span("user_delete", name=name):
+        if settings.native_pki and pki.native_pki_available():
+            result = delete_users_on_server([name])[name]
+            return "not_found" if result == "not_found" else result == "deleted"
+        return _delete_user_with_script(name)
+
+
+@span("user_delete_batch")
+def delete_users_on_server(
+    names: list[str], progress: Callable[[int], None] | None = None
+) -> dict[str, str]:
+    """Revoke many users with a single CRL rebuild and return a per-name result"""
+    names = list(dict.fromkeys(names))
+    progress = progress or (lambda done: None)
+    annotate(count=len(names))
+    if not (settings.native_pki and pki.native_pki_available()):
+        results = {}
+        for name in names:
+            result = _delete_user_with_script(name)
+            if isinstance(result, str):
+                results[name] = result
+            else:
+                results[name] = "deleted" if result else "failed"
+            progress(len(results))
+        return results
+
+    clean_names = {name: pki.sanitize_name(name) for name in names}
+    known = [
+        clean
+        for clean in dict.fromkeys(clean_names.values())
+        if (client := registry.get(clean)) and client["status"] == "valid"
+    ]
+    try:
+        with span("cert_revoke", count=len(known)):
+            revoked = pki.revoke_clients(known) if known else {}
+    except Exception as e:
+        logger.exception("Error in batch delete: %s", e)
+        return {name: "failed" for name in names}
+    with span("registry_record"):
+        registry.record_revoked(
+            [clean for clean, serial in revoked.items() if isinstance(serial, str)]
+        )
+
+    results = {}
+    for name, clean in clean_names.items():
+        if isinstance(revoked.get(clean), str):
+            results[name] = "deleted"
+        else:
+            logger.error("User '%s' not found for delete!", clean)
+            results[name] = "not_found"
+    _remove_client_files(
+        [clean for name, clean in clean_names.items() if results[name] == "deleted"]
+    )
+    progress(len(results))
+    return results
+
+
+@span("client_files_remove")
+def _remove_client_files(names: list[str]) -> None:
+    """Remove the local .ovpn and ccd files of revoked clients in one sweep"""
+    for name in names:
+        for path in (f"{pki.PROFILE_DIR}/{name}.ovpn", f"/etc/openvpn/ccd/{name}"):
+            try:
+                os.remove(path)
+                logger.info("Removed %s", path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error("Error deleting file %s: %s", path, e)
+
+
+@span("script_revoke")
+@_holding_pki_lock
+def _delete_user_with_script(name) -> bool | str:
     try:
         if not os.path.exists(script_path):
             logger.error("script not found at %s", script_path)
             return False
 
-        env = {"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"}
-        bash = pexpect.spawn(
-            "/usr/bin/bash", [script_path], env=env, encoding="utf-8", timeout=120
-        )
+        # The script numbers clients in index.txt order, which the registry
+        # keeps, so there is no need to scrape the printed menu.
+        user_number = registry.menu_number(name)
+        if user_number is None:
+            logger.error("User '%s' not found for delete!", name)
+            return "not_found"
+
+        bash = _spawn_script()
 
         try:
-            bash.expect(r"Option:|Select an option:", timeout=20)
+            _expect(bash, "revoke", "menu", r"Option:|Select an option:", 20)
         except pexpect.TIMEOUT:
             logger.warning("Did not see main menu prompt, attempting to continue")
 
         bash.sendline("2")
 
         try:
-            bash.expect(
-                r"Select the client to revoke:|Select the client to revoke", timeout=20
+            _expect(
+                bash,
+                "revoke",
+                "client_list",
+                r"Select the client to revoke:|Select the client to revoke",
+                20,
             )
         except pexpect.TIMEOUT:
             logger.info("Didn't match full header")
 
-        bash.expect(r"Client:", timeout=20)
-        list_output = bash.before
-
-        pattern = re.compile(r"\s*(\d+)\)\s*(.+)")
-        matches = pattern.findall(list_output)
-
-        user_number = None
-        for num, user in matches:
-            if user.strip() == name:
-                user_number = num
-                break
-
-        if not user_number:
-            logger.error("User '%s' not found for delete!", name)
-            bash.close(force=True)
-            return "not_found"
+        _expect(bash, "revoke", "client", r"Client:", 20)
 
         logger.info("Revoking user '%s' -> number %s", name, user_number)
-        bash.sendline(user_number)
+        bash.sendline(str(user_number))
 
         try:
-            bash.expect(
+            _expect(
+                bash,
+                "revoke",
+                "confirm",
                 r"Confirm .*revocation\?.*\[y/N\]:|Confirm .*revocation\?.*:|Confirm .*revocation\?",
-                timeout=20,
+                20,
             )
             bash.sendline("y")
         except pexpect.TIMEOUT:
             logger.warning("Confirmation prompt not seen; trying to continue")
 
-        bash.expect(pexpect.EOF, timeout=120)
+        _expect(bash, "revoke", "finish", pexpect.EOF, 120)
         bash.close()
 
         # remove local .ovpn file if exists
@@ -127,17 +386,28 @@ def delete_user_on_server(name) -> bool | str:
         return True
 
     except Exception as e:
+        ERRORS.labels("script_error").inc()
         logger.exception("Error in delete_user_on_server: %s", e)
         return False
 
 
+@span("user_status")
 def change_user_status(name: str, status: str) -> bool:
+    """Toggle a user through its ccd file.
+
+    With ccd-exclusive a missing ccd file rejects new connections, so only the
+    user's live sessions need to be dropped; that is done through the
+    management interface and the daemon is restarted only if it is unreachable.
+    """
+    annotate(name=name, status=status)
     ccd_file = f"/etc/openvpn/ccd/{name}"
     if status == "deactivate":
         if os.path.exists(ccd_file):
             try:
                 os.remove(ccd_file)
-                restart_openvpn_service()
+                registry.set_ccd(name, False)
+                if not kill_client(name):
+                    restart_openvpn_service()
                 logger.info("Removed %s", ccd_file)
             except Exception as e:
                 logger.error("Error deleting file %s: %s", ccd_file, e)
@@ -149,28 +419,166 @@ def change_user_status(name: str, status: str) -> bool:
             with open(ccd_file, "w") as f:
                 f.write("")
             logger.info("Created %s", ccd_file)
-            restart_openvpn_service()
+            registry.set_ccd(name, True)
             return True
         except Exception as e:
             logger.error("Error creating file %s: %s", ccd_file, e)
             return False
 
 
-def restart_openvpn_service() -> bool:
+@span("reconcile")
+def reconcile_users(
+    desired: dict[str, str],
+    prune: bool = False,
+    dry_run: bool = False,
+    progress: Callable[[int], None] | None = None,
+) -> dict:
+    """Bring the node to the desired {name: "activate"|"deactivate"} set.
+
+    The desired set is diffed against the valid certificates in the PKI
+    index and the ccd directory, and only the differences are applied:
+    missing users are issued in one batch, users not listed are revoked in
+    one batch (a single CRL rebuild) when prune is set, and ccd files are
+    created or removed. Sessions of cut-off users are killed through the
+    management interface; if that is unreachable, one reconnect is scheduled
+    at the end. With prune, the ccd and profile files left behind by revoked
+    clients are swept too. With dry_run only the plan is returned.
+    """
+    progress = progress or (lambda done: None)
+    desired = {pki.sanitize_name(name): status for name, status in desired.items()}
+    valid = set(registry.names("valid"))
     try:
-        os.system("systemctl restart openvpn-server@server")
-        logger.info("OpenVPN service restarted successfully.")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to restart OpenVPN service: {e}")
-        return False
+        ccd = set(os.listdir("/etc/openvpn/ccd"))
+    except FileNotFoundError:
+        ccd = set()
+
+    plan = {
+        "create": [name for name in desired if name not in valid],
+        "revoke": sorted(valid - desired.keys()) if prune else [],
+        "activate": [
+            name
+            for name, status in desired.items()
+            if status == "activate" and name in valid and name not in ccd
+        ],
+        "deactivate": [
+            name
+            for name, status in desired.items()
+            if status == "deactivate" and name in valid and name in ccd
+        ],
+    }
+    # Files left behind by revoked clients: ccd entries and the profiles the
+    # install script wrote to /root. Only names the PKI once issued count;
+    # other ccd entries (DEFAULT, hand-written ones) are not ours to remove.
+    if prune:
+        stale = {
+            name
+            for name in registry.names("revoked")
+            if name in ccd or os.path.exists(f"{pki.PROFILE_DIR}/{name}.ovpn")
+        }
+        plan["orphans"] = sorted(stale - valid - desired.keys())
+    else:
+        plan["orphans"] = []
+    annotate(**{action: len(names) for action, names in plan.items()})
+    if dry_run:
+        return {"dry_run": True, "plan": plan}
+    unchanged = len(desired.keys() - set().union(*plan.values()))
+
+    summary = {action: [] for action in plan}
+    failed: dict[str, str] = {}
+    done = 0
+
+    if plan["create"]:
+        results = create_users_on_server(
+            plan["create"], lambda count: progress(done + count)
+        )
+        for name, result in results.items():
+            if result == "created":
+                summary["create"].append(name)
+                # Issuing writes the ccd file; a disabled user must not keep it
+                if desired[name] == "deactivate":
+                    plan["deactivate"].append(name)
+            elif result != "exists":
+                failed[name] = "create"
+        done += len(plan["create"])
+
+    if plan["revoke"]:
+        results = delete_users_on_server(plan["revoke"])
+        summary["revoke"] = [n for n, r in results.items() if r == "deleted"]
+        failed.update({n: "revoke" for n, r in results.items() if r == "failed"})
+        done += len(plan["revoke"])
+        progress(done)
+
+    with span("ccd_write"):
+        os.makedirs("/etc/openvpn/ccd", exist_ok=True)
+        for action in ("activate", "deactivate"):
+            for name in plan[action]:
+                ccd_file = f"/etc/openvpn/ccd/{name}"
+                try:
+                    if action == "activate":
+                        with open(ccd_file, "w") as f:
+                            f.write("")
+                    elif os.path.exists(ccd_file):
+                        os.remove(ccd_file)
+                except OSError as e:
+                    logger.error("Error updating %s: %s", ccd_file, e)
+                    failed[name] = action
+                    continue
+                registry.set_ccd(name, action == "activate")
+                summary[action].append(name)
+            done += len(plan[action])
+            progress(done)
+    _remove_client_files(plan["orphans"])
+    summary["orphans"] = plan["orphans"]
+
+    # Only sessions that existed before can be connected; stop at the first
+    # kill the management interface cannot take and drop every session once
+    # instead.
+    reload = False
+    for name in summary["revoke"] + summary["deactivate"]:
+        if name in valid and not kill_client(name):
+            reload = True
+            break
+    if reload:
+        restart_openvpn_service()
+
+    logger.info(
+        "Reconciled users: %s",
+        ", ".join(f"{len(names)} {action}" for action, names in summary.items()),
+    )
+    return {
+        "dry_run": False,
+        "changes": summary,
+        "failed": failed,
+        "unchanged": unchanged,
+        "reloaded": reload,
+    }
 
 
-async def download_ovpn_file(name: str) -> str | None:
-    """This function returns the path of the ovpn file for downloading"""
-    file_path = f"/root/{name}.ovpn"
-    if os.path.exists(file_path):
-        return file_path
-    else:
-        create_user_on_server(name)
-        return await download_ovpn_file(name)
+def restart_openvpn_service() -> bool:
+    """Schedule a reconnect (SIGUSR1); dropping sessions needs no new process"""
+    reload_scheduler.request(restart=False)
+    return True
+
+
+def list_users_on_server(
+    offset: int = 0, limit: int = 100, status: str | None = None
+) -> dict:
+    """Return one page of the client registry"""
+    total, users = registry.page(offset, limit, status)
+    return {"total": total, "offset": offset, "limit": limit, "users": users}
+
+
+async def download_ovpn_file(name: str) -> Profile | None:
+    """This function returns the ovpn profile of the user, rendered from the PKI.
+
+    A missing user triggers one user creation, shared with any concurrent
+    create-user for the same name; if that fails there is nothing to serve.
+    """
+    profile = await run_fast(profile_renderer.render, name)
+    if profile is None:
+        await single_flight.do(
+            ("create-user", name),
+            lambda: run_slow(create_user_on_server, name, keys=[name]),
+        )
+        profile = await run_fast(profile_renderer.render, name)
+    return profile
@@ -0,0 +1,228 @@
+"""Structured view of server.conf and client-common.txt.
+
+Stdlib only: the installer uses it before the node's dependencies exist.
+"""
+
+import os
+import tempfile
+from dataclasses import dataclass, field
+
+SERVER_CONF = "/etc/openvpn/server/server.conf"
+CLIENT_TEMPLATE = "/etc/openvpn/server/client-common.txt"
+MANAGEMENT_SOCKET = "/etc/openvpn/server/management.sock"
+# Read by the connection monitor when the management interface is down
+STATUS_FILE = "/etc/openvpn/server/openvpn-status.log"
+STATUS_INTERVAL = "10"
+
+
+class OpenVPNConfig:
+    """An OpenVPN config file as directives, keeping every line it does not touch.
+
+    Each line is kept as read, with its parsed (keyword, args) next to it.
+    Comments, blank lines and inline blocks such as <ca>...</ca> are kept
+    as text, so render() of an unchanged config returns the file unchanged.
+    """
+
+    def __init__(self, text: str = ""):
+        self.lines: list[list] = []
+        block = None
+        for line in text.splitlines(keepends=True):
+            stripped = line.strip()
+            if block is not None:
+                self.lines.append([line, None, None])
+                if stripped == f"</{block}>":
+                    block = None
+                continue
+            if stripped.startswith("<") and stripped.endswith(">"):
+                block = stripped[1:-1]
+                self.lines.append([line, None, None])
+                continue
+            words = stripped.split()
+            if not words or words[0][0] in "#;":
+                self.lines.append([line, None, None])
+            else:
+                self.lines.append([line, words[0].lower(), words[1:]])
+
+    @classmethod
+    def load(cls, path: str) -> "OpenVPNConfig":
+        with open(path, "r") as f:
+            return cls(f.read())
+
+    def get(self, keyword: str) -> list[str] | None:
+        """Arguments of the first occurrence of keyword"""
+        for _, key, args in self.lines:
+            if key == keyword:
+                return list(args)
+        return None
+
+    def get_all(self, keyword: str) -> list[list[str]]:
+        return [list(args) for _, key, args in self.lines if key == keyword]
+
+    def set(self, keyword: str, *args: str) -> None:
+        """Replace the first occurrence of keyword, or append it"""
+        text = " ".join((keyword,) + args) + "\n"
+        for entry in self.lines:
+            if entry[1] == keyword:
+                entry[:] = [text, keyword, list(args)]
+                return
+        if self.lines and not self.lines[-1][0].endswith("\n"):
+            self.lines[-1][0] += "\n"
+        self.lines.append([text, keyword, list(args)])
+
+    def set_all(self, keyword: str, values: list[list[str]]) -> None:
+        """Make values the only occurrences of keyword, at the first one's place"""
+        position = next(
+            (i for i, entry in enumerate(self.lines) if entry[1] == keyword),
+            len(self.lines),
+        )
+        kept = self.lines[:position] + [
+            entry for entry in self.lines[position:] if entry[1] != keyword
+        ]
+        new = [
+            [" ".join([keyword] + args) + "\n", keyword, list(args)] for args in values
+        ]
+        if position and not kept[position - 1][0].endswith("\n"):
+            kept[position - 1][0] += "\n"
+        self.lines = kept[:position] + new + kept[position:]
+
+    def render(self) -> str:
+        return "".join(line for line, _, _ in self.lines)
+
+
+@dataclass
+class ConfigChange:
+    """The outcome of planning new settings against the current files"""
+
+    server: OpenVPNConfig
+    client: OpenVPNConfig | None
+    # directive -> [old args, new args], for every semantic difference
+    diff: dict[str, list] = field(default_factory=dict)
+    server_changed: bool = False
+    client_changed: bool = False
+
+    @property
+    def action(self) -> str | None:
+        """What the running server needs: "restart" or nothing.
+
+        There is no in-place reload: SIGHUP re-opens tun and re-reads the
+        keys, which fails once OpenVPN runs as nobody, so any server.conf
+        change is applied by a restart.
+        """
+        return "restart" if self.server_changed else None
+
+
+def normalize_proto(value: str | None) -> str | None:
+    """tcp, tcp-server and tcp-client are the same transport"""
+    if value is None:
+        return None
+    value = value.lower()
+    for suffix in ("-server", "-client"):
+        if value.endswith(suffix):
+            return value[: -len(suffix)]
+    return value
+
+
+def format_proto(protocol: str, role: str, current: str | None) -> str:
+    """Spell protocol for a config role in the style the file already uses"""
+    protocol = normalize_proto(protocol)
+    if protocol.startswith("tcp") and current and current.endswith(f"-{role}"):
+        return f"{protocol}-{role}"
+    return protocol
+
+
+def plan(
+    server: OpenVPNConfig,
+    client: OpenVPNConfig | None,
+    ovpn_port: int | str,
+    protocol: str,
+    tunnel_address: str | None = None,
+    management: bool = False,
+) -> ConfigChange:
+    """Apply the node settings to parsed configs and record what really changed.
+
+    An empty tunnel_address keeps the host of the first remote. With
+    management, the management socket line is added if missing, and the
+    status file the connection monitor falls back to is written every
+    STATUS_INTERVAL seconds in status-version 3.
+    """
+    change = ConfigChange(server, client)
+    port = str(ovpn_port)
+
+    def update(config: OpenVPNConfig, scope: str, keyword: str, args: list[str]):
+        old = config.get(keyword)
+        same = old == args
+        if keyword == "proto" and old:
+            same = normalize_proto(old[0]) == normalize_proto(args[0])
+        if not same:
+            config.set(keyword, *args)
+            change.diff[f"{scope}:{keyword}"] = [old, args]
+            if scope == "server":
+                change.server_changed = True
+            else:
+                change.client_changed = True
+
+    update(server, "server", "port", [port])
+    current = (server.get("proto") or [None])[0]
+    update(server, "server", "proto", [format_proto(protocol, "server", current)])
+    if management and server.get("management") is None:
+        update(server, "server", "management", [MANAGEMENT_SOCKET, "unix"])
+    if management:
+        update(server, "server", "status", [STATUS_FILE, STATUS_INTERVAL])
+        update(server, "server", "status-version", ["3"])
+
+    if client is not None:
+        remotes = client.get_all("remote")
+        if remotes:
+            first = remotes[0]
+            host = tunnel_address.strip() if tunnel_address else ""
+            wanted = [host or first[0], port] + first[2:]
+            if first[:2] != wanted[:2]:
+                remotes[0] = wanted
+                client.set_all("remote", remotes)
+                change.diff["client:remote"] = [first, wanted]
+                change.client_changed = True
+        current = (client.get("proto") or [None])[0]
+        update(client, "client", "proto", [format_proto(protocol, "client", current)])
+    return change
+
+
+def write_atomic(path: str, text: str) -> None:
+    """Replace path with text through a temp file and rename, keeping its mode"""
+    directory = os.path.dirname(path)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def apply_settings(
+    ovpn_port: int | str,
+    protocol: str,
+    tunnel_address: str | None = None,
+    management: bool = False,
+    server_path: str = SERVER_CONF,
+    client_path: str = CLIENT_TEMPLATE,
+) -> ConfigChange:
+    """Plan the settings against the files and write only those that changed"""
+    server = OpenVPNConfig.load(server_path)
+    client = OpenVPNConfig.load(client_path) if os.path.exists(client_path) else None
+    change = plan(server, client, ovpn_port, protocol, tunnel_address, management)
+    if change.server_changed:
+        write_atomic(server_path, server.render())
+    if change.client_changed:
+        write_atomic(client_path, client.render())
+    return change
@@ -8,6 +8,8 @@ from colorama import Fore, Style
 
 
 def create_ccd() -> None:
+    from core.setting import ovpn_config
+
     ccd_dir = "/etc/openvpn/ccd"
     server_conf = "/etc/openvpn/server/server.conf"
 
@@ -26,6 +28,9 @@ def create_ccd() -> None:
 
         if ccd_exclusive_line not in lines:
             lines.append(ccd_exclusive_line)
+
+        if not any(line.startswith("management ") for line in lines):
+            lines.append(f"management {ovpn_config.MANAGEMENT_SOCKET} unix\n")
         with open(server_conf, "w") as f:
             f.writelines(lines)
 
@@ -36,65 +41,16 @@ def create_ccd() -> None:
 
 def apply_openvpn_config(tunnel_address: str, protocol: str, ovpn_port: str) -> None:
     """Apply OpenVPN configuration settings"""
-    import re
-
-    server_conf = "/etc/openvpn/server/server.conf"
-    template_file = "/etc/openvpn/server/client-common.txt"
+    from core.setting import ovpn_config
 
     try:
-        # Determine correct protocol format for server and client
-        server_proto = f"{protocol}-server" if protocol == "tcp" else protocol
-        client_proto = f"{protocol}-client" if protocol == "tcp" else protocol
-
-        # Update server.conf
-        if os.path.exists(server_conf):
-            with open(server_conf, "r") as f:
-                config = f.read()
-
-            config = re.sub(
-                r"^port\s+\d+", f"port {ovpn_port}", config, flags=re.MULTILINE
-            )
-            config = re.sub(
-                r"^proto\s+[\w-]+", f"proto {server_proto}", config, flags=re.MULTILINE
-            )
-
-            with open(server_conf, "w") as f:
-                f.write(config)
-
-        # Update client-common.txt
-        if os.path.exists(template_file):
-            with open(template_file, "r") as f:
-                template = f.read()
-
-            if tunnel_address and tunnel_address.strip() != "":
-                template = re.sub(
-                    r"^remote\s+\S+\s+\d+",
-                    f"remote {tunnel_address} {ovpn_port}",
-                    template,
-                    flags=re.MULTILINE,
-                )
-            else:
-                template = re.sub(
-                    r"^remote\s+(\S+)\s+\d+",
-                    rf"remote \1 {ovpn_port}",
-                    template,
-                    flags=re.MULTILINE,
-                )
-
-            template = re.sub(
-                r"^proto\s+[\w-]+",
-                f"proto {client_proto}",
-                template,
-                flags=re.MULTILINE,
-            )
-
-            with open(template_file, "w") as f:
-                f.write(template)
-
-        # Restart OpenVPN service
-        subprocess.run(
-            ["systemctl", "restart", "openvpn-server@server.service"], check=True
+        change = ovpn_config.apply_settings(
+            ovpn_port, protocol, tunnel_address, management=True
         )
+        if change.action is not None:
+            subprocess.run(
+                ["systemctl", "restart", "openvpn-server@server.service"], check=True
+            )
         print(
             Fore.GREEN
             + f"✓ OpenVPN configured: {protocol}://{tunnel_address}:{ovpn_port}"
@@ -341,6 +297,9 @@ def update_ovnode():
         install_dir = "/opt/ov-node"
         env_file = os.path.join(install_dir, ".env")
         backup_env = "/tmp/ovnode_env_backup"
+        # Registry, limits, change journal and traffic history live here
+        data_dir = os.path.join(install_dir, "data")
+        backup_data = "/opt/ovnode_data_backup"
 
         response = requests.get(repo)
         response.raise_for_status()
@@ -355,6 +314,11 @@ def update_ovnode():
         if os.path.exists(env_file):
             shutil.copy2(env_file, backup_env)
 
+        if os.path.exists(data_dir):
+            if os.path.exists(backup_data):
+                shutil.rmtree(backup_data)
+            shutil.move(data_dir, backup_data)
+
         if os.path.exists(install_dir):
             shutil.rmtree(install_dir)
 
@@ -368,6 +332,11 @@ def update_ovnode():
         if os.path.exists(backup_env):
             shutil.move(backup_env, env_file)
 
+        if os.path.exists(backup_data):
+            if os.path.exists(data_dir):
+                shutil.rmtree(data_dir)
+            shutil.move(backup_data, data_dir)
+
         print(Fore.YELLOW + "Installing requirements..." + Style.RESET_ALL)
         os.chdir(install_dir)
         subprocess.run(["uv", "sync"], check=True)
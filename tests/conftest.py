@@ -0,0 +1,83 @@
+import datetime
+import os
+
+import pytest
+
+# core.config needs an API key before anything under core is imported
+os.environ.setdefault("API_KEY", "test")
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+@pytest.fixture
+def pki(tmp_path, monkeypatch):
+    """The pki module pointed at a fresh easy-rsa layout with its own CA"""
+    from core.service import pki
+
+    server_dir = tmp_path / "server"
+    pki_dir = server_dir / "easy-rsa" / "pki"
+    for sub in ("issued", "private", "certs_by_serial", "reqs"):
+        (pki_dir / sub).mkdir(parents=True)
+    profile_dir = tmp_path / "profiles"
+    profile_dir.mkdir()
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Easy-RSA CA")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=3650))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), True)
+        .add_extension(
+            x509.KeyUsage(
+                digital_signature=False,
+                content_commitment=False,
+                key_encipherment=False,
+                data_encipherment=False,
+                key_agreement=False,
+                key_cert_sign=True,
+                crl_sign=True,
+                encipher_only=False,
+                decipher_only=False,
+            ),
+            True,
+        )
+        .add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(key.public_key()), False
+        )
+        .sign(key, hashes.SHA256())
+    )
+    (pki_dir / "ca.crt").write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    (pki_dir / "private" / "ca.key").write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    # The first entry is the server certificate, as openvpn-install.sh leaves it
+    (pki_dir / "index.txt").write_text(
+        "V\t351231000000Z\t\t01AB\tunknown\t/CN=server\n"
+    )
+    (server_dir / "client-common.txt").write_text(
+        "client\ndev tun\nproto udp\nremote 203.0.113.1 1194\n"
+    )
+    (server_dir / "tc.key").write_text(
+        "-----BEGIN OpenVPN Static key V1-----\n00\n-----END OpenVPN Static key V1-----\n"
+    )
+
+    monkeypatch.setattr(pki, "SERVER_DIR", str(server_dir))
+    monkeypatch.setattr(pki, "PKI_DIR", str(pki_dir))
+    monkeypatch.setattr(pki, "CLIENT_COMMON", str(server_dir / "client-common.txt"))
+    monkeypatch.setattr(pki, "TLS_CRYPT_KEY", str(server_dir / "tc.key"))
+    monkeypatch.setattr(pki, "PROFILE_DIR", str(profile_dir))
+    monkeypatch.setattr(pki, "_ca_cache", {})
+    return pki
@@ -0,0 +1,51 @@
+from core.service.connections import STALE_INTERVALS, ConnectionMonitor
+from core.service.fake_management import FakeManagementServer
+
+
+def _status(*names: str) -> list[str]:
+    server = FakeManagementServer("unused.sock")
+    for name in names:
+        server.connect_client(name)
+    return server.status_lines()
+
+
+def test_snapshot_goes_stale_then_empty_without_a_source(tmp_path):
+    monitor = ConnectionMonitor(5, str(tmp_path / "missing-status.log"))
+    assert monitor.snapshot()["stale"]
+
+    monitor._collect({0: _status("alice", "bob")})
+    snapshot = monitor.snapshot()
+    assert (snapshot["stale"], snapshot["count"]) == (False, 2)
+
+    # Nothing answers: the sessions are kept, flagged stale with their age
+    monitor._collect({})
+    snapshot = monitor.snapshot()
+    assert snapshot["stale"] and snapshot["count"] == 2
+    assert snapshot["age"] is not None
+    assert len(monitor.sessions_of("alice")) == 1
+
+    monitor._snapshot["updated_at"] -= 5 * STALE_INTERVALS + 1
+    monitor._collect({})
+    snapshot = monitor.snapshot()
+    assert snapshot["stale"] and snapshot["count"] == 0
+    assert snapshot["sessions"] == [] and monitor.sessions_of("alice") == []
+    assert snapshot["age"] > 5 * STALE_INTERVALS
+
+    monitor._collect({0: _status("alice")})
+    assert not monitor.snapshot()["stale"]
+    assert monitor.snapshot()["count"] == 1
+
+
+def test_status_files_answer_for_unreachable_instances(tmp_path):
+    status_file = tmp_path / "openvpn-status-1.log"
+    status_file.write_text("\n".join(_status("carol")) + "\n")
+    monitor = ConnectionMonitor(5, str(tmp_path / "openvpn-status.log"))
+    monitor.configure([str(tmp_path / "openvpn-status.log"), str(status_file)])
+
+    monitor._collect({0: _status("alice")})
+    snapshot = monitor.snapshot()
+    assert snapshot["source"] == "management+status-file"
+    assert [(s["common_name"], s["instance"]) for s in snapshot["sessions"]] == [
+        ("alice", 0),
+        ("carol", 1),
+    ]
@@ -0,0 +1,114 @@
+import pytest
+
+from core.service import instances
+from core.service.instances import InstanceManager
+from core.setting import ovpn_config
+
+SERVER_CONF = """\
+local 203.0.113.1
+port 1194
+proto udp
+dev tun
+server 10.8.0.0 255.255.255.0
+server-ipv6 fddd:1194:1194:1194::/64
+ifconfig-pool-persist ipp.txt
+management /etc/openvpn/server/management.sock unix
+status /etc/openvpn/server/openvpn-status.log 10
+status-version 3
+"""
+
+FIREWALL = """\
+[Service]
+Type=oneshot
+ExecStart=/usr/sbin/iptables -t nat -A POSTROUTING -s 10.8.0.0/24 ! -d 10.8.0.0/24 -j SNAT --to 203.0.113.1
+ExecStart=/usr/sbin/iptables -I INPUT -p udp --dport 1194 -j ACCEPT
+ExecStart=/usr/sbin/iptables -I FORWARD -m state --state RELATED,ESTABLISHED -j ACCEPT
+ExecStart=/usr/sbin/ip6tables -I FORWARD -s fddd:1194:1194:1194::/64 -j ACCEPT
+RemainAfterExit=yes
+"""
+
+
+@pytest.fixture
+def server_dir(tmp_path, monkeypatch):
+    """server.conf, client-common.txt and the installer's firewall unit"""
+    (tmp_path / "server.conf").write_text(SERVER_CONF)
+    (tmp_path / "client-common.txt").write_text("client\nremote 203.0.113.1 1194\n")
+    (tmp_path / "openvpn-iptables.service").write_text(FIREWALL)
+    monkeypatch.setattr(ovpn_config, "SERVER_CONF", str(tmp_path / "server.conf"))
+    monkeypatch.setattr(
+        ovpn_config, "CLIENT_TEMPLATE", str(tmp_path / "client-common.txt")
+    )
+    monkeypatch.setattr(instances, "SERVER_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        instances, "FIREWALL_UNIT", str(tmp_path / "openvpn-iptables.service")
+    )
+    monkeypatch.setattr(
+        instances, "INSTANCES_FIREWALL_UNIT", str(tmp_path / "instances.service")
+    )
+    monkeypatch.setattr(instances, "_systemctl", lambda *args: True)
+    monkeypatch.setattr(instances.management_client, "configure", lambda a: None)
+    monkeypatch.setattr(instances.connection_monitor, "configure", lambda f: None)
+    monkeypatch.setattr(instances.reload_scheduler, "units", [])
+    monkeypatch.setattr(instances.system_sampler, "tun_interfaces", [])
+    return tmp_path
+
+
+def test_extra_instances_get_their_own_port_subnet_and_files(server_dir):
+    manager = InstanceManager(3)
+    manager.provision()
+
+    assert (server_dir / "server.conf").read_text() == SERVER_CONF
+    config = ovpn_config.OpenVPNConfig.load(str(server_dir / "server-2.conf"))
+    assert config.get("port") == ["1196"]
+    assert config.get("dev") == ["tun2"]
+    assert config.get("server") == ["10.8.2.0", "255.255.255.0"]
+    assert config.get("server-ipv6") == ["fddd:1194:1194:1196::/64"]
+    assert config.get("ifconfig-pool-persist") == ["ipp-2.txt"]
+    assert config.get("management") == [
+        "/etc/openvpn/server/management-2.sock",
+        "unix",
+    ]
+    assert config.get("status") == ["/etc/openvpn/server/openvpn-status-2.log", "10"]
+    assert instances.system_sampler.tun_interfaces == ["tun0", "tun1", "tun2"]
+    assert instances.reload_scheduler.units == [
+        "openvpn-server@server",
+        "openvpn-server@server-1",
+        "openvpn-server@server-2",
+    ]
+
+    client = ovpn_config.OpenVPNConfig.load(str(server_dir / "client-common.txt"))
+    assert client.get_all("remote") == [
+        ["203.0.113.1", "1194"],
+        ["203.0.113.1", "1195"],
+        ["203.0.113.1", "1196"],
+    ]
+    assert client.get_all("remote-random") == [[]]
+
+
+def test_firewall_rules_are_copied_for_each_extra_instance(server_dir):
+    InstanceManager(3).provision()
+
+    rules = (server_dir / "instances.service").read_text().splitlines()
+    assert "Type=oneshot" in rules
+    assert [rule for rule in rules if rule.startswith("ExecStart=")] == [
+        "ExecStart=/usr/sbin/iptables -t nat -A POSTROUTING -s 10.8.1.0/24"
+        " ! -d 10.8.1.0/24 -j SNAT --to 203.0.113.1",
+        "ExecStart=/usr/sbin/iptables -t nat -A POSTROUTING -s 10.8.2.0/24"
+        " ! -d 10.8.2.0/24 -j SNAT --to 203.0.113.1",
+        "ExecStart=/usr/sbin/iptables -I INPUT -p udp --dport 1195 -j ACCEPT",
+        "ExecStart=/usr/sbin/iptables -I INPUT -p udp --dport 1196 -j ACCEPT",
+        "ExecStart=/usr/sbin/ip6tables -I FORWARD -s fddd:1194:1194:1195::/64"
+        " -j ACCEPT",
+        "ExecStart=/usr/sbin/ip6tables -I FORWARD -s fddd:1194:1194:1196::/64"
+        " -j ACCEPT",
+    ]
+
+
+def test_shrinking_to_one_instance_removes_the_extra_ones(server_dir):
+    InstanceManager(3).provision()
+    InstanceManager(1).provision()
+
+    assert not (server_dir / "server-1.conf").exists()
+    assert not (server_dir / "server-2.conf").exists()
+    assert not (server_dir / "instances.service").exists()
+    assert instances.system_sampler.tun_interfaces == ["tun0"]
@@ -0,0 +1,85 @@
+import asyncio
+
+from core.service.jobs import PRIORITY_BATCH, PRIORITY_USER, JobManager
+
+
+def _run(manager: JobManager, scenario) -> None:
+    async def main():
+        await manager.start()
+        try:
+            await scenario()
+        finally:
+            await manager.stop()
+
+    asyncio.run(main())
+
+
+async def _finished(*jobs) -> None:
+    while any(job.finished_at is None for job in jobs):
+        await asyncio.sleep(0.01)
+
+
+def test_user_jobs_overtake_queued_batch_work():
+    manager = JobManager(1, 100, 3600)
+    order = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def blocking(job):
+            await release.wait()
+            order.append("blocking")
+
+        def recording(label):
+            async def func(job):
+                order.append(label)
+
+            return func
+
+        blocker = manager.submit("t", blocking, PRIORITY_BATCH)
+        await asyncio.sleep(0.01)
+        batch = manager.submit("t", recording("batch"), PRIORITY_BATCH)
+        user = manager.submit("t", recording("user"), PRIORITY_USER)
+        release.set()
+        await _finished(blocker, batch, user)
+
+    _run(manager, scenario)
+    assert order == ["blocking", "user", "batch"]
+
+
+def test_jobs_keep_their_result_progress_and_error():
+    manager = JobManager(2, 100, 3600)
+
+    async def scenario():
+        async def counting(job):
+            job.set_progress(1)
+            return {"count": 3}
+
+        async def failing(job):
+            raise RuntimeError("disk full")
+
+        done = manager.submit("t", counting, total=3)
+        failed = manager.submit("t", failing)
+        await _finished(done, failed)
+
+        assert manager.get(done.id).to_dict()["result"] == {"count": 3}
+        assert (done.status, done.progress) == ("done", 3)
+        assert (failed.status, failed.error) == ("failed", "disk full")
+
+    _run(manager, scenario)
+
+
+def test_finished_jobs_are_evicted_beyond_the_history():
+    manager = JobManager(1, 2, 3600)
+
+    async def scenario():
+        async def noop(job):
+            return None
+
+        jobs = [manager.submit("t", noop) for _ in range(3)]
+        await _finished(*jobs)
+
+        assert manager.get(jobs[0].id) is None
+        assert manager.get(jobs[2].id) is not None
+
+    _run(manager, scenario)
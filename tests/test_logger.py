@@ -0,0 +1,30 @@
+import io
+import json
+import logging
+
+from core import logger as log
+
+
+def test_queued_json_records_keep_the_exception_separate():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(log.JsonFormatter())
+    queue_handler = log.queued(handler)
+    test_logger = logging.getLogger("test.queued")
+    test_logger.addHandler(queue_handler)
+    test_logger.propagate = False
+    try:
+        try:
+            raise ValueError("bad port")
+        except ValueError:
+            test_logger.exception("Failed to apply %s", "settings")
+    finally:
+        test_logger.removeHandler(queue_handler)
+        listener = log._listeners.pop()
+        listener.stop()
+
+    entry = json.loads(stream.getvalue())
+    assert entry["message"] == "Failed to apply settings"
+    assert entry["level"] == "ERROR"
+    assert entry["exception"].startswith("Traceback")
+    assert "ValueError: bad port" in entry["exception"]
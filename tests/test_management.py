@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+from core.service import management
+from core.service.connections import parse_status
+from core.service.fake_management import FakeManagementServer
+from core.service.management import ManagementClient, ManagementPool, kill_client
+from core.service.traffic import Tier, TrafficAccounting
+
+
+async def _wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+def _run(tmp_path, scenario) -> None:
+    """Run scenario(server, client) against a fake management socket"""
+
+    async def main():
+        server = FakeManagementServer(str(tmp_path / "management.sock"))
+        await server.start()
+        client = ManagementClient(server.address, instance=2)
+        await client.start()
+        try:
+            await _wait_for(lambda: client.connected)
+            await scenario(server, client)
+        finally:
+            await client.stop()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_pipelined_commands_get_their_own_replies(tmp_path):
+    async def scenario(server, client):
+        alice = server.connect_client("alice", "198.51.100.7:40000")
+        server.connect_client("bob")
+        server.add_traffic(alice.cid, 1000, 2000)
+
+        status, killed, missing, stats = await asyncio.gather(
+            client.status(),
+            client.kill("bob"),
+            client.kill("nobody"),
+            client.load_stats(),
+        )
+
+        sessions = parse_status(status)
+        assert [s.common_name for s in sessions] == ["alice", "bob"]
+        assert sessions[0].real_address == "198.51.100.7:40000"
+        assert sessions[0].bytes_received == 1000
+        assert sessions[0].client_id == alice.cid
+        assert killed.startswith("SUCCESS:")
+        assert missing.startswith("ERROR:")
+        # Commands run in the order they were sent: bob is gone by load-stats
+        assert stats == {"nclients": 1, "bytesin": 1000, "bytesout": 2000}
+        assert [c.name for c in server.clients.values()] == ["alice"]
+
+    _run(tmp_path, scenario)
+
+
+def test_reconnects_after_the_server_goes_away(tmp_path):
+    async def scenario(server, client):
+        await server.stop()
+        await _wait_for(lambda: not client.connected)
+
+        await server.start()
+        await _wait_for(lambda: client.connected)
+        server.connect_client("alice")
+        assert parse_status(await client.status())[0].common_name == "alice"
+
+    _run(tmp_path, scenario)
+
+
+def test_client_notifications_are_delivered_with_their_env(tmp_path):
+    async def scenario(server, client):
+        events = []
+        unsubscribe = client.subscribe("CLIENT", events.append)
+        alice = server.connect_client("alice", "198.51.100.7:40000")
+        server.add_traffic(alice.cid, 300, 700)
+        server.disconnect_client(alice.cid)
+        await _wait_for(lambda: len(events) == 2)
+
+        established, disconnect = events
+        assert established["event"] == "ESTABLISHED"
+        assert established["args"] == [str(alice.cid)]
+        assert established["instance"] == 2
+        assert established["env"]["common_name"] == "alice"
+        assert established["env"]["trusted_ip"] == "198.51.100.7"
+        assert disconnect["event"] == "DISCONNECT"
+        assert disconnect["env"]["bytes_received"] == "300"
+        assert disconnect["env"]["bytes_sent"] == "700"
+
+        unsubscribe()
+        server.connect_client("bob")
+        await client.status()
+        assert len(events) == 2
+
+    _run(tmp_path, scenario)
+
+
+def test_disconnect_settles_bytes_moved_after_the_last_sample(tmp_path):
+    traffic = TrafficAccounting(
+        str(tmp_path / "traffic"), 60, [Tier("1m", 60, 5), Tier("1h", 3600, 3)]
+    )
+
+    async def scenario(server, client):
+        events = []
+        client.subscribe("CLIENT", events.append)
+        alice = server.connect_client("alice")
+        server.add_traffic(alice.cid, 1000, 100)
+        sessions = parse_status(await client.status())
+        for session in sessions:
+            session.instance = client.instance
+        traffic.sample([vars(session) for session in sessions])
+
+        server.add_traffic(alice.cid, 500, 50)
+        server.disconnect_client(alice.cid)
+        await _wait_for(lambda: len(events) == 2)
+        traffic._settle(events[1])
+
+        # The session is gone from status before the next sample
+        traffic.sample([])
+
+    _run(tmp_path, scenario)
+    usage = traffic.usage("alice")
+    assert (usage["bytes_received"], usage["bytes_sent"]) == (1500, 150)
+
+
+def test_pool_reconfigures_while_running_and_kills_where_connected(
+    tmp_path, monkeypatch
+):
+    async def main():
+        first = FakeManagementServer(str(tmp_path / "management.sock"))
+        second = FakeManagementServer(str(tmp_path / "management-1.sock"))
+        await first.start()
+        await second.start()
+        pool = ManagementPool([first.address])
+        monkeypatch.setattr(management, "management_client", pool)
+        events = []
+        pool.subscribe("CLIENT", events.append)
+        await pool.start()
+        try:
+            await _wait_for(lambda: pool.connected)
+            await asyncio.to_thread(pool.configure, [first.address, second.address])
+            await _wait_for(lambda: all(c.connected for c in pool.clients))
+
+            second.connect_client("bob")
+            await _wait_for(lambda: len(events) == 1)
+            assert events[0]["instance"] == 1
+            assert await asyncio.to_thread(kill_client, "bob")
+            assert list(second.clients) == []
+
+            # bob's sessions can only be on the instance that is down
+            first.connect_client("alice")
+            await second.stop()
+            await _wait_for(lambda: not pool.clients[1].connected)
+            assert await asyncio.to_thread(kill_client, "alice")
+            assert not await asyncio.to_thread(kill_client, "bob")
+        finally:
+            await pool.stop()
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,26 @@
+from fastapi.testclient import TestClient
+
+from core.app import api
+from core.service.metrics import REQUEST_DURATION
+
+
+def test_request_labels_stay_bounded_for_unknown_methods_and_paths():
+    with TestClient(api) as client:
+        for i in range(10):
+            client.request(f"X{i}", f"/no/such/path/{i}")
+            client.get(f"/scan/{i}")
+
+    methods = {labels[0] for labels in REQUEST_DURATION._children}
+    routes = {labels[1] for labels in REQUEST_DURATION._children}
+    assert methods <= {
+        "GET",
+        "POST",
+        "PUT",
+        "DELETE",
+        "PATCH",
+        "HEAD",
+        "OPTIONS",
+        "other",
+    }
+    assert "other" in methods
+    assert not any(route.startswith(("/no/", "/scan/")) for route in routes)
@@ -0,0 +1,87 @@
+import os
+
+from core.setting import ovpn_config
+from core.setting.ovpn_config import OpenVPNConfig, apply_settings, plan
+
+SERVER = """\
+# Managed by openvpn-install.sh
+port 1194
+proto tcp-server
+dev tun
+<tls-crypt>
+port 9999
+</tls-crypt>
+status openvpn-status.log
+"""
+
+CLIENT = """\
+client
+proto tcp-client
+remote 203.0.113.1 1194
+"""
+
+
+def test_unchanged_config_renders_byte_for_byte():
+    config = OpenVPNConfig(SERVER)
+
+    assert config.render() == SERVER
+    assert config.get("port") == ["1194"]
+    assert config.get_all("port") == [["1194"]]
+
+
+def test_same_settings_plan_no_change():
+    change = plan(OpenVPNConfig(SERVER), OpenVPNConfig(CLIENT), 1194, "tcp")
+
+    assert change.diff == {}
+    assert change.action is None
+    assert not change.client_changed
+
+
+def test_plan_records_only_real_differences():
+    server, client = OpenVPNConfig(SERVER), OpenVPNConfig(CLIENT)
+    change = plan(server, client, "1195", "udp", "198.51.100.2")
+
+    assert change.diff == {
+        "server:port": [["1194"], ["1195"]],
+        "server:proto": [["tcp-server"], ["udp"]],
+        "client:remote": [["203.0.113.1", "1194"], ["198.51.100.2", "1195"]],
+        "client:proto": [["tcp-client"], ["udp"]],
+    }
+    assert change.action == "restart"
+    assert "port 1195\n" in server.render() and "port 9999\n" in server.render()
+    assert client.get_all("remote") == [["198.51.100.2", "1195"]]
+
+
+def test_management_adds_the_socket_and_status_file():
+    server = OpenVPNConfig(SERVER)
+    plan(server, None, 1194, "tcp", management=True)
+
+    assert server.get("management") == [ovpn_config.MANAGEMENT_SOCKET, "unix"]
+    assert server.get("status") == [
+        ovpn_config.STATUS_FILE,
+        ovpn_config.STATUS_INTERVAL,
+    ]
+    assert server.get("status-version") == ["3"]
+
+
+def test_apply_settings_writes_only_changed_files_keeping_their_mode(tmp_path):
+    server_path, client_path = tmp_path / "server.conf", tmp_path / "client.txt"
+    server_path.write_text(SERVER)
+    client_path.write_text(CLIENT)
+    os.chmod(server_path, 0o600)
+    client_inode = os.stat(client_path).st_ino
+
+    apply_settings(
+        1195, "tcp", server_path=str(server_path), client_path=str(client_path)
+    )
+
+    assert "port 1195\n" in server_path.read_text()
+    assert os.stat(server_path).st_mode & 0o777 == 0o600
+    assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".")] == []
+    # The client remote follows the port, so it was replaced as well
+    assert os.stat(client_path).st_ino != client_inode
+    untouched = os.stat(client_path).st_ino
+    apply_settings(
+        1195, "tcp", server_path=str(server_path), client_path=str(client_path)
+    )
+    assert os.stat(client_path).st_ino == untouched
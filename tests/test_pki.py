@@ -0,0 +1,101 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+needs_openssl = pytest.mark.skipif(
+    shutil.which("openssl") is None, reason="openssl is not installed"
+)
+
+
+def _index(pki) -> list[list[str]]:
+    with open(f"{pki.PKI_DIR}/index.txt") as f:
+        return [line.rstrip("\n").split("\t") for line in f]
+
+
+def _issue(pki, *names: str) -> dict:
+    key_spec = pki.client_key_spec()
+    return pki.issue_clients(
+        {name: pki.generate_client_key(*key_spec) for name in names}
+    )
+
+
+def _verify(pki, cert_path: str) -> subprocess.CompletedProcess:
+    """openssl verify against the CA and the CRL the server would load"""
+    with open(f"{pki.PKI_DIR}/ca.crt") as ca, open(f"{pki.SERVER_DIR}/crl.pem") as crl:
+        bundle = os.path.join(pki.PKI_DIR, "ca-crl.pem")
+        with open(bundle, "w") as f:
+            f.write(ca.read() + crl.read())
+    return subprocess.run(
+        ["openssl", "verify", "-crl_check", "-CAfile", bundle, cert_path],
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_issue_clients_appends_index_and_writes_profiles(pki):
+    results = _issue(pki, "alice", "bob")
+
+    assert set(results) == {"alice", "bob"}
+    serials = [entry[3] for entry in _index(pki)[1:]]
+    assert serials == [results["alice"], results["bob"]]
+    assert [entry[5] for entry in _index(pki)[1:]] == ["/CN=alice", "/CN=bob"]
+    with open(f"{pki.PKI_DIR}/serial") as f:
+        assert int(f.read(), 16) == int(results["bob"], 16) + 1
+    for name in ("alice", "bob"):
+        assert os.path.exists(f"{pki.PKI_DIR}/issued/{name}.crt")
+        with open(f"{pki.PROFILE_DIR}/{name}.ovpn") as f:
+            profile = f.read()
+        assert "remote 203.0.113.1 1194" in profile
+        assert "<cert>" in profile and "<key>" in profile and "<tls-crypt>" in profile
+
+
+def test_issue_clients_rejects_existing_name(pki):
+    _issue(pki, "alice")
+    results = _issue(pki, "alice", "carol")
+
+    assert isinstance(results["alice"], pki.PKIError)
+    assert isinstance(results["carol"], str)
+    assert len(_index(pki)) == 3
+
+
+def test_revoke_clients_marks_index_and_archives(pki):
+    issued = _issue(pki, "alice", "bob")
+    results = pki.revoke_clients(["alice", "nobody"])
+
+    assert results["alice"] == issued["alice"]
+    assert isinstance(results["nobody"], pki.PKIError)
+    entries = {entry[5]: entry for entry in _index(pki)}
+    assert entries["/CN=alice"][0] == "R" and entries["/CN=alice"][2]
+    assert entries["/CN=bob"][0] == "V"
+    assert entries["/CN=server"][0] == "V"
+    assert not os.path.exists(f"{pki.PKI_DIR}/issued/alice.crt")
+    assert not os.path.exists(f"{pki.PKI_DIR}/private/alice.key")
+    assert os.path.exists(
+        f"{pki.PKI_DIR}/revoked/certs_by_serial/{issued['alice']}.crt"
+    )
+    assert os.path.exists(f"{pki.PKI_DIR}/index.txt.old")
+
+
+def test_revoke_clients_never_touches_the_server_certificate(pki):
+    results = pki.revoke_clients(["server"])
+
+    assert isinstance(results["server"], pki.PKIError)
+    assert _index(pki)[0][0] == "V"
+
+
+@needs_openssl
+def test_crl_round_trip_with_openssl(pki):
+    issued = _issue(pki, "alice", "bob")
+    pki.generate_crl()
+    assert _verify(pki, f"{pki.PKI_DIR}/issued/alice.crt").returncode == 0
+
+    pki.revoke_clients(["alice"])
+
+    revoked = _verify(
+        pki, f"{pki.PKI_DIR}/revoked/certs_by_serial/{issued['alice']}.crt"
+    )
+    assert revoked.returncode != 0
+    assert "revoked" in revoked.stdout + revoked.stderr
+    assert _verify(pki, f"{pki.PKI_DIR}/issued/bob.crt").returncode == 0
@@ -0,0 +1,58 @@
+import gzip
+from email.utils import formatdate
+
+from starlette.requests import Request
+
+from core.routers.router import _profile_response
+from core.service.profile import Profile
+
+PROFILE = Profile(data=b"client\n" * 100, etag="abc", last_modified=1700000000.0)
+
+
+def _get(**headers: str):
+    request = Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/sync/download/ovpn/alice",
+            "headers": [
+                (key.replace("_", "-").encode(), value.encode())
+                for key, value in headers.items()
+            ],
+        }
+    )
+    return _profile_response(request, PROFILE, "alice")
+
+
+def test_each_encoding_has_its_own_etag():
+    plain = _get()
+    zipped = _get(accept_encoding="gzip")
+
+    assert plain.status_code == zipped.status_code == 200
+    assert plain.headers["etag"] == '"abc"'
+    assert plain.body == PROFILE.data
+    assert zipped.headers["etag"] == '"abc-gzip"'
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(zipped.body) == PROFILE.data
+
+
+def test_304_carries_the_etag_of_the_representation_it_stands_for():
+    response = _get(accept_encoding="gzip", if_none_match='"abc-gzip"')
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"abc-gzip"'
+    assert not response.body
+
+
+def test_an_etag_of_another_encoding_does_not_match():
+    response = _get(accept_encoding="gzip", if_none_match='"abc"')
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+
+
+def test_if_modified_since_is_only_used_without_if_none_match():
+    since = formatdate(PROFILE.last_modified, usegmt=True)
+
+    assert _get(if_modified_since=since).status_code == 304
+    assert _get(if_modified_since=since, if_none_match='"old"').status_code == 200
@@ -0,0 +1,49 @@
+import time
+
+from core.service import quota
+from core.service.quota import Limit, QuotaEngine
+
+
+def _engine(monkeypatch, tmp_path, *limits: Limit) -> QuotaEngine:
+    monkeypatch.setattr(quota, "CCD_DIR", str(tmp_path))
+    monkeypatch.setattr(quota.traffic, "_sampled", True)
+    engine = QuotaEngine(60, 100)
+    engine._limits = {limit.name: limit for limit in limits}
+    return engine
+
+
+def test_users_over_their_limits_are_cut_off(monkeypatch, tmp_path):
+    over = Limit("alice", data_limit=1000, used=1500)
+    under = Limit("bob", data_limit=1000, used=10)
+    expired = Limit("carol", expires_at=time.time() - 1)
+    engine = _engine(monkeypatch, tmp_path, over, under, expired)
+
+    actions = {
+        limit.name: (violation, used) for limit, violation, used in engine.check()
+    }
+    assert actions == {"alice": ("quota", 1500), "carol": ("expired", 0)}
+
+
+def test_data_limits_wait_for_the_first_traffic_sample(monkeypatch, tmp_path):
+    engine = _engine(monkeypatch, tmp_path, Limit("alice", data_limit=1, used=5))
+    monkeypatch.setattr(quota.traffic, "_sampled", False)
+
+    assert engine.check() == []
+
+
+def test_a_cut_off_user_comes_back_only_when_the_limit_changes(monkeypatch, tmp_path):
+    limit = Limit("alice", data_limit=1000, used=10, enforced="quota")
+    engine = _engine(monkeypatch, tmp_path, limit)
+
+    assert engine.check() == []
+    engine._review.add("alice")
+    assert [(l.name, v) for l, v, _ in engine.check()] == [("alice", None)]
+
+
+def test_a_user_reactivated_behind_the_engine_is_cut_off_again(monkeypatch, tmp_path):
+    limit = Limit("alice", data_limit=1000, used=1500, enforced="quota")
+    engine = _engine(monkeypatch, tmp_path, limit)
+
+    assert engine.check() == []
+    (tmp_path / "alice").write_text("")
+    assert [(l.name, v) for l, v, _ in engine.check()] == [("alice", "quota")]
@@ -0,0 +1,51 @@
+import asyncio
+import os
+
+from core.routers.router import _reconcile
+from core.schema.all_schemas import ReconcileRequest
+from core.service import user_managment
+from core.service.user_managment import reconcile_users
+
+
+def _node(monkeypatch, valid, revoked, ccd):
+    """Fake the registry's view of the PKI and the ccd directory"""
+    names = {"valid": list(valid), "revoked": list(revoked)}
+    monkeypatch.setattr(user_managment.registry, "names", lambda status: names[status])
+    listdir = os.listdir
+    monkeypatch.setattr(
+        user_managment.os,
+        "listdir",
+        lambda path: list(ccd) if path == "/etc/openvpn/ccd" else listdir(path),
+    )
+
+
+def test_clients_not_listed_are_kept_without_prune(monkeypatch, pki):
+    _node(monkeypatch, ["alice", "bob"], [], ["alice", "bob"])
+
+    plan = reconcile_users({"alice": "activate", "carol": "deactivate"}, dry_run=True)[
+        "plan"
+    ]
+    assert plan == {
+        "create": ["carol"],
+        "revoke": [],
+        "activate": [],
+        "deactivate": [],
+        "orphans": [],
+    }
+
+
+def test_prune_sweeps_only_files_of_revoked_clients(monkeypatch, pki):
+    _node(monkeypatch, ["alice", "bob"], ["old", "gone"], ["DEFAULT", "alice", "old"])
+    open(f"{pki.PROFILE_DIR}/gone.ovpn", "w").close()
+
+    plan = reconcile_users({"alice": "deactivate"}, prune=True, dry_run=True)["plan"]
+    assert plan["revoke"] == ["bob"]
+    assert plan["deactivate"] == ["alice"]
+    assert plan["orphans"] == ["gone", "old"]
+
+
+def test_prune_to_an_empty_set_is_refused():
+    request = ReconcileRequest(users=[], prune=True)
+
+    response = asyncio.run(_reconcile(request))
+    assert not response.success
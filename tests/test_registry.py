@@ -0,0 +1,66 @@
+from core.service.registry import ClientRegistry
+
+
+def _registry(pki, tmp_path, journal_max: int = 100) -> ClientRegistry:
+    registry = ClientRegistry(str(tmp_path / "clients.db"), journal_max)
+    registry.rebuild()
+    return registry
+
+
+def test_changes_are_journaled_after_the_first_snapshot(pki, tmp_path):
+    registry = _registry(pki, tmp_path)
+    registry.record_issued({"alice": "02"})
+    first = registry.changes(0)
+    assert first["snapshot"] and first["revision"] == 1
+    assert [user["name"] for user in first["users"]] == ["alice"]
+
+    registry.record_issued({"bob": "03"})
+    registry.record_revoked(["bob"])
+    registry.record_change("settings_changed", data={"port": 1195})
+
+    changes = registry.changes(first["revision"])
+    assert not changes["snapshot"] and not changes["more"]
+    assert [(c["kind"], c["name"]) for c in changes["changes"]] == [
+        ("user_created", "bob"),
+        ("user_revoked", "bob"),
+        ("settings_changed", None),
+    ]
+    assert changes["changes"][-1]["data"] == {"port": 1195}
+    assert registry.changes(changes["revision"])["changes"] == []
+
+
+def test_changes_are_paged(pki, tmp_path):
+    registry = _registry(pki, tmp_path)
+    for i in range(5):
+        registry.record_change("settings_changed", data={"i": i})
+
+    page = registry.changes(1, limit=2)
+    assert [c["data"]["i"] for c in page["changes"]] == [1, 2]
+    assert page["more"]
+    rest = registry.changes(page["revision"])
+    assert [c["data"]["i"] for c in rest["changes"]] == [3, 4]
+
+
+def test_a_snapshot_replaces_dropped_entries_and_unknown_revisions(pki, tmp_path):
+    registry = _registry(pki, tmp_path, journal_max=3)
+    registry.record_issued({"alice": "02"})
+    for i in range(5):
+        registry.record_change("settings_changed", data={"i": i})
+
+    assert registry.changes(1)["snapshot"]
+    assert registry.changes(4)["snapshot"] is False
+    ahead = registry.changes(1000)
+    assert ahead["snapshot"] and ahead["revision"] == 6
+    assert [user["name"] for user in ahead["users"]] == ["alice"]
+
+
+def test_clients_issued_behind_our_back_are_journaled(pki, tmp_path):
+    registry = _registry(pki, tmp_path)
+    registry.record_change("settings_changed")
+    since = registry.changes(0)["revision"]
+
+    with open(f"{pki.PKI_DIR}/index.txt", "a") as f:
+        f.write("V\t351231000000Z\t\t02\tunknown\t/CN=carol\n")
+
+    changes = registry.changes(since)["changes"]
+    assert [(c["kind"], c["name"]) for c in changes] == [("user_created", "carol")]
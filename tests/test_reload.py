@@ -0,0 +1,65 @@
+from core.service import reload
+from core.service.reload import ReloadScheduler
+
+
+def _scheduler(monkeypatch) -> tuple[ReloadScheduler, list]:
+    commands = []
+    monkeypatch.setattr(
+        reload.subprocess, "run", lambda command, **kwargs: commands.append(command)
+    )
+    return ReloadScheduler(60), commands
+
+
+def test_a_window_runs_one_action_for_every_request(monkeypatch):
+    scheduler, commands = _scheduler(monkeypatch)
+    for _ in range(3):
+        scheduler.request()
+    scheduler.flush()
+
+    assert commands == [
+        [
+            "/usr/bin/systemctl",
+            "kill",
+            "--kill-who=main",
+            "-s",
+            "SIGUSR1",
+            "openvpn-server@server",
+        ]
+    ]
+    stats = scheduler.summary()
+    assert (stats["reconnects"], stats["coalesced"]) == (1, 2)
+    assert stats["restarts_saved"] == 0
+
+
+def test_one_restart_request_upgrades_the_window(monkeypatch):
+    scheduler, commands = _scheduler(monkeypatch)
+    scheduler.units = ["openvpn-server@server", "openvpn-server@server-1"]
+    scheduler.request()
+    scheduler.request(restart=True)
+    scheduler.request()
+    scheduler.flush()
+
+    assert commands == [
+        [
+            "/usr/bin/systemctl",
+            "restart",
+            "openvpn-server@server",
+            "openvpn-server@server-1",
+        ]
+    ]
+    assert scheduler.summary()["restarts_saved"] == 0
+
+
+def test_restarts_saved_counts_only_coalesced_restart_requests(monkeypatch):
+    scheduler, commands = _scheduler(monkeypatch)
+    for _ in range(3):
+        scheduler.request(restart=True)
+    scheduler.request()
+    scheduler.flush()
+    scheduler.request()
+    scheduler.flush()
+
+    stats = scheduler.summary()
+    assert (stats["restart_requests"], stats["restarts"]) == (3, 1)
+    assert stats["restarts_saved"] == 2
+    assert len(commands) == 2
@@ -0,0 +1,114 @@
+import asyncio
+
+from core.routers.router import _accept
+from core.schema.all_schemas import ResponseModel
+from core.service.jobs import PRIORITY_USER, job_manager
+from core.service.singleflight import SingleFlight
+
+
+def _counting(*results):
+    """An operation returning results in turn, counting its calls"""
+    calls = []
+
+    async def func():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        result = results[min(len(calls), len(results)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return func, calls
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight(60, 100)
+    func, calls = _counting(ResponseModel(success=True, msg="ok"))
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", func) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_idempotent_replays_a_success():
+    flight = SingleFlight(60, 100)
+    func, calls = _counting(ResponseModel(success=True, msg="ok"))
+
+    async def main():
+        first = await flight.idempotent("create-user", "k1", func)
+        second = await flight.idempotent("create-user", "k1", func)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert len(calls) == 1
+    assert second is first
+
+
+def test_idempotent_retries_after_a_failure():
+    flight = SingleFlight(60, 100)
+    func, calls = _counting(
+        ResponseModel(success=False, msg="OpenVPN down"),
+        RuntimeError("lock timeout"),
+        ResponseModel(success=True, msg="ok"),
+    )
+
+    async def main():
+        first = await flight.idempotent("create-user", "k1", func)
+        try:
+            await flight.idempotent("create-user", "k1", func)
+        except RuntimeError:
+            pass
+        third = await flight.idempotent("create-user", "k1", func)
+        fourth = await flight.idempotent("create-user", "k1", func)
+        return first, third, fourth
+
+    first, third, fourth = asyncio.run(main())
+    assert not first.success
+    assert third.success and fourth is third
+    assert len(calls) == 3
+
+
+def test_idempotent_results_expire_after_the_window():
+    flight = SingleFlight(0, 100)
+    func, calls = _counting(ResponseModel(success=True, msg="ok"))
+
+    async def main():
+        await flight.idempotent("create-user", "k1", func)
+        await flight.idempotent("create-user", "k1", func)
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_accept_resubmits_a_failed_job_for_the_same_key():
+    outcomes = [False, True]
+
+    async def operation(job):
+        return ResponseModel(success=outcomes.pop(0), msg="")
+
+    def job_id(response) -> str:
+        return response.body.decode().split('"job_id":"')[1].split('"')[0]
+
+    async def main():
+        await job_manager.start()
+        try:
+            first = job_id(_accept("t", operation, PRIORITY_USER, idempotency_key="k"))
+            await _finished(first)
+            second = job_id(_accept("t", operation, PRIORITY_USER, idempotency_key="k"))
+            await _finished(second)
+            third = job_id(_accept("t", operation, PRIORITY_USER, idempotency_key="k"))
+            return first, second, third
+        finally:
+            await job_manager.stop()
+
+    first, second, third = asyncio.run(main())
+    assert second != first
+    assert third == second
+
+
+async def _finished(job_id: str) -> None:
+    while job_manager.get(job_id).finished_at is None:
+        await asyncio.sleep(0.01)
@@ -0,0 +1,25 @@
+import asyncio
+
+from core.service.tracing import StackSampler, recent_spans, span
+
+
+def test_profile_runs_on_its_own_thread_one_at_a_time():
+    sampler = StackSampler(0.001)
+
+    async def main():
+        return await asyncio.gather(sampler.run(0.1), sampler.run(0.1))
+
+    first, second = asyncio.run(main())
+    assert first["samples"] > 0
+    assert second is None
+    assert any(stack.startswith("MainThread;") for stack in first["folded"])
+
+
+def test_nested_spans_share_the_trace():
+    with span("outer"):
+        with span("inner"):
+            pass
+
+    outer, inner = recent_spans(limit=2)
+    assert (inner["name"], outer["name"]) == ("inner", "outer")
+    assert inner["trace_id"] == outer["trace_id"]
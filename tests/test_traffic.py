@@ -0,0 +1,92 @@
+import json
+import os
+
+from core.service.traffic import Tier, TrafficAccounting
+
+
+def _traffic(path) -> TrafficAccounting:
+    return TrafficAccounting(str(path), 60, [Tier("1m", 60, 5), Tier("1h", 3600, 3)])
+
+
+def _session(name: str, received: int, sent: int) -> dict:
+    return {
+        "common_name": name,
+        "bytes_received": received,
+        "bytes_sent": sent,
+        "connected_since": 1700000000,
+        "instance": 0,
+    }
+
+
+def _used(traffic: TrafficAccounting, name: str) -> tuple[int, int]:
+    usage = traffic.usage(name)
+    return usage["bytes_received"], usage["bytes_sent"]
+
+
+def test_history_and_session_baselines_survive_a_restart(tmp_path):
+    traffic = _traffic(tmp_path)
+    traffic.sample([_session("alice", 100, 10), _session("bob", 5, 50)])
+    traffic.save()
+
+    restored = _traffic(tmp_path)
+    restored.load()
+    assert _used(restored, "alice") == (100, 10)
+    assert _used(restored, "bob") == (5, 50)
+    # A session that outlived the restart is not counted twice
+    restored.sample([_session("alice", 150, 20)])
+    assert _used(restored, "alice") == (150, 20)
+
+
+def test_each_save_replaces_the_previous_one_whole(tmp_path):
+    traffic = _traffic(tmp_path)
+    traffic.sample([_session("alice", 100, 10)])
+    traffic.save()
+    traffic.sample([_session("alice", 300, 30), _session("bob", 1, 1)])
+    traffic.save()
+
+    with open(tmp_path / "index.json") as f:
+        assert json.load(f)["generation"] == 2
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["index.json"]
+        + [
+            f"{tier}.2.{c}"
+            for tier in ("1m", "1h")
+            for c in ("buckets", "received", "sent")
+        ]
+    )
+
+
+def test_an_interrupted_save_leaves_the_last_complete_one(tmp_path):
+    traffic = _traffic(tmp_path)
+    traffic.sample([_session("alice", 100, 10)])
+    traffic.save()
+    # Tier files of the next generation were written, index.json was not
+    for name in os.listdir(tmp_path):
+        if name.startswith("1m.1."):
+            (tmp_path / name.replace(".1.", ".2.")).write_bytes(b"\xff" * 8)
+
+    restored = _traffic(tmp_path)
+    restored.load()
+    assert _used(restored, "alice") == (100, 10)
+    restored.save()
+    assert not any(".1." in name for name in os.listdir(tmp_path))
+
+
+def test_saves_without_generations_still_load(tmp_path):
+    traffic = _traffic(tmp_path)
+    traffic.sample([_session("alice", 100, 10)])
+    traffic.save()
+    with open(tmp_path / "index.json") as f:
+        meta = json.load(f)
+    del meta["generation"]
+    with open(tmp_path / "index.json", "w") as f:
+        json.dump(meta, f)
+    for name in os.listdir(tmp_path):
+        os.rename(tmp_path / name, tmp_path / name.replace(".1.", "."))
+
+    restored = _traffic(tmp_path)
+    restored.load()
+    assert _used(restored, "alice") == (100, 10)
+    restored.save()
+    assert "1m.buckets" not in os.listdir(tmp_path)
+    assert "1m.1.buckets" in os.listdir(tmp_path)